@@ -0,0 +1,96 @@
+import datetime
+import hmac
+import logging
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from .database import get_db
+from .utils import create_response
+from .config import settings
+from . import llm_usage, reply_templates, exports, rollups, archive
+
+logger = logging.getLogger("consulting_bot.admin")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """
+    Admin endpoints need the X-Admin-Token header. Without ADMIN_TOKEN they
+    are disabled, unless ADMIN_OPEN=true opts in for local development.
+    """
+    if not settings.ADMIN_TOKEN:
+        if settings.ADMIN_OPEN and settings.DEPLOYMENT_MODE != "PROD":
+            return
+        raise HTTPException(status_code=403, detail="Admin endpoints disabled: ADMIN_TOKEN not set")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+@router.get("/llm-usage", tags=["Admin"])
+def llm_usage_report(hours: int = 24, db: Session = Depends(get_db)):
+    """
+    Gemini usage: live totals over the rolling window (by flow, model, tool
+    and top visitors) and hourly rollups for the last `hours`.
+    """
+    llm_usage.flush()
+    return create_response(success=True, data={
+        "live": llm_usage.snapshot(),
+        "hourly": llm_usage.get_rollups(db, max(1, min(hours, 24 * 31))),
+    })
+
+@router.delete("/reply-templates", tags=["Admin"])
+def clear_reply_templates(kind: Optional[str] = None, name: Optional[str] = None):
+    """Discards cached /trigger and /context templates (optionally one kind or name) so they are regenerated."""
+    count = reply_templates.invalidate(kind, name)
+    return create_response(success=True, data={"deleted": count})
+
+@router.get("/export/{table}", tags=["Admin"])
+def export_table(
+    table: str,
+    format: str = "csv",
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    status: Optional[List[str]] = Query(None),
+    date_field: Optional[str] = None,
+    gzip: bool = False,
+    archived: bool = False,
+):
+    """
+    Streams bookings, payments or users as CSV or NDJSON, optionally gzipped.
+    start/end filter on created_at (or date_field, e.g. start_time for bookings); status may repeat.
+    archived=true reads the archive database instead of the live tables.
+    """
+    try:
+        exports.validate(table, format, status, date_field, archived)
+    except ValueError as e:
+        return create_response(success=False, error=str(e))
+    logger.info(f"Export of {table} requested", extra={"format": format, "gzip": gzip})
+    media_type = "application/gzip" if gzip else exports.FORMATS[format]
+    return StreamingResponse(
+        exports.stream_export(table, format, gzip, archived, start=start, end=end, status=status, date_field=date_field),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{exports.filename(table, format, gzip)}"'},
+    )
+
+@router.get("/reports/daily", tags=["Admin"])
+def daily_report(start: Optional[datetime.date] = None, end: Optional[datetime.date] = None, db: Session = Depends(get_db)):
+    """Bookings per day, cancellation rate, paid conversion and revenue by currency (default: last 30 days)."""
+    end = end or datetime.datetime.utcnow().date()
+    start = start or end - datetime.timedelta(days=29)
+    if start > end:
+        return create_response(success=False, error="start must not be after end")
+    return create_response(success=True, data=rollups.daily_report(db, start, end))
+
+@router.post("/reports/backfill", tags=["Admin"])
+def backfill_rollups(since: Optional[datetime.date] = None, db: Session = Depends(get_db)):
+    """Recomputes the daily rollups from bookings and payments (all history, or from `since`)."""
+    rows = rollups.backfill(db, since)
+    return create_response(success=True, data={"rows": rows})
+
+@router.post("/archive/run", tags=["Admin"])
+def run_archive(retention_days: Optional[int] = None):
+    """Moves bookings that ended more than retention_days ago (default ARCHIVE_RETENTION_DAYS), with their payments, to the archive."""
+    result = archive.run_archive(retention_days)
+    if result["error"]:
+        return create_response(success=False, error="Archival failed", details=result)
+    return create_response(success=True, data=result)
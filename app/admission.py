@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from .utils import create_response
+from .config import settings
+from . import deadline
+
+logger = logging.getLogger("consulting_bot.admission")
+
+# Longest prefix wins; anything unmatched is a cheap read or webhook and is never queued
+ROUTE_CLASSES = [
+    ("/chat", "llm"),
+    ("/trigger", "llm"),
+    ("/context", "llm"),
+    ("/salesiq/actions", "calendar"),
+    ("/slots/", "calendar"),
+    ("/appointment/list", None),
+    ("/appointment/", "calendar"),
+    ("/payment/webhook", None),
+    ("/payment/", "payment"),
+]
+
+LLM_FALLBACK = "We're handling a lot of conversations right now. Please try again in a moment."
+
+def _parse(raw: str, cast=float):
+    values = {}
+    for pair in (raw or "").split(","):
+        if "=" in pair:
+            key, value = pair.split("=", 1)
+            try:
+                values[key.strip()] = cast(value)
+            except ValueError:
+                continue
+    return values
+
+def classify(path: str):
+    best = None
+    for prefix, klass in ROUTE_CLASSES:
+        if path.startswith(prefix) and (best is None or len(prefix) > len(best[0])):
+            best = (prefix, klass)
+    return best[1] if best else None
+
+class AdaptiveLimit:
+    """
+    Concurrency limit for one endpoint class with a bounded FIFO wait queue.
+
+    AIMD: each completion under the target latency grows the limit by 1/limit,
+    a slow or failed completion shrinks it by 20%. When a backend such as
+    Gemini slows down, its class quickly holds fewer workers and the rest of
+    the app keeps its share of the threadpool.
+    """
+
+    def __init__(self, name: str, initial: int, maximum: int, target_latency: float, queue_timeout: float, max_queue: int):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = 1.0
+        self.max_limit = float(maximum)
+        self.target_latency = target_latency
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.inflight = 0
+        self.ewma_latency = None
+        self._waiters = deque()
+        self.stats = {"admitted": 0, "shed_queue_full": 0, "shed_deadline": 0, "shed_timeout": 0}
+
+    def _has_capacity(self):
+        return self.inflight < int(self.limit)
+
+    def _expected_wait(self, position: int) -> float:
+        if not self.ewma_latency:
+            return 0.0
+        return self.ewma_latency * (position + 1) / max(1, int(self.limit))
+
+    async def acquire(self, budget: float = None) -> str:
+        """Returns None when admitted, otherwise the reason the request was shed."""
+        if self._has_capacity() and not self._waiters:
+            self.inflight += 1
+            self.stats["admitted"] += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            self.stats["shed_queue_full"] += 1
+            return "queue_full"
+        timeout = self.queue_timeout if budget is None else min(self.queue_timeout, budget)
+        if self._expected_wait(len(self._waiters)) > timeout:
+            # Would not get a slot before the caller gives up: shed now instead of queuing
+            self.stats["shed_deadline"] += 1
+            return "deadline"
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await asyncio.wait_for(fut, timeout=timeout)
+        except asyncio.TimeoutError:
+            self.stats["shed_timeout"] += 1
+            return "timeout"
+        finally:
+            if fut in self._waiters:
+                self._waiters.remove(fut)
+        self.stats["admitted"] += 1
+        return None
+
+    def release(self, latency: float, ok: bool):
+        self.inflight -= 1
+        self.ewma_latency = latency if self.ewma_latency is None else 0.8 * self.ewma_latency + 0.2 * latency
+        if not ok or latency > self.target_latency:
+            self.limit = max(self.min_limit, self.limit * 0.8)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._has_capacity():
+            fut = self._waiters.popleft()
+            if not fut.done():
+                # Hand the slot straight to the waiter
+                self.inflight += 1
+                fut.set_result(True)
+
+    def snapshot(self):
+        return dict(
+            self.stats,
+            limit=round(self.limit, 2),
+            inflight=self.inflight,
+            queued=len(self._waiters),
+            ewma_latency_ms=round(self.ewma_latency * 1000, 1) if self.ewma_latency else None,
+        )
+
+def _build_limits():
+    limits = {}
+    targets = _parse(settings.ADMISSION_TARGET_LATENCY)
+    timeouts = _parse(settings.ADMISSION_QUEUE_TIMEOUT)
+    for name, spec in _parse(settings.ADMISSION_LIMITS, str).items():
+        try:
+            initial, maximum = (int(v) for v in spec.split("/", 1))
+        except ValueError:
+            continue
+        limits[name] = AdaptiveLimit(name, initial, maximum, targets.get(name, 5.0), timeouts.get(name, 1.0), settings.ADMISSION_MAX_QUEUE)
+    return limits
+
+limits = _build_limits()
+
+def shed_response(klass: str, path: str):
+    """Quick fallback in the create_response envelope."""
+    if klass == "llm":
+        key = "response" if path.startswith("/chat") else "reply"
+        return create_response(success=True, data={key: LLM_FALLBACK, "degraded": True})
+    return create_response(success=False, error="Service busy, please retry shortly", details={"retryable": True})
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits requests per endpoint class before they reach
+    the router (and the threadpool). Shed requests get an immediate HTTP 200
+    envelope so SalesIQ shows a reply instead of timing out.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.ADMISSION_ENABLED:
+            return await self.app(scope, receive, send)
+        path = scope.get("path", "")
+        klass = classify(path)
+        limit = limits.get(klass) if klass else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        # The deadline was set by the request logging middleware further out
+        reason = await limit.acquire(deadline.remaining())
+        if reason:
+            logger.warning(f"Shed {path} ({klass}): {reason}")
+            return await _send_json(send, shed_response(klass, path))
+
+        start = time.perf_counter()
+        ok = True
+        status = {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            ok = False
+            raise
+        finally:
+            ok = ok and status.get("code", 500) < 500
+            limit.release(time.perf_counter() - start, ok)
+
+async def _send_json(send, payload: dict):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+def get_metrics():
+    return {name: limit.snapshot() for name, limit in limits.items()}
@@ -0,0 +1,132 @@
+import asyncio
+import datetime
+import logging
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from .database import SessionLocal, ArchiveSessionLocal, engine
+from .models import Booking, Payment, ReminderLog, ArchivedBooking, ArchivedPayment
+from .config import settings
+from . import data_version
+
+logger = logging.getLogger("consulting_bot.archive")
+
+_stats = {"runs": 0, "bookings": 0, "payments": 0, "last_run": None, "last_error": None}
+
+def _copy(row, archived_model, archived_at: datetime.datetime):
+    columns = archived_model.__table__.columns
+    values = {c.name: getattr(row, c.name) for c in row.__table__.columns if c.name in columns}
+    return archived_model(archived_at=archived_at, **values)
+
+def _archive_batch(cutoff: datetime.datetime, batch_size: int):
+    """
+    Moves one batch of bookings that ended before cutoff, with their payments.
+    The archive commit comes first and merge() keeps it idempotent: if the hot
+    delete then fails, the next run copies the same rows again and deletes them.
+    Returns (bookings moved, payments moved).
+    """
+    hot = SessionLocal()
+    cold = ArchiveSessionLocal()
+    try:
+        bookings = hot.query(Booking).filter(Booking.end_time < cutoff).order_by(Booking.id).limit(batch_size).all()
+        if not bookings:
+            return 0, 0
+        ids = [b.id for b in bookings]
+        payments = hot.query(Payment).filter(Payment.booking_id.in_(ids)).all()
+
+        now = datetime.datetime.utcnow()
+        for b in bookings:
+            cold.merge(_copy(b, ArchivedBooking, now))
+        for p in payments:
+            cold.merge(_copy(p, ArchivedPayment, now))
+        cold.commit()
+
+        hot.query(Payment).filter(Payment.id.in_([p.id for p in payments])).delete(synchronize_session=False)
+        hot.query(ReminderLog).filter(ReminderLog.booking_id.in_(ids)).delete(synchronize_session=False)
+        hot.query(Booking).filter(Booking.id.in_(ids)).delete(synchronize_session=False)
+        data_version.bump(hot, data_version.BOOKINGS)
+        hot.commit()
+        return len(bookings), len(payments)
+    except Exception:
+        hot.rollback()
+        cold.rollback()
+        raise
+    finally:
+        hot.close()
+        cold.close()
+
+def run_archive(retention_days: int = None, batch_size: int = None):
+    """Archives everything past the retention window, one batch per transaction. Returns a summary dict."""
+    retention_days = retention_days if retention_days is not None else settings.ARCHIVE_RETENTION_DAYS
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=retention_days)
+    moved_bookings = moved_payments = 0
+    try:
+        while True:
+            b, p = _archive_batch(cutoff, batch_size)
+            moved_bookings += b
+            moved_payments += p
+            if b < batch_size:
+                break
+        if moved_bookings and settings.ARCHIVE_VACUUM and engine.dialect.name == "sqlite":
+            # Deleted pages are only returned to the OS by VACUUM, which needs autocommit
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("VACUUM"))
+        _stats["last_error"] = None
+    except Exception as e:
+        _stats["last_error"] = str(e)
+        logger.error(f"Archival failed: {e}")
+    _stats["runs"] += 1
+    _stats["bookings"] += moved_bookings
+    _stats["payments"] += moved_payments
+    _stats["last_run"] = datetime.datetime.utcnow().isoformat()
+    if moved_bookings:
+        logger.info(f"Archived {moved_bookings} bookings and {moved_payments} payments older than {cutoff.date()}")
+    return {"cutoff": cutoff.isoformat(), "bookings": moved_bookings, "payments": moved_payments, "error": _stats["last_error"]}
+
+async def run_archive_loop(interval: float = None):
+    """Periodic archival, started from the app lifespan."""
+    interval = interval or settings.ARCHIVE_INTERVAL
+    while True:
+        await asyncio.to_thread(run_archive)
+        await asyncio.sleep(interval)
+
+def get_metrics():
+    return dict(_stats)
+
+# Reads that need history: the hot table first, then the archive
+
+def list_user_bookings(db: Session, user_email: str):
+    """All bookings of a user, hot and archived, as (booking, archived) pairs ordered by start time."""
+    hot = db.query(Booking).filter(Booking.user_email == user_email).all()
+    cold = ArchiveSessionLocal()
+    try:
+        seen = {b.id for b in hot}
+        # A row may briefly exist in both places mid-archival; the hot copy wins
+        archived = [b for b in cold.query(ArchivedBooking).filter(ArchivedBooking.user_email == user_email).all() if b.id not in seen]
+    finally:
+        cold.close()
+    pairs = [(b, False) for b in hot] + [(b, True) for b in archived]
+    return sorted(pairs, key=lambda pair: pair[0].start_time or datetime.datetime.min)
+
+def is_archived_booking(booking_id: int) -> bool:
+    cold = ArchiveSessionLocal()
+    try:
+        return cold.query(ArchivedBooking.id).filter(ArchivedBooking.id == booking_id).first() is not None
+    finally:
+        cold.close()
+
+def archived_booking_ids(booking_ids: list) -> set:
+    if not booking_ids:
+        return set()
+    cold = ArchiveSessionLocal()
+    try:
+        return {row[0] for row in cold.query(ArchivedBooking.id).filter(ArchivedBooking.id.in_(booking_ids)).all()}
+    finally:
+        cold.close()
+
+def find_archived_payment(order_id: str):
+    cold = ArchiveSessionLocal()
+    try:
+        return cold.query(ArchivedPayment).filter(ArchivedPayment.order_id == order_id).first()
+    finally:
+        cold.close()
@@ -2,6 +2,9 @@ import os
 from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
+from googleapiclient.discovery import build, build_from_document
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 from sqlalchemy.orm import Session
 from .models import OAuthToken
 from .database import get_db
@@ -17,9 +20,17 @@ SCOPES = [
 ]
 
 from .config import settings
+from . import deadline
 
 # ... (imports)
 
+class _DeadlineRequest(Request):
+    """Token refresh transport bounded by the current request deadline."""
+
+    def __call__(self, *args, **kwargs):
+        kwargs["timeout"] = deadline.timeout()
+        return super().__call__(*args, **kwargs)
+
 def get_google_flow(redirect_uri=None):
     """
     Creates a Google OAuth Flow instance.
@@ -79,7 +90,7 @@ def get_credentials(db: Session, user_email: str = None):
         )
 
     if creds and creds.expired and creds.refresh_token:
-        creds.refresh(Request())
+        creds.refresh(_DeadlineRequest())
         # Update DB if we have a record
         if token_record:
             token_record.access_token = creds.token
@@ -106,3 +117,26 @@ def save_credentials(db: Session, creds, user_email: str = "admin@example.com"):
     token_record.expiry = creds.expiry
     
     db.commit()
+
+_discovery_docs = {}
+
+def build_google_service(api: str, version: str, creds):
+    """
+    Builds a Google API client, parsing the discovery document only once per process.
+    Socket operations time out with the remaining request budget.
+    """
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=deadline.timeout()))
+    key = (api, version)
+    doc = _discovery_docs.get(key)
+    if doc is None:
+        try:
+            from googleapiclient.discovery_cache import get_static_doc
+            raw = get_static_doc(api, version)
+        except Exception:
+            raw = None
+        if not raw:
+            # Older client libraries: fall back to the regular discovery path
+            return build(api, version, http=http)
+        doc = json.loads(raw)
+        _discovery_docs[key] = doc
+    return build_from_document(doc, http=http)
@@ -0,0 +1,249 @@
+import asyncio
+import bisect
+import datetime
+import logging
+import threading
+import time
+import hashlib
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import CalendarEvent
+from .config import settings
+
+logger = logging.getLogger("consulting_bot.availability")
+
+SLOT_MINUTES = 30
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Callbacks run after single events change in the index: listener(calendar_id, windows),
+# windows being the (start, end) epoch-minute intervals whose free time may have changed
+change_listeners = []
+
+def _notify_change(calendar_id: str, windows: list):
+    for listener in change_listeners:
+        try:
+            listener(calendar_id, windows)
+        except Exception as e:
+            logger.warning(f"Availability listener {getattr(listener, '__name__', listener)} failed: {e}")
+
+def _merge_windows(windows) -> list:
+    merged = []
+    for lo, hi in sorted(windows):
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+def from_minute(minute: int) -> datetime.datetime:
+    """Inverse of to_minute, as an aware UTC datetime."""
+    return (EPOCH + datetime.timedelta(minutes=minute)).replace(tzinfo=datetime.timezone.utc)
+
+def to_minute(dt: datetime.datetime) -> int:
+    """Epoch minute of a datetime; naive values are taken as UTC."""
+    if dt.tzinfo:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return int((dt - EPOCH).total_seconds() // 60)
+
+class AvailabilityIndex:
+    """
+    In-memory free time per calendar over the booking horizon.
+
+    Busy intervals are kept per event id so single events can be added, moved
+    or removed; the merged free ranges are stored as two sorted arrays of
+    epoch minutes (starts, ends), so a window lookup is a bisect plus a scan of
+    the ranges it overlaps.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = {} # calendar_id -> {event_id: (start_minute, end_minute)}
+        self._free = {} # calendar_id -> (starts, ends)
+        self.horizon_start = None
+        self.horizon_end = None
+        self.built_at = None
+        self.generation = 0 # Bumped when the contents change
+        self._digests = {} # calendar_id -> hash of its free ranges, for ETags
+
+    def _recompute(self, calendar_id: str):
+        busy = sorted(
+            (max(s, self.horizon_start), min(e, self.horizon_end))
+            for s, e in self._events.get(calendar_id, {}).values()
+            if e > self.horizon_start and s < self.horizon_end
+        )
+        starts, ends = [], []
+        cursor = self.horizon_start
+        for s, e in busy:
+            if s > cursor:
+                starts.append(cursor)
+                ends.append(s)
+            cursor = max(cursor, e)
+        if cursor < self.horizon_end:
+            starts.append(cursor)
+            ends.append(self.horizon_end)
+        self._free[calendar_id] = (starts, ends)
+        self._digests[calendar_id] = hashlib.sha1(repr((starts, ends)).encode("ascii")).hexdigest()[:16]
+
+    def rebuild(self, events_by_calendar: dict, horizon_start: int, horizon_end: int):
+        """
+        Replaces the whole index. events_by_calendar: {calendar_id: {event_id: (start_min, end_min)}}.
+        Busy intervals that appeared or vanished (e.g. deletions missed during a
+        full resync) are reported to change_listeners like single-event changes.
+        """
+        with self._lock:
+            previous = self._events if self.built_at is not None else None
+            unchanged = (
+                previous == events_by_calendar
+                and (self.horizon_start, self.horizon_end) == (horizon_start, horizon_end)
+            )
+            self.built_at = time.monotonic()
+            if unchanged:
+                # Periodic refresh with nothing new: keep the free ranges and version
+                return
+            self.horizon_start = horizon_start
+            self.horizon_end = horizon_end
+            self._events = events_by_calendar
+            self._free = {}
+            self._digests = {}
+            for calendar_id in events_by_calendar:
+                self._recompute(calendar_id)
+            self.generation += 1
+        if previous is None:
+            return
+        for calendar_id in set(previous) | set(events_by_calendar):
+            changed = set(previous.get(calendar_id, {}).values()) ^ set(events_by_calendar.get(calendar_id, {}).values())
+            if changed:
+                _notify_change(calendar_id, _merge_windows(changed))
+
+    def set_event(self, calendar_id: str, event_id: str, start: datetime.datetime, end: datetime.datetime):
+        if self.built_at is None or not event_id or start is None or end is None:
+            return
+        interval = (to_minute(start), to_minute(end))
+        with self._lock:
+            previous = self._events.setdefault(calendar_id, {}).get(event_id)
+            if previous == interval:
+                return
+            self._events[calendar_id][event_id] = interval
+            self._recompute(calendar_id)
+            self.generation += 1
+        _notify_change(calendar_id, [w for w in (previous, interval) if w])
+
+    def remove_event(self, calendar_id: str, event_id: str):
+        if self.built_at is None:
+            return
+        with self._lock:
+            previous = self._events.get(calendar_id, {}).pop(event_id, None)
+            if previous is None:
+                return
+            self._recompute(calendar_id)
+            self.generation += 1
+        _notify_change(calendar_id, [previous])
+
+    def is_usable(self) -> bool:
+        return self.built_at is not None and time.monotonic() - self.built_at <= settings.AVAILABILITY_MAX_AGE
+
+    def covers(self, start: datetime.datetime, end: datetime.datetime) -> bool:
+        """Whether free_slots can answer this window from the index."""
+        if not self.is_usable():
+            return False
+        return self.horizon_start <= to_minute(start) and to_minute(end) <= self.horizon_end
+
+    def version(self, calendar_id: str = "primary") -> str:
+        """
+        Content hash of a calendar's free ranges (horizon included). Equal
+        contents give equal versions across refreshes, restarts and workers.
+        """
+        with self._lock:
+            return self._digests.get(calendar_id) or f"free:{self.horizon_start}:{self.horizon_end}"
+
+    def free_slots(self, start: datetime.datetime, end: datetime.datetime, calendar_id: str = "primary"):
+        """
+        30-minute slots stepping from start that lie fully inside free time,
+        same semantics as the freebusy-based computation. Returns None when the
+        index cannot answer (not built, stale, or window outside the horizon).
+        """
+        if not self.covers(start, end):
+            return None
+        lo, hi = to_minute(start), to_minute(end)
+        with self._lock:
+            starts, ends = self._free.get(calendar_id, ([self.horizon_start], [self.horizon_end]))
+            # First free range that ends after the window start
+            i = bisect.bisect_right(ends, lo)
+            ranges = []
+            while i < len(starts) and starts[i] < hi:
+                ranges.append((starts[i], ends[i]))
+                i += 1
+        slots = []
+        for fs, fe in ranges:
+            # Slot k covers [lo + k*30, lo + (k+1)*30); keep those inside [fs, fe) and the window
+            k = max(0, -(-(fs - lo) // SLOT_MINUTES))
+            while lo + (k + 1) * SLOT_MINUTES <= min(fe, hi):
+                slot_start = start + datetime.timedelta(minutes=k * SLOT_MINUTES)
+                slots.append({
+                    "start": slot_start.isoformat(),
+                    "end": (slot_start + datetime.timedelta(minutes=SLOT_MINUTES)).isoformat()
+                })
+                k += 1
+        return slots
+
+    def stats(self):
+        with self._lock:
+            return {
+                "built": self.built_at is not None,
+                "generation": self.generation,
+                "age_seconds": round(time.monotonic() - self.built_at, 1) if self.built_at else None,
+                "calendars": {cid: {"events": len(evts), "free_ranges": len(self._free.get(cid, ([], []))[0])} for cid, evts in self._events.items()},
+            }
+
+index = AvailabilityIndex()
+
+def _horizon():
+    today = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    end = today + datetime.timedelta(days=settings.AVAILABILITY_HORIZON_DAYS)
+    return today, end
+
+def rebuild_from_mirror(db: Session):
+    """Materializes the horizon from the local calendar mirror."""
+    start, end = _horizon()
+    rows = db.query(
+        CalendarEvent.calendar_id, CalendarEvent.event_id, CalendarEvent.start_time, CalendarEvent.end_time
+    ).filter(
+        CalendarEvent.status != 'cancelled',
+        CalendarEvent.transparency != 'transparent',
+        CalendarEvent.start_time < end,
+        CalendarEvent.end_time > start,
+    ).all()
+    events = {}
+    for calendar_id, event_id, s, e in rows:
+        events.setdefault(calendar_id, {})[event_id] = (to_minute(s), to_minute(e))
+    events.setdefault("primary", {})
+    index.rebuild(events, to_minute(start), to_minute(end))
+    return len(rows)
+
+def refresh():
+    """Rebuilds the index when the mirror is current; used by the background job."""
+    from .calendar_sync import mirror_is_fresh
+    db = SessionLocal()
+    try:
+        if not mirror_is_fresh(db):
+            return None
+        return rebuild_from_mirror(db)
+    except Exception as e:
+        logger.error(f"Availability rebuild failed: {e}")
+        return None
+    finally:
+        db.close()
+
+async def run_refresh_loop(interval: float = None):
+    """Keeps the horizon rolling forward and folds in changes made by other workers."""
+    interval = interval or settings.AVAILABILITY_REFRESH_INTERVAL
+    while True:
+        await asyncio.to_thread(refresh)
+        await asyncio.sleep(interval)
+
+def on_booking_change(action: str, booking, previous: tuple = None):
+    """bookings listener: keep the booked event's interval current without waiting for a rebuild."""
+    if action == "cancelled":
+        index.remove_event("primary", booking.event_id)
+    else:
+        index.set_event("primary", booking.event_id, booking.start_time, booking.end_time)
@@ -0,0 +1,72 @@
+import datetime
+import numpy as np
+
+SLOT_MINUTES = 30
+
+def _parse(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+class BusyBitmap:
+    """
+    Minute-granularity busy matrix for a set of calendars over one window.
+
+    Row i is calendar_ids[i]; column j is minute j after start. "Any free" and
+    "all free" across calendars are then vectorized OR/AND reductions, and
+    30-minute slots are a reshape plus an all() over each block of minutes.
+    """
+
+    def __init__(self, calendar_ids: list, start: datetime.datetime, end: datetime.datetime):
+        self.calendar_ids = list(calendar_ids)
+        self.rows = {cid: i for i, cid in enumerate(self.calendar_ids)}
+        self.start = start
+        self.end = end
+        self.minutes = max(0, int((end - start).total_seconds() // 60))
+        self.busy = np.zeros((len(self.calendar_ids), self.minutes), dtype=bool)
+
+    @classmethod
+    def from_busy(cls, busy_by_calendar: dict, start: datetime.datetime, end: datetime.datetime):
+        """
+        Builds the matrix from freebusy-shaped busy lists ({calendar_id: [{"start", "end"}]}).
+        A None list (calendar Google could not read) marks the whole row busy.
+        """
+        bitmap = cls(list(busy_by_calendar), start, end)
+        for cid, busy in busy_by_calendar.items():
+            bitmap.mark_busy(cid, busy)
+        return bitmap
+
+    def mark_busy(self, calendar_id: str, busy):
+        row = self.busy[self.rows[calendar_id]]
+        if busy is None:
+            row[:] = True
+            return
+        for b in busy:
+            lo = int((_parse(b['start']) - self.start).total_seconds() // 60)
+            # Round the end up so partially busy minutes count as busy
+            hi = -int(-(_parse(b['end']) - self.start).total_seconds() // 60)
+            lo, hi = max(lo, 0), min(hi, self.minutes)
+            if lo < hi:
+                row[lo:hi] = True
+
+    def _select(self, calendar_ids=None):
+        if calendar_ids is None:
+            return self.busy
+        return self.busy[[self.rows[cid] for cid in calendar_ids]]
+
+    def slot_matrix(self, calendar_ids=None, slot_minutes: int = SLOT_MINUTES):
+        """Boolean (calendars x slots) matrix: True where the calendar is free for the whole slot."""
+        busy = self._select(calendar_ids)
+        n_slots = self.minutes // slot_minutes
+        blocks = busy[:, :n_slots * slot_minutes].reshape(busy.shape[0], n_slots, slot_minutes)
+        return ~blocks.any(axis=2)
+
+    def any_free(self, calendar_ids=None, slot_minutes: int = SLOT_MINUTES):
+        """Per slot: at least one of the calendars is free."""
+        return self.slot_matrix(calendar_ids, slot_minutes).any(axis=0)
+
+    def all_free(self, calendar_ids=None, slot_minutes: int = SLOT_MINUTES):
+        """Per slot: every one of the calendars is free (e.g. consultant plus room)."""
+        return self.slot_matrix(calendar_ids, slot_minutes).all(axis=0)
+
+    def slot_bounds(self, index: int, slot_minutes: int = SLOT_MINUTES):
+        slot_start = self.start + datetime.timedelta(minutes=int(index) * slot_minutes)
+        return slot_start.isoformat(), (slot_start + datetime.timedelta(minutes=slot_minutes)).isoformat()
@@ -1,17 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Request, Query
 from sqlalchemy.orm import Session
 from .database import get_db
 from .models import Booking
-from .calendar_client import get_free_busy, create_event, update_event, delete_event
+from .calendar_client import get_free_busy, free_busy_version, create_event, update_event, delete_event, batch_delete_events, batch_update_events
+from .consultants import get_consultant_slots, get_consultant_email
 from .utils import create_response
+from .config import settings
+from .idempotency import run_idempotent, forget
+from . import rollups, archive, conditional, data_version
 from pydantic import BaseModel
+from typing import List, Optional
 import datetime
+import logging
 
 router = APIRouter()
 
+logger = logging.getLogger("consulting_bot.bookings")
+
+# Callbacks run after a booking is committed: listener(action, booking, previous),
+# action being "created", "updated" or "cancelled"; previous is the
+# (start_time, end_time) before an update, else None
+booking_listeners = []
+
+def notify_booking_change(action: str, booking: Booking, previous: tuple = None):
+    for listener in booking_listeners:
+        try:
+            listener(action, booking, previous)
+        except Exception as e:
+            logger.warning(f"Booking listener {getattr(listener, '__name__', listener)} failed: {e}")
+
 class SlotRequest(BaseModel):
     time_min: str
     time_max: str
+    # Specific consultant, or any_consultant=True for slots tagged with every free consultant
+    consultant_id: Optional[int] = None
+    any_consultant: bool = False
+    # Slots where all of these consultants/resources are free at once
+    all_of: Optional[List[int]] = None
 
 class BookingCreateRequest(BaseModel):
     user_email: str
@@ -19,6 +44,9 @@ class BookingCreateRequest(BaseModel):
     end_time: str
     summary: str = "Consulting Session"
     description: str = ""
+    consultant_id: Optional[int] = None # Invited to the event when set
+    # Client supplied, e.g. "<salesiq visitor id>:<slot start>"; the Idempotency-Key header also works
+    idempotency_key: Optional[str] = None
 
 class BookingUpdateRequest(BaseModel):
     booking_id: int
@@ -28,12 +56,97 @@ class BookingUpdateRequest(BaseModel):
 class BookingCancelRequest(BaseModel):
     booking_id: int
 
-@router.post("/slots/get", tags=["Slots"])
-def get_slots(request: SlotRequest, db: Session = Depends(get_db)):
+class BulkCancelRequest(BaseModel):
+    booking_ids: List[int]
+
+class BulkUpdateRequest(BaseModel):
+    updates: List[BookingUpdateRequest]
+
+def get_slots(request: SlotRequest, db: Session):
+    if request.consultant_id is not None or request.any_consultant or request.all_of:
+        return get_consultant_slots(db, request.time_min, request.time_max, request.consultant_id, request.all_of)
     return get_free_busy(db, request.time_min, request.time_max)
 
+def _slots_version(request: SlotRequest, db: Session):
+    # Consultant slots combine several live calendars; only primary availability is versioned
+    if request.consultant_id is not None or request.any_consultant or request.all_of:
+        return None
+    try:
+        version = free_busy_version(db, request.time_min, request.time_max)
+    except ValueError:
+        return None
+    return f"slots:{version}:{request.time_min}:{request.time_max}" if version else None
+
+@router.post("/slots/get", tags=["Slots"])
+def get_slots_endpoint(request: SlotRequest, http_request: Request, db: Session = Depends(get_db)):
+    return conditional.respond(http_request, _slots_version(request, db), lambda: get_slots(request, db))
+
+@router.get("/slots/get", tags=["Slots"])
+def get_slots_conditional(
+    http_request: Request,
+    time_min: str,
+    time_max: str,
+    consultant_id: Optional[int] = None,
+    any_consultant: bool = False,
+    all_of: Optional[List[int]] = Query(None),
+    db: Session = Depends(get_db),
+):
+    """GET form for browsers: send the ETag back as If-None-Match to get 304 while availability is unchanged."""
+    request = SlotRequest(time_min=time_min, time_max=time_max, consultant_id=consultant_id, any_consultant=any_consultant, all_of=all_of)
+    return conditional.respond(http_request, _slots_version(request, db), lambda: get_slots(request, db))
+
+def _slot_stamp(value) -> str:
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if value.tzinfo:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
+
+def slot_idempotency_key(user_email: str, start_time, end_time) -> str:
+    """Default key when the caller sends none: one booking per user and slot."""
+    return f"{user_email.strip().lower()}|{_slot_stamp(start_time)}|{_slot_stamp(end_time)}"
+
+def create_appointment_once(request: BookingCreateRequest, db: Session, idempotency_key: Optional[str] = None):
+    key = idempotency_key or request.idempotency_key
+    if key:
+        return run_idempotent("appointment.create", key, request.dict(exclude={"idempotency_key"}), lambda: _create_appointment(request, db))
+    try:
+        key = slot_idempotency_key(request.user_email, request.start_time, request.end_time)
+    except ValueError:
+        return _create_appointment(request, db)
+    # Derived keys fingerprint the slot only, so a retry with other details still replays
+    return run_idempotent(
+        "appointment.create", key, {"slot": key}, lambda: _create_appointment(request, db),
+        ttl_seconds=settings.IDEMPOTENCY_DERIVED_TTL_SECONDS,
+    )
+
 @router.post("/appointment/create", tags=["Appointments"])
-def create_appointment(request: BookingCreateRequest, db: Session = Depends(get_db)):
+def create_appointment(request: BookingCreateRequest, db: Session = Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    return create_appointment_once(request, db, idempotency_key)
+
+def release_slot_key(action: str, booking: Booking, previous: tuple = None):
+    """
+    bookings listener: a slot the booking no longer holds (cancelled, or moved
+    away from) can be booked again by the same user within the derived-key TTL.
+    """
+    if action == "cancelled":
+        start, end = booking.start_time, booking.end_time
+    elif action == "updated" and previous:
+        start, end = previous
+    else:
+        return
+    if not booking.user_email or start is None or end is None:
+        return
+    forget("appointment.create", slot_idempotency_key(booking.user_email, start, end))
+
+def _create_appointment(request: BookingCreateRequest, db: Session):
+    attendees = [request.user_email]
+    if request.consultant_id is not None:
+        consultant_email = get_consultant_email(db, request.consultant_id)
+        if not consultant_email:
+            return create_response(success=False, error="Consultant not found")
+        attendees.append(consultant_email)
+
     # Create Google Calendar Event
     cal_response = create_event(
         db, 
@@ -41,7 +154,7 @@ def create_appointment(request: BookingCreateRequest, db: Session = Depends(get_
         start_time=request.start_time, 
         end_time=request.end_time, 
         description=request.description,
-        attendees=[request.user_email]
+        attendees=attendees
     )
     
     if not cal_response.get("success"):
@@ -57,30 +170,38 @@ def create_appointment(request: BookingCreateRequest, db: Session = Depends(get_
         status="confirmed"
     )
     db.add(new_booking)
+    rollups.booking_status_changed(db, new_booking)
     db.commit()
     db.refresh(new_booking)
+    notify_booking_change("created", new_booking)
     
     return create_response(success=True, data={"booking_id": new_booking.id, "event_id": event_id}, message="Appointment created successfully")
 
-@router.post("/appointment/list", tags=["Appointments"])
-def list_appointments(user_email: str, db: Session = Depends(get_db)):
-    bookings = db.query(Booking).filter(Booking.user_email == user_email).all()
+def list_appointments(user_email: str, db: Session):
     data = []
-    for b in bookings:
+    for b, archived in archive.list_user_bookings(db, user_email):
         data.append({
             "id": b.id,
             "event_id": b.event_id,
             "start": b.start_time.isoformat(),
             "end": b.end_time.isoformat(),
-            "status": b.status
+            "status": b.status,
+            "archived": archived
         })
     return create_response(success=True, data={"appointments": data})
 
+@router.post("/appointment/list", tags=["Appointments"])
+@router.get("/appointment/list", tags=["Appointments"])
+def list_appointments_endpoint(user_email: str, http_request: Request, db: Session = Depends(get_db)):
+    """POST for Deluge; GET for browsers, which revalidate with If-None-Match (the tag changes with any booking change)."""
+    version = data_version.get(db, data_version.BOOKINGS)[data_version.BOOKINGS]
+    return conditional.respond(http_request, f"appointments:{version}:{user_email}", lambda: list_appointments(user_email, db))
+
 @router.post("/appointment/update", tags=["Appointments"])
 def update_appointment(request: BookingUpdateRequest, db: Session = Depends(get_db)):
     booking = db.query(Booking).filter(Booking.id == request.booking_id).first()
     if not booking:
-        return create_response(success=False, error="Booking not found")
+        return create_response(success=False, error=_missing_error(request.booking_id))
     
     # Update Google Calendar
     cal_response = update_event(db, booking.event_id, request.new_start_time, request.new_end_time)
@@ -88,9 +209,11 @@ def update_appointment(request: BookingUpdateRequest, db: Session = Depends(get_
         return create_response(success=False, error=cal_response.get("error", "Calendar Update Error"))
     
     # Update DB
+    previous = (booking.start_time, booking.end_time)
     booking.start_time = datetime.datetime.fromisoformat(request.new_start_time.replace('Z', '+00:00'))
     booking.end_time = datetime.datetime.fromisoformat(request.new_end_time.replace('Z', '+00:00'))
     db.commit()
+    notify_booking_change("updated", booking, previous)
     
     return create_response(success=True, data={"booking_id": booking.id}, message="Booking updated successfully")
 
@@ -98,7 +221,7 @@ def update_appointment(request: BookingUpdateRequest, db: Session = Depends(get_
 def cancel_appointment(request: BookingCancelRequest, db: Session = Depends(get_db)):
     booking = db.query(Booking).filter(Booking.id == request.booking_id).first()
     if not booking:
-        return create_response(success=False, error="Booking not found")
+        return create_response(success=False, error=_missing_error(request.booking_id))
     
     # Delete from Google Calendar
     cal_response = delete_event(db, booking.event_id)
@@ -106,7 +229,104 @@ def cancel_appointment(request: BookingCancelRequest, db: Session = Depends(get_
         return create_response(success=False, error=cal_response.get("error", "Calendar Delete Error"))
     
     # Update DB status
+    old_status = booking.status
     booking.status = "cancelled"
+    rollups.booking_status_changed(db, booking, old_status)
     db.commit()
+    notify_booking_change("cancelled", booking)
     
     return create_response(success=True, data={"booking_id": booking.id}, message="Booking cancelled successfully")
+
+def _missing_error(booking_id: int) -> str:
+    if archive.is_archived_booking(booking_id):
+        return "Booking is archived and can no longer be changed"
+    return "Booking not found"
+
+def _load_bookings(db: Session, booking_ids: list):
+    bookings = db.query(Booking).filter(Booking.id.in_(booking_ids)).all()
+    return {b.id: b for b in bookings}
+
+def _missing_results(booking_ids, bookings: dict):
+    missing = [bid for bid in booking_ids if bid not in bookings]
+    archived = archive.archived_booking_ids(missing)
+    return {
+        bid: {"booking_id": bid, "success": False, "error": "Booking is archived and can no longer be changed" if bid in archived else "Booking not found"}
+        for bid in missing
+    }
+
+@router.post("/appointment/bulk-cancel", tags=["Appointments"])
+def bulk_cancel_appointments(request: BulkCancelRequest, db: Session = Depends(get_db)):
+    """
+    Cancels many bookings: calendar deletes go out as Google batch requests,
+    DB changes are committed in one transaction. Returns per-item results.
+    """
+    booking_ids = list(dict.fromkeys(request.booking_ids))
+    bookings = _load_bookings(db, booking_ids)
+    results = _missing_results(booking_ids, bookings)
+
+    targets = [b for b in bookings.values() if b.status != "cancelled"]
+    for b in bookings.values():
+        if b.status == "cancelled":
+            results[b.id] = {"booking_id": b.id, "success": True, "message": "Already cancelled"}
+
+    if targets:
+        outcome = batch_delete_events(db, list({b.event_id for b in targets}))
+        if outcome is None:
+            return create_response(success=False, error="Authentication failed")
+        cancelled = []
+        for b in targets:
+            error = outcome.get(b.event_id, "No response from calendar")
+            if error:
+                results[b.id] = {"booking_id": b.id, "success": False, "error": error}
+                continue
+            old_status = b.status
+            b.status = "cancelled"
+            rollups.booking_status_changed(db, b, old_status)
+            cancelled.append(b)
+            results[b.id] = {"booking_id": b.id, "success": True}
+        db.commit()
+        for b in cancelled:
+            notify_booking_change("cancelled", b)
+
+    items = [results[bid] for bid in booking_ids]
+    succeeded = sum(1 for item in items if item["success"])
+    return create_response(success=True, data={"results": items, "succeeded": succeeded, "failed": len(items) - succeeded}, message="Bulk cancel processed")
+
+@router.post("/appointment/bulk-update", tags=["Appointments"])
+def bulk_update_appointments(request: BulkUpdateRequest, db: Session = Depends(get_db)):
+    """
+    Reschedules many bookings with batched calendar patches and a single DB commit.
+    Returns per-item results.
+    """
+    updates = {u.booking_id: u for u in request.updates}
+    bookings = _load_bookings(db, list(updates))
+    results = _missing_results(list(updates), bookings)
+
+    targets = [b for b in bookings.values() if b.status != "cancelled"]
+    for b in bookings.values():
+        if b.status == "cancelled":
+            results[b.id] = {"booking_id": b.id, "success": False, "error": "Booking is cancelled"}
+
+    if targets:
+        outcome = batch_update_events(db, list({b.event_id: (b.event_id, updates[b.id].new_start_time, updates[b.id].new_end_time) for b in targets}.values()))
+        if outcome is None:
+            return create_response(success=False, error="Authentication failed")
+        moved = []
+        for b in targets:
+            error = outcome.get(b.event_id, "No response from calendar")
+            if error:
+                results[b.id] = {"booking_id": b.id, "success": False, "error": error}
+                continue
+            u = updates[b.id]
+            previous = (b.start_time, b.end_time)
+            b.start_time = datetime.datetime.fromisoformat(u.new_start_time.replace('Z', '+00:00'))
+            b.end_time = datetime.datetime.fromisoformat(u.new_end_time.replace('Z', '+00:00'))
+            moved.append((b, previous))
+            results[b.id] = {"booking_id": b.id, "success": True}
+        db.commit()
+        for b, previous in moved:
+            notify_booking_change("updated", b, previous)
+
+    items = [results[bid] for bid in updates]
+    succeeded = sum(1 for item in items if item["success"])
+    return create_response(success=True, data={"results": items, "succeeded": succeeded, "failed": len(items) - succeeded}, message="Bulk update processed")
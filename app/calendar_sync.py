@@ -0,0 +1,239 @@
+import asyncio
+import datetime
+import logging
+import threading
+from fastapi import APIRouter, Request, BackgroundTasks, Depends
+from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from .database import SessionLocal
+from .models import CalendarEvent, CalendarSyncState
+from .utils import create_response
+from .config import settings
+from . import availability
+from .admin import require_admin
+
+logger = logging.getLogger("consulting_bot.calendar_sync")
+
+router = APIRouter()
+
+class WatchRequest(BaseModel):
+    channel_id: str
+    calendar_id: str = "primary"
+
+# One sync at a time per process; the periodic job and the webhook can overlap
+_sync_lock = threading.Lock()
+
+def _to_utc(value: dict):
+    """Converts a Google event start/end object to a naive UTC datetime."""
+    if not value:
+        return None
+    if value.get('dateTime'):
+        dt = datetime.datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00'))
+        if dt.tzinfo:
+            dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return dt
+    if value.get('date'):
+        # All-day event: block the whole day
+        return datetime.datetime.fromisoformat(value['date'])
+    return None
+
+def _parse_updated(value: str):
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+def _iso_utc(dt: datetime.datetime) -> str:
+    return dt.replace(tzinfo=datetime.timezone.utc).isoformat()
+
+def apply_event(db: Session, event: dict, calendar_id: str = "primary"):
+    """Upserts one event resource (as returned by the Calendar API) into the mirror."""
+    row = db.query(CalendarEvent).filter(
+        CalendarEvent.calendar_id == calendar_id,
+        CalendarEvent.event_id == event['id']
+    ).first()
+    if event.get('status') == 'cancelled':
+        if row:
+            db.delete(row)
+        availability.index.remove_event(calendar_id, event['id'])
+        return
+    if not row:
+        row = CalendarEvent(calendar_id=calendar_id, event_id=event['id'])
+        db.add(row)
+    row.status = event.get('status', 'confirmed')
+    row.transparency = event.get('transparency', 'opaque')
+    row.summary = event.get('summary')
+    row.start_time = _to_utc(event.get('start'))
+    row.end_time = _to_utc(event.get('end'))
+    row.updated = _parse_updated(event.get('updated'))
+    if row.transparency == 'transparent':
+        availability.index.remove_event(calendar_id, event['id'])
+    else:
+        availability.index.set_event(calendar_id, event['id'], row.start_time, row.end_time)
+
+def remove_event(db: Session, event_id: str, calendar_id: str = "primary"):
+    db.query(CalendarEvent).filter(
+        CalendarEvent.calendar_id == calendar_id,
+        CalendarEvent.event_id == event_id
+    ).delete(synchronize_session=False)
+
+def _get_state(db: Session, calendar_id: str):
+    state = db.query(CalendarSyncState).filter(CalendarSyncState.calendar_id == calendar_id).first()
+    if not state:
+        state = CalendarSyncState(calendar_id=calendar_id)
+        db.add(state)
+    return state
+
+def _list_pages(service, calendar_id: str, sync_token: str = None):
+    """Yields event pages; the last page carries nextSyncToken."""
+    page_token = None
+    while True:
+        params = {"calendarId": calendar_id, "singleEvents": True, "maxResults": 2500}
+        if sync_token:
+            params["syncToken"] = sync_token
+        else:
+            params["showDeleted"] = False
+        if page_token:
+            params["pageToken"] = page_token
+        page = service.events().list(**params).execute()
+        yield page
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            return
+
+def sync_calendar(db: Session, calendar_id: str = "primary"):
+    """
+    Pulls changes since the stored sync token into the local mirror.
+    Without a token, or when Google answers 410 Gone, the mirror is rebuilt from a full listing.
+    Returns a summary dict, or None when there are no credentials.
+    """
+    from googleapiclient.errors import HttpError
+    from .calendar_client import get_calendar_service
+
+    service = get_calendar_service(db)
+    if not service:
+        return None
+
+    with _sync_lock:
+        state = _get_state(db, calendar_id)
+        full = not state.sync_token
+        try:
+            changed, next_token = _pull(db, service, calendar_id, state.sync_token)
+        except HttpError as e:
+            if getattr(e, 'resp', None) is None or e.resp.status != 410:
+                raise
+            logger.warning(f"Sync token for '{calendar_id}' expired; running full resync")
+            db.rollback()
+            state = _get_state(db, calendar_id)
+            full = True
+            changed, next_token = _pull(db, service, calendar_id, None)
+
+        state.sync_token = next_token
+        state.last_synced_at = datetime.datetime.utcnow()
+        db.commit()
+        if full:
+            availability.rebuild_from_mirror(db)
+
+    if changed:
+        logger.info(f"Calendar '{calendar_id}' synced ({'full' if full else 'incremental'}): {changed} changes")
+    return {"calendar_id": calendar_id, "full": full, "changes": changed}
+
+def _pull(db: Session, service, calendar_id: str, sync_token: str):
+    changed = 0
+    next_token = None
+    if not sync_token:
+        db.query(CalendarEvent).filter(CalendarEvent.calendar_id == calendar_id).delete(synchronize_session=False)
+    for page in _list_pages(service, calendar_id, sync_token):
+        for event in page.get('items', []):
+            apply_event(db, event, calendar_id)
+            changed += 1
+        next_token = page.get('nextSyncToken') or next_token
+    return changed, next_token
+
+def mirror_is_fresh(db: Session, calendar_id: str = "primary") -> bool:
+    state = db.query(CalendarSyncState).filter(CalendarSyncState.calendar_id == calendar_id).first()
+    if not state or not state.last_synced_at or not state.sync_token:
+        return False
+    age = (datetime.datetime.utcnow() - state.last_synced_at).total_seconds()
+    return age <= settings.CALENDAR_MIRROR_MAX_AGE
+
+def mirror_version(db: Session, calendar_id: str = "primary"):
+    """The sync token while the mirror is fresh (it changes with every sync that saw changes), else None."""
+    if not mirror_is_fresh(db, calendar_id):
+        return None
+    return db.query(CalendarSyncState.sync_token).filter(CalendarSyncState.calendar_id == calendar_id).scalar()
+
+def get_busy_from_mirror(db: Session, time_min: datetime.datetime, time_max: datetime.datetime, calendar_id: str = "primary"):
+    """
+    Busy intervals overlapping [time_min, time_max) in the freebusy response shape.
+    Expects naive UTC datetimes; served by the (calendar_id, start_time, end_time) index.
+    """
+    rows = db.query(CalendarEvent.start_time, CalendarEvent.end_time).filter(
+        CalendarEvent.calendar_id == calendar_id,
+        CalendarEvent.status != 'cancelled',
+        CalendarEvent.transparency != 'transparent',
+        CalendarEvent.start_time < time_max,
+        CalendarEvent.end_time > time_min,
+    ).order_by(CalendarEvent.start_time).all()
+    return [{"start": _iso_utc(start), "end": _iso_utc(end)} for start, end in rows]
+
+def run_sync(calendar_id: str = "primary"):
+    """Runs one sync in its own session; used by background jobs."""
+    db = SessionLocal()
+    try:
+        return sync_calendar(db, calendar_id)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Calendar sync failed for '{calendar_id}': {e}")
+        return None
+    finally:
+        db.close()
+
+async def run_sync_loop(interval: float = None):
+    """Periodic incremental sync, started from the app lifespan."""
+    interval = interval or settings.CALENDAR_SYNC_INTERVAL
+    while True:
+        await asyncio.to_thread(run_sync)
+        await asyncio.sleep(interval)
+
+@router.post("/calendar/sync", tags=["Calendar"], dependencies=[Depends(require_admin)])
+def trigger_sync(calendar_id: str = "primary"):
+    result = run_sync(calendar_id)
+    if result is None:
+        return create_response(success=False, error="Calendar sync failed")
+    return create_response(success=True, data=result)
+
+@router.post("/calendar/watch", tags=["Calendar"], dependencies=[Depends(require_admin)])
+def watch_calendar(request: WatchRequest):
+    """
+    Registers a Google push-notification channel pointing at this app's own
+    /calendar/webhook. The address comes from config, never the caller: the
+    channel carries CALENDAR_WEBHOOK_TOKEN to whatever URL it names.
+    """
+    from .calendar_client import get_calendar_service
+    base_url = settings.get_public_base_url()
+    if not base_url:
+        return create_response(success=False, error="PUBLIC_BASE_URL is not configured")
+    db = SessionLocal()
+    try:
+        service = get_calendar_service(db)
+        if not service:
+            return create_response(success=False, error="Authentication failed")
+        body = {"id": request.channel_id, "type": "web_hook", "address": f"{base_url}/calendar/webhook"}
+        if settings.CALENDAR_WEBHOOK_TOKEN:
+            body["token"] = settings.CALENDAR_WEBHOOK_TOKEN
+        channel = service.events().watch(calendarId=request.calendar_id, body=body).execute()
+        return create_response(success=True, data={"channel_id": channel.get('id'), "resource_id": channel.get('resourceId'), "expiration": channel.get('expiration')})
+    except Exception as e:
+        return create_response(success=False, error=str(e))
+    finally:
+        db.close()
+
+@router.post("/calendar/webhook", tags=["Calendar"])
+async def calendar_webhook(request: Request, background_tasks: BackgroundTasks):
+    """Google push notification: schedule an incremental sync and acknowledge right away."""
+    if settings.CALENDAR_WEBHOOK_TOKEN and request.headers.get('X-Goog-Channel-Token') != settings.CALENDAR_WEBHOOK_TOKEN:
+        return create_response(success=False, error="Invalid channel token")
+    state = request.headers.get('X-Goog-Resource-State')
+    if state != 'sync':
+        background_tasks.add_task(run_sync)
+    return create_response(success=True, message="Notification received")
@@ -0,0 +1,195 @@
+import contextvars
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fastapi import APIRouter, Request
+from pydantic import BaseModel
+from typing import Any, Dict, List
+from .database import SessionLocal
+from .utils import create_response
+from . import bookings, payment, gmail_client, otp_client, deadline, ratelimit
+
+logger = logging.getLogger("consulting_bot.composite")
+
+router = APIRouter()
+
+# Shared by all composite requests; bounds the extra outbound concurrency
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="composite")
+
+# Whole-string references to an earlier step's response, e.g. "$book.data.booking_id"
+REF_PATTERN = re.compile(r"^\$([A-Za-z0-9_\-]+)((?:\.[A-Za-z0-9_\-]+)*)$")
+
+MAX_ACTIONS = 10
+
+class Action(BaseModel):
+    id: str
+    type: str
+    params: Dict[str, Any] = {}
+
+class CompositeRequest(BaseModel):
+    actions: List[Action]
+    stop_on_error: bool = True # Skip steps whose dependencies failed
+
+def _with_session(func):
+    def run(params):
+        db = SessionLocal()
+        try:
+            return func(params, db)
+        finally:
+            db.close()
+    return run
+
+# Address of the composite caller, so OTP steps draw on the same per-IP buckets as /otp/*
+_caller_ip = contextvars.ContextVar("composite_caller_ip", default="")
+
+def _otp_send(params):
+    return ratelimit.enforce(("otp_send_ip", _caller_ip.get())) or otp_client.send_otp(params["phone_number"])
+
+def _otp_verify(params):
+    return ratelimit.enforce(("otp_verify_ip", _caller_ip.get())) or otp_client.verify_otp(params["request_id"], params["code"])
+
+ACTIONS = {
+    "slots.get": _with_session(lambda p, db: bookings.get_slots(bookings.SlotRequest(**p), db)),
+    "appointment.create": _with_session(lambda p, db: bookings.create_appointment_once(bookings.BookingCreateRequest(**p), db)),
+    "appointment.update": _with_session(lambda p, db: bookings.update_appointment(bookings.BookingUpdateRequest(**p), db)),
+    "appointment.cancel": _with_session(lambda p, db: bookings.cancel_appointment(bookings.BookingCancelRequest(**p), db)),
+    "appointment.list": _with_session(lambda p, db: bookings.list_appointments(p["user_email"], db)),
+    "payment.create_order": _with_session(lambda p, db: payment.create_order_once(payment.OrderCreateRequest(**p), db)),
+    "email.send_confirmation": _with_session(lambda p, db: gmail_client.send_email(db, p["to"], p["subject"], p["body"])),
+    "otp.send": _otp_send,
+    "otp.verify": _otp_verify,
+}
+
+def _find_refs(value, refs: set):
+    if isinstance(value, str):
+        m = REF_PATTERN.match(value)
+        if m:
+            refs.add(m.group(1))
+    elif isinstance(value, dict):
+        for v in value.values():
+            _find_refs(v, refs)
+    elif isinstance(value, list):
+        for v in value:
+            _find_refs(v, refs)
+    return refs
+
+def _lookup(result, path: str):
+    current = result
+    for part in [p for p in path.split(".") if p]:
+        if isinstance(current, list):
+            current = current[int(part)]
+        else:
+            current = current[part]
+    return current
+
+def _resolve(value, results: dict):
+    if isinstance(value, str):
+        m = REF_PATTERN.match(value)
+        if m:
+            return _lookup(results[m.group(1)], m.group(2))
+        return value
+    if isinstance(value, dict):
+        return {k: _resolve(v, results) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve(v, results) for v in value]
+    return value
+
+def _run_step(action: Action, params: dict):
+    start = time.perf_counter()
+    try:
+        deadline.check()
+        result = ACTIONS[action.type](params)
+    except Exception as e:
+        result = create_response(success=False, error=str(e))
+    return result, round((time.perf_counter() - start) * 1000, 1)
+
+def _validate(actions: List[Action]):
+    """Returns (dependencies per step id, error message or None)."""
+    if not actions:
+        return None, "No actions given"
+    if len(actions) > MAX_ACTIONS:
+        return None, f"At most {MAX_ACTIONS} actions per request"
+    ids = [a.id for a in actions]
+    if len(set(ids)) != len(ids):
+        return None, "Action ids must be unique"
+    deps = {}
+    seen = set()
+    for a in actions:
+        if a.type not in ACTIONS:
+            return None, f"Unknown action type '{a.type}'"
+        refs = _find_refs(a.params, set())
+        unknown = refs - seen
+        if unknown:
+            # References may only point backwards, which also rules out cycles
+            return None, f"Action '{a.id}' references unknown or later step(s): {', '.join(sorted(unknown))}"
+        deps[a.id] = refs
+        seen.add(a.id)
+    return deps, None
+
+def run_actions(actions: List[Action], stop_on_error: bool = True):
+    """
+    Runs the steps as a dependency graph: a step starts as soon as every step
+    it references has finished, so independent steps run concurrently.
+    """
+    deps, error = _validate(actions)
+    if error:
+        return create_response(success=False, error=error)
+
+    by_id = {a.id: a for a in actions}
+    results, timings, failed = {}, {}, set()
+    pending = list(by_id)
+    running = {}
+
+    while pending or running:
+        for step_id in list(pending):
+            step_deps = deps[step_id]
+            if not step_deps <= set(results):
+                continue
+            pending.remove(step_id)
+            if stop_on_error and step_deps & failed:
+                results[step_id] = create_response(success=False, error="Skipped: a referenced step failed")
+                failed.add(step_id)
+                continue
+            try:
+                params = _resolve(by_id[step_id].params, results)
+            except (KeyError, IndexError, ValueError, TypeError) as e:
+                results[step_id] = create_response(success=False, error=f"Unresolvable reference: {e}")
+                failed.add(step_id)
+                continue
+            # Each step runs in a copy of the request context so it sees the deadline
+            running[_executor.submit(contextvars.copy_context().run, _run_step, by_id[step_id], params)] = step_id
+
+        if not running:
+            continue
+        done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+        for future in done:
+            step_id = running.pop(future)
+            result, elapsed_ms = future.result()
+            results[step_id] = result
+            timings[step_id] = elapsed_ms
+            if not (isinstance(result, dict) and result.get("success")):
+                failed.add(step_id)
+
+    steps = [
+        {"id": a.id, "type": a.type, "duration_ms": timings.get(a.id), "result": results[a.id]}
+        for a in actions
+    ]
+    return create_response(
+        success=not failed,
+        data={"steps": steps, "failed": sorted(failed)},
+        message="All actions completed" if not failed else None,
+        error="One or more actions failed" if failed else None,
+        details={"steps": steps, "failed": sorted(failed)} if failed else None,
+    )
+
+@router.post("/salesiq/actions", tags=["Chat"])
+def composite_actions(request: CompositeRequest, http_request: Request):
+    """
+    Runs an ordered list of actions in one round trip. Params can reference an
+    earlier step's response with "$<step id>.<path>", e.g. "$book.data.booking_id".
+    """
+    logger.info(f"Running composite request with {len(request.actions)} actions")
+    # Steps run in copies of this context, so they see the caller's address
+    _caller_ip.set(ratelimit.client_ip(http_request))
+    return run_actions(request.actions, request.stop_on_error)
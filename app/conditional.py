@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import json
+from fastapi import Request
+from fastapi.responses import Response
+from .config import settings
+
+try:
+    import orjson
+except ImportError: # Optional: faster serialization of the response envelope
+    orjson = None
+
+try:
+    import brotli
+except ImportError: # Optional: gzip is used when brotli is not installed
+    brotli = None
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=str, separators=(",", ":")).encode("utf-8")
+
+def make_etag(version_key: str) -> str:
+    # Weak: equal data, not byte-identical bodies (encoding may differ)
+    return 'W/"' + hashlib.sha256(version_key.encode("utf-8")).hexdigest()[:32] + '"'
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return _opaque(etag) in {_opaque(t) for t in header.split(",")}
+
+def _accepted_encodings(request: Request) -> set:
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if name and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add(name.lower())
+    return accepted
+
+def encode(request: Request, body: bytes):
+    """Compresses bodies over COMPRESS_MIN_BYTES with brotli or gzip, as the client accepts. Returns (body, encoding)."""
+    if len(body) < settings.COMPRESS_MIN_BYTES:
+        return body, None
+    accepted = _accepted_encodings(request)
+    if brotli is not None and "br" in accepted:
+        return brotli.compress(body, quality=5), "br"
+    if "gzip" in accepted:
+        return gzip.compress(body, compresslevel=6), "gzip"
+    return body, None
+
+def respond(request: Request, version_key, compute):
+    """
+    Serves a read endpoint with conditional request semantics.
+
+    version_key identifies the data (change counters plus request parameters),
+    or is None when the data version is unknown (e.g. read live from Google).
+    A matching If-None-Match gets 304 on GET/HEAD (412 on other methods, per
+    RFC 9110) before compute() runs. The version is read before computing, so
+    a tag is never newer than the body it labels. Failed envelopes are sent
+    without an ETag so they are not revalidated.
+    """
+    etag = make_etag(version_key) if version_key is not None else None
+    headers = {"Vary": "Accept-Encoding"}
+    if etag:
+        headers["ETag"] = etag
+        headers["Cache-Control"] = "no-cache"
+        if etag_matches(request, etag):
+            status = 304 if request.method in ("GET", "HEAD") else 412
+            return Response(status_code=status, headers=headers)
+
+    payload = compute()
+    if etag and not (isinstance(payload, dict) and payload.get("success")):
+        headers.pop("ETag")
+        headers.pop("Cache-Control")
+    body, encoding = encode(request, dumps(payload))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
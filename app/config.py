@@ -12,7 +12,141 @@ class Settings:
     GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
     GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
     GOOGLE_REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI")
+
+    # Startup warm-up
+    WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_STEP_TIMEOUT = float(os.getenv("WARMUP_STEP_TIMEOUT", 10))
+
+    # Background dependency prober
+    HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", 30))
+    HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", 5))
+    HEALTH_PROBE_WINDOW = int(os.getenv("HEALTH_PROBE_WINDOW", 10))
+
+    # Logging
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # json or text
+    LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", 1000))
+    # Comma separated "KEY=rate" pairs, e.g. "DEBUG=0.1,INFO=1"
+    LOG_LEVEL_SAMPLE_RATES = os.getenv("LOG_LEVEL_SAMPLE_RATES", "")
+    # e.g. "/health=0,/live=0,/chat=0.5"; only applies below WARNING
+    LOG_ROUTE_SAMPLE_RATES = os.getenv("LOG_ROUTE_SAMPLE_RATES", "/health=0,/live=0,/ready=0")
+
+    # Idempotency keys
+    IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 86400))
+    # Keys derived server-side (no client key) only cover retries, so they expire sooner
+    IDEMPOTENCY_DERIVED_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_DERIVED_TTL_SECONDS", 900))
+    IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 30))
+    IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 120))
+
+    # Calendar mirror
+    CALENDAR_SYNC_ENABLED = os.getenv("CALENDAR_SYNC_ENABLED", "true").lower() == "true"
+    CALENDAR_SYNC_INTERVAL = float(os.getenv("CALENDAR_SYNC_INTERVAL", 60))
+    # Availability falls back to live freebusy when the mirror is older than this
+    CALENDAR_MIRROR_MAX_AGE = float(os.getenv("CALENDAR_MIRROR_MAX_AGE", 300))
+    CALENDAR_WEBHOOK_TOKEN = os.getenv("CALENDAR_WEBHOOK_TOKEN")
+    # Public HTTPS origin of this app (push channels point at <it>/calendar/webhook); defaults to the Railway domain
+    PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "")
+
+    # Materialized availability
+    AVAILABILITY_HORIZON_DAYS = int(os.getenv("AVAILABILITY_HORIZON_DAYS", 60))
+    AVAILABILITY_REFRESH_INTERVAL = float(os.getenv("AVAILABILITY_REFRESH_INTERVAL", 60))
+    # Older indexes are ignored and slots are computed from the mirror or Google
+    AVAILABILITY_MAX_AGE = float(os.getenv("AVAILABILITY_MAX_AGE", 300))
+
+    # Appointment reminders
+    REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "true").lower() == "true"
+    # Comma separated minutes before the appointment, e.g. "1440,60"
+    REMINDER_LEAD_MINUTES = [int(m) for m in os.getenv("REMINDER_LEAD_MINUTES", "1440,60").split(",") if m.strip()]
+    REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", 50))
+
+    # OTP: "local" issues and verifies codes in process, "vonage_verify" uses Vonage Verify
+    OTP_MODE = os.getenv("OTP_MODE", "local").lower()
+    # Delivery for local codes: vonage_sms, log or sink; empty picks vonage_sms when configured
+    OTP_TRANSPORT = os.getenv("OTP_TRANSPORT", "").lower()
+    OTP_LENGTH = int(os.getenv("OTP_LENGTH", 6))
+    OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", 300))
+    OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", 5))
+    OTP_SMS_FROM = os.getenv("OTP_SMS_FROM", "ConsultBot")
+    # Pepper for OTP hashes; required in PROD, where codes are not issued without it
+    SECRET_KEY = os.getenv("SECRET_KEY", "")
+
+    # Rate limiting (token buckets)
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower() # memory or sqlite
+    RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "./rate_limits.db")
+    RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", 10000))
+    # "<policy>=<burst>/<seconds>" pairs; a bucket refills burst tokens per period
+    RATE_LIMIT_RULES = os.getenv("RATE_LIMIT_RULES", "otp_phone=3/600,otp_send_ip=10/600,otp_verify_ip=30/600,chat_user=20/60,chat_ip=60/60")
+    # Reverse proxies in front of the app that append to X-Forwarded-For (e.g. 1 on Railway); 0 uses the socket peer
+    TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", 0))
+
+    # Admission control: per endpoint class "<class>=<initial>/<max>" concurrency
+    ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "llm=4/16,calendar=8/32,payment=8/24")
+    # Latency above which a class backs off its limit, in seconds
+    ADMISSION_TARGET_LATENCY = os.getenv("ADMISSION_TARGET_LATENCY", "llm=8,calendar=2,payment=3")
+    # Longest a request may wait for a slot before it is shed, in seconds
+    ADMISSION_QUEUE_TIMEOUT = os.getenv("ADMISSION_QUEUE_TIMEOUT", "llm=2,calendar=1,payment=2")
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 32))
+
+    # Request deadlines: per route budget in seconds ("default" for the rest)
+    REQUEST_BUDGETS = os.getenv("REQUEST_BUDGETS", "default=10,/chat=25,/trigger=20,/context=20,/salesiq/actions=25")
+    # Outbound calls are not started with less than this left
+    DEADLINE_MIN_CALL_SECONDS = float(os.getenv("DEADLINE_MIN_CALL_SECONDS", 0.5))
+    # Timeout for outbound calls made outside a request (background jobs)
+    OUTBOUND_DEFAULT_TIMEOUT = float(os.getenv("OUTBOUND_DEFAULT_TIMEOUT", 30))
+
+    # Gemini function calling: concurrent tool calls per turn and model round trips per message
+    GEMINI_TOOL_WORKERS = int(os.getenv("GEMINI_TOOL_WORKERS", 8))
+    GEMINI_MAX_TOOL_ROUNDS = int(os.getenv("GEMINI_MAX_TOOL_ROUNDS", 5))
+
+    # Per-visitor chat history, compacted to stay under a token budget
+    # Opt-in: /chat then issues a conversation_token the client sends back to continue
+    GEMINI_HISTORY_ENABLED = os.getenv("GEMINI_HISTORY_ENABLED", "false").lower() == "true"
+    GEMINI_HISTORY_TOKEN_BUDGET = int(os.getenv("GEMINI_HISTORY_TOKEN_BUDGET", 3000))
+    GEMINI_HISTORY_KEEP_TURNS = int(os.getenv("GEMINI_HISTORY_KEEP_TURNS", 4))
+    GEMINI_HISTORY_SUMMARY_TOKENS = int(os.getenv("GEMINI_HISTORY_SUMMARY_TOKENS", 600))
+    GEMINI_HISTORY_TTL_SECONDS = int(os.getenv("GEMINI_HISTORY_TTL_SECONDS", 3600))
+    GEMINI_HISTORY_MAX_CONVERSATIONS = int(os.getenv("GEMINI_HISTORY_MAX_CONVERSATIONS", 1000))
+
+    # Shared secret for /admin endpoints (X-Admin-Token header)
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+    # Local development only: serve /admin without a token when ADMIN_TOKEN is unset (never in PROD)
+    ADMIN_OPEN = os.getenv("ADMIN_OPEN", "false").lower() == "true"
+    # Gemini usage accounting: rolling window for live totals, rollup flush period in seconds
+    LLM_USAGE_WINDOW_MINUTES = int(os.getenv("LLM_USAGE_WINDOW_MINUTES", 60))
+    LLM_USAGE_FLUSH_INTERVAL = int(os.getenv("LLM_USAGE_FLUSH_INTERVAL", 60))
+
+    # Cached /trigger and /context reply templates; bump the version to discard all of them
+    REPLY_TEMPLATES_ENABLED = os.getenv("REPLY_TEMPLATES_ENABLED", "true").lower() == "true"
+    REPLY_TEMPLATE_TTL_SECONDS = int(os.getenv("REPLY_TEMPLATE_TTL_SECONDS", 86400))
+    REPLY_TEMPLATE_VERSION = os.getenv("REPLY_TEMPLATE_VERSION", "1")
+
+    # Archival of old bookings (and their payments) to the archive database
+    ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "true").lower() == "true"
+    ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", 180))
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 500))
+    ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", 86400))
+    # Run VACUUM on a SQLite main database after rows were moved, to shrink the file
+    ARCHIVE_VACUUM = os.getenv("ARCHIVE_VACUUM", "false").lower() == "true"
+    # Conditional reads: bodies at least this large are sent brotli/gzip compressed
+    COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+
+    # Live slot updates over /ws/slots
+    SLOT_STREAM_MAX_CLIENTS = int(os.getenv("SLOT_STREAM_MAX_CLIENTS", 1000))
+    SLOT_STREAM_MAX_DAYS = int(os.getenv("SLOT_STREAM_MAX_DAYS", 31))
+    # Messages queued per client before they collapse into one resync
+    SLOT_STREAM_QUEUE_SIZE = int(os.getenv("SLOT_STREAM_QUEUE_SIZE", 100))
+    # A client that does not take a message within this many seconds is disconnected
+    SLOT_STREAM_SEND_TIMEOUT = float(os.getenv("SLOT_STREAM_SEND_TIMEOUT", 10))
     
+    def get_public_base_url(self):
+        if self.PUBLIC_BASE_URL:
+            return self.PUBLIC_BASE_URL.rstrip("/")
+        if self.RAILWAY_DOMAIN:
+            return f"https://{self.RAILWAY_DOMAIN}"
+        return None
+
     def get_redirect_uri(self):
         if self.DEPLOYMENT_MODE == "PROD" and self.RAILWAY_DOMAIN:
             return f"https://{self.RAILWAY_DOMAIN}/auth/callback"
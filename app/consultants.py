@@ -0,0 +1,91 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from .database import get_db
+from .models import Consultant
+from .calendar_client import get_busy_for_calendars
+from .bitmap_index import BusyBitmap
+from .utils import create_response
+from .admin import require_admin
+from pydantic import BaseModel
+from typing import List, Optional
+import datetime
+import numpy as np
+
+router = APIRouter()
+
+class ConsultantCreateRequest(BaseModel):
+    name: str
+    email: str
+    calendar_id: Optional[str] = None # Defaults to the email address
+
+@router.post("/consultants/create", tags=["Consultants"], dependencies=[Depends(require_admin)])
+def create_consultant(request: ConsultantCreateRequest, db: Session = Depends(get_db)):
+    if db.query(Consultant).filter(Consultant.email == request.email).first():
+        return create_response(success=False, error="Consultant already exists")
+    consultant = Consultant(
+        name=request.name,
+        email=request.email,
+        calendar_id=request.calendar_id or request.email,
+        active=True
+    )
+    db.add(consultant)
+    db.commit()
+    db.refresh(consultant)
+    return create_response(success=True, data={"consultant_id": consultant.id}, message="Consultant created successfully")
+
+@router.get("/consultants/list", tags=["Consultants"])
+def list_consultants(db: Session = Depends(get_db)):
+    consultants = db.query(Consultant).filter(Consultant.active == True).all()
+    data = [{"id": c.id, "name": c.name, "email": c.email} for c in consultants]
+    return create_response(success=True, data={"consultants": data})
+
+def get_consultant_slots(db: Session, time_min: str, time_max: str, consultant_id: Optional[int] = None, all_of: Optional[List[int]] = None):
+    """
+    Slots in one of three modes, from a single batched freebusy fetch:
+    - specific (consultant_id): slots tagged with that consultant_id
+    - any (default): each slot lists the consultant_ids free at that time
+    - all (all_of): slots where every listed consultant/resource is free,
+      e.g. a consultant plus a room
+    """
+    query = db.query(Consultant).filter(Consultant.active == True)
+    if consultant_id is not None:
+        query = query.filter(Consultant.id == consultant_id)
+    elif all_of:
+        query = query.filter(Consultant.id.in_(all_of))
+    consultants = query.all()
+    if not consultants or (all_of and len(consultants) != len(set(all_of))):
+        return create_response(success=False, error="Consultant not found" if consultant_id is not None or all_of else "No consultants configured")
+
+    try:
+        busy_by_calendar = get_busy_for_calendars(db, [c.calendar_id for c in consultants], time_min, time_max)
+        if busy_by_calendar is None:
+            return create_response(success=False, error="Authentication failed")
+
+        start = datetime.datetime.fromisoformat(time_min.replace('Z', '+00:00'))
+        end = datetime.datetime.fromisoformat(time_max.replace('Z', '+00:00'))
+        bitmap = BusyBitmap.from_busy(busy_by_calendar, start, end)
+        calendar_ids = [c.calendar_id for c in consultants]
+
+        slots = []
+        if all_of:
+            for idx in np.flatnonzero(bitmap.all_free(calendar_ids)):
+                slot_start, slot_end = bitmap.slot_bounds(idx)
+                slots.append({"start": slot_start, "end": slot_end, "consultant_ids": sorted(set(all_of))})
+        else:
+            # (consultants x slots) free matrix; one column per candidate slot
+            free = bitmap.slot_matrix(calendar_ids)
+            ids = np.array([c.id for c in consultants])
+            for idx in np.flatnonzero(free.any(axis=0)):
+                slot_start, slot_end = bitmap.slot_bounds(idx)
+                if consultant_id is not None:
+                    slots.append({"start": slot_start, "end": slot_end, "consultant_id": consultant_id})
+                else:
+                    slots.append({"start": slot_start, "end": slot_end, "consultant_ids": ids[free[:, idx]].tolist()})
+        return create_response(success=True, data={"slots": slots})
+
+    except Exception as e:
+        return create_response(success=False, error=str(e))
+
+def get_consultant_email(db: Session, consultant_id: int):
+    consultant = db.query(Consultant).filter(Consultant.id == consultant_id).first()
+    return consultant.email if consultant else None
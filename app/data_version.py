@@ -0,0 +1,37 @@
+import logging
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import DataVersion
+
+logger = logging.getLogger("consulting_bot.data_version")
+
+# Counters bumped whenever the data behind a cached read changes; ETags are
+# derived from them, so a poll can be answered with 304 without recomputing.
+BOOKINGS = "bookings"
+CALENDAR = "calendar"
+
+def bump(db: Session, name: str):
+    """Increments a counter in the caller's transaction."""
+    updated = db.query(DataVersion).filter(DataVersion.name == name).update(
+        {DataVersion.version: DataVersion.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.add(DataVersion(name=name, version=1))
+
+def get(db: Session, *names) -> dict:
+    rows = db.query(DataVersion.name, DataVersion.version).filter(DataVersion.name.in_(names)).all()
+    versions = dict.fromkeys(names, 0)
+    versions.update({name: version for name, version in rows})
+    return versions
+
+def on_booking_change(action: str, booking, previous: tuple = None):
+    """bookings listener: booking rows changed, so cached booking reads are stale."""
+    db = SessionLocal()
+    try:
+        bump(db, BOOKINGS)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Could not bump booking version: {e}")
+    finally:
+        db.close()
@@ -0,0 +1,93 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from .config import settings
+
+# Absolute time.monotonic() by which the current request must be answered
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    """Raised instead of starting an outbound call the caller will not wait for."""
+
+    def __init__(self, message: str = "Deadline exceeded"):
+        super().__init__(message)
+
+def _parse_budgets(raw: str):
+    budgets = {}
+    for pair in (raw or "").split(","):
+        if "=" in pair:
+            key, value = pair.split("=", 1)
+            try:
+                budgets[key.strip()] = float(value)
+            except ValueError:
+                continue
+    return budgets
+
+_budgets = _parse_budgets(settings.REQUEST_BUDGETS)
+
+def budget_for(path: str) -> float:
+    best = None
+    for prefix in _budgets:
+        if prefix != "default" and path.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return _budgets[best] if best else _budgets.get("default", 10.0)
+
+def start(path: str, client_timeout: str = None):
+    """
+    Sets the deadline for the current request from the route budget, tightened
+    by an X-Request-Timeout header (seconds) when the client sends one.
+    """
+    budget = budget_for(path)
+    if client_timeout:
+        try:
+            budget = min(budget, float(client_timeout))
+        except ValueError:
+            pass
+    return _deadline.set(time.monotonic() + budget)
+
+def set_remaining(seconds: float):
+    """Sets a deadline outside the request middleware, e.g. for a background job."""
+    return _deadline.set(time.monotonic() + seconds)
+
+def remaining():
+    """Seconds left for the current request, or None outside a request."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+def timeout(cap: float = None) -> float:
+    """
+    Timeout to use for the next outbound call: the remaining budget (or
+    OUTBOUND_DEFAULT_TIMEOUT outside a request), optionally capped.
+    Raises DeadlineExceeded when too little is left to be worth starting.
+    """
+    left = remaining()
+    if left is None:
+        left = settings.OUTBOUND_DEFAULT_TIMEOUT
+    elif left < settings.DEADLINE_MIN_CALL_SECONDS:
+        raise DeadlineExceeded()
+    return min(left, cap) if cap else left
+
+def check():
+    """Raises DeadlineExceeded when the request has run out of budget."""
+    timeout()
+
+_executor = None
+
+def run_with_timeout(func, *args, **kwargs):
+    """
+    For SDK calls that take no timeout argument: runs func in a helper thread
+    and stops waiting when the deadline passes. The abandoned call finishes
+    in the background; the request worker is released right away.
+    """
+    global _executor
+    limit = timeout()
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="outbound")
+    ctx = contextvars.copy_context()
+    future = _executor.submit(ctx.run, func, *args, **kwargs)
+    try:
+        return future.result(timeout=limit)
+    except FuturesTimeout:
+        raise DeadlineExceeded()
@@ -0,0 +1,132 @@
+import csv
+import datetime
+import io
+import json
+import logging
+import zlib
+from .database import SessionLocal, ArchiveSessionLocal
+from .models import Booking, Payment, User, ArchivedBooking, ArchivedPayment
+
+logger = logging.getLogger("consulting_bot.exports")
+
+# Exportable tables and the columns a date range may filter on (first is the default)
+TABLES = {
+    "bookings": (Booking, ("created_at", "start_time")),
+    "payments": (Payment, ("created_at",)),
+    "users": (User, ("created_at",)),
+}
+
+# archived=true exports the archive database's copy instead
+ARCHIVED_MODELS = {"bookings": ArchivedBooking, "payments": ArchivedPayment}
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# Rows read per keyset page (one short transaction each), and bytes buffered before a chunk is sent
+PAGE_SIZE = 1000
+CHUNK_BYTES = 64 * 1024
+
+def _value(v):
+    if isinstance(v, (datetime.datetime, datetime.date)):
+        return v.isoformat()
+    return v
+
+def validate(table: str, fmt: str = "csv", status: list = None, date_field: str = None, archived: bool = False):
+    """Raises ValueError for an unknown table, format or date field, or a status filter on a table without status."""
+    if table not in TABLES:
+        raise ValueError(f"Unknown table '{table}'")
+    if archived and table not in ARCHIVED_MODELS:
+        raise ValueError(f"'{table}' is not archived")
+    if fmt not in FORMATS:
+        raise ValueError(f"Format must be one of {', '.join(FORMATS)}")
+    model, date_fields = TABLES[table]
+    if date_field and date_field not in date_fields:
+        raise ValueError(f"'{table}' can be filtered by {', '.join(date_fields)}")
+    if status and "status" not in model.__table__.columns:
+        raise ValueError(f"'{table}' has no status column")
+
+def build_query(db, table: str, start: datetime.datetime = None, end: datetime.datetime = None,
+                status: list = None, date_field: str = None, archived: bool = False):
+    """Column query (no ORM objects) over one validated table, plus its model for keyset paging."""
+    model, date_fields = TABLES[table]
+    if archived:
+        model = ARCHIVED_MODELS[table]
+    date_field = date_field or date_fields[0]
+    columns = list(model.__table__.columns)
+    query = db.query(*columns)
+    date_column = getattr(model, date_field)
+    if start:
+        query = query.filter(date_column >= start)
+    if end:
+        query = query.filter(date_column < end)
+    if status:
+        query = query.filter(model.status.in_(status))
+    return [c.name for c in columns], query, model
+
+def _pages(db, query, model):
+    """
+    Rows in id order, read as keyset pages (WHERE id > last ORDER BY id LIMIT n).
+    Each page's read transaction ends before its rows are sent, so a slow
+    download never holds a SQLite read lock that would block writers.
+    """
+    last = None
+    while True:
+        page = query if last is None else query.filter(model.id > last)
+        rows = page.order_by(model.id).limit(PAGE_SIZE).all()
+        db.rollback()
+        if not rows:
+            return
+        last = rows[-1].id
+        yield from rows
+        if len(rows) < PAGE_SIZE:
+            return
+
+def _encode_rows(names: list, rows, fmt: str):
+    """Yields encoded text pieces: a header line for CSV, then one line per row."""
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(names)
+        for row in rows:
+            writer.writerow([_value(v) for v in row])
+            if buf.tell() >= CHUNK_BYTES:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(names, (_value(v) for v in row))), default=str) + "\n"
+
+def stream_export(table: str, fmt: str = "csv", compress: bool = False, archived: bool = False, **filters):
+    """
+    Generator of response chunks for a StreamingResponse. It owns its DB session
+    for the whole stream and reads page by page, so memory stays flat however
+    many rows are exported.
+    Starlette iterates sync generators in the threadpool, leaving the event loop free.
+    """
+    db = ArchiveSessionLocal() if archived else SessionLocal()
+    try:
+        names, query, model = build_query(db, table, archived=archived, **filters)
+        gz = zlib.compressobj(wbits=31) if compress else None # 31: gzip container
+        pending, size = [], 0
+        for piece in _encode_rows(names, _pages(db, query, model), fmt):
+            data = piece.encode("utf-8")
+            if gz:
+                data = gz.compress(data)
+            if data:
+                pending.append(data)
+                size += len(data)
+            if size >= CHUNK_BYTES:
+                yield b"".join(pending)
+                pending, size = [], 0
+        if gz:
+            pending.append(gz.flush())
+        if pending:
+            yield b"".join(pending)
+        logger.info(f"Exported {table} as {fmt}{'.gz' if compress else ''}")
+    finally:
+        db.close()
+
+def filename(table: str, fmt: str, compress: bool) -> str:
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    return f"{table}-{stamp}.{fmt}{'.gz' if compress else ''}"
@@ -1,10 +1,19 @@
 import os
+import json
+import secrets
 import logging
 import datetime
+import threading
+import time
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
 from google.generativeai.types import FunctionDeclaration, Tool  # type: ignore
-from . import bookings, otp_client, gmail_client
+from . import bookings, otp_client, gmail_client, deadline, llm_usage, rollups
 from .database import SessionLocal
+from .config import settings
 
 logger = logging.getLogger("consulting_bot.gemini")
 
@@ -19,21 +28,64 @@ if API_KEY:
 else:
     logger.warning("GEMINI_API_KEY not set; Gemini calls will return error message.")
 
+class _TurnSessions:
+    """
+    DB session scope for one chat turn. Tools called in the same turn reuse
+    their thread's session instead of opening a new one per call; sessions
+    are not shared between threads, since a Session is not thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def get(self):
+        ident = threading.get_ident()
+        with self._lock:
+            db = self._sessions.get(ident)
+            if db is None:
+                db = self._sessions[ident] = SessionLocal()
+            return db
+
+    def rollback(self):
+        """Discards a failed tool's pending changes so later calls on this thread can proceed."""
+        with self._lock:
+            db = self._sessions.get(threading.get_ident())
+        if db is not None:
+            db.rollback()
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for db in sessions:
+            db.close()
+
+_turn_sessions = contextvars.ContextVar("gemini_turn_sessions", default=None)
+
+@contextmanager
+def _tool_db():
+    """The turn's session when called from the tool loop, otherwise a private one."""
+    scope = _turn_sessions.get()
+    if scope is not None:
+        yield scope.get()
+        return
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 # Define Tools
 def check_availability(time_min: str, time_max: str):
     """Checks calendar availability for a given time range."""
-    db = SessionLocal()
-    try:
+    with _tool_db() as db:
         # Assuming bookings.get_free_busy is accessible or we use calendar_client directly
         from .calendar_client import get_free_busy
         return get_free_busy(db, time_min, time_max)
-    finally:
-        db.close()
 
 def book_appointment(user_email: str, start_time: str, end_time: str, summary: str):
     """Books an appointment for the user."""
-    db = SessionLocal()
-    try:
+    with _tool_db() as db:
         # We need to call the logic from bookings.create_appointment but it expects a request object.
         # It's better to call the underlying logic or construct the request.
         # For simplicity, let's call the calendar_client directly and save to DB, 
@@ -56,10 +108,10 @@ def book_appointment(user_email: str, start_time: str, end_time: str, summary: s
             status="confirmed"
         )
         db.add(new_booking)
+        rollups.booking_status_changed(db, new_booking)
         db.commit()
+        bookings.notify_booking_change("created", new_booking)
         return {"success": True, "booking_id": new_booking.id, "event_id": event_id}
-    finally:
-        db.close()
 
 def send_otp(phone_number: str):
     """Sends an OTP to the specified phone number."""
@@ -71,60 +123,57 @@ def verify_otp(request_id: str, code: str):
 
 def send_email(to: str, subject: str, body: str):
     """Sends an email to the specified recipient."""
-    db = SessionLocal()
-    try:
+    with _tool_db() as db:
         return gmail_client.send_email(db, to, subject, body)
-    finally:
-        db.close()
 
 def create_payment_link(booking_id: int, amount: int, currency: str = "INR"):
     """Generates a payment link for a booking."""
     import razorpay
     from .models import Payment
     
-    db = SessionLocal()
-    try:
-        key_id = os.getenv("RAZORPAY_KEY_ID")
-        key_secret = os.getenv("RAZORPAY_KEY_SECRET")
+    with _tool_db() as db:
+        try:
+            key_id = os.getenv("RAZORPAY_KEY_ID")
+            key_secret = os.getenv("RAZORPAY_KEY_SECRET")
         
-        if not key_id or not key_secret:
-            return {"error": "Razorpay credentials missing"}
+            if not key_id or not key_secret:
+                return {"error": "Razorpay credentials missing"}
             
-        client = razorpay.Client(auth=(key_id, key_secret))
+            client = razorpay.Client(auth=(key_id, key_secret))
         
-        data = {
-            "amount": amount * 100, # subunits
-            "currency": currency,
-            "receipt": f"booking_{booking_id}",
-            "payment_capture": 1
-        }
-        order = client.order.create(data=data)
+            data = {
+                "amount": amount * 100, # subunits
+                "currency": currency,
+                "receipt": f"booking_{booking_id}",
+                "payment_capture": 1
+            }
+            order = client.order.create(data=data, timeout=deadline.timeout())
         
-        # Save Payment Record
-        # We need a user_id, but for this tool we might not have it directly from the prompt 
-        # unless passed. We'll assume a placeholder or try to fetch from booking if possible.
-        # For now, let's use a default or 0 if not provided.
-        # Ideally, the bot should ask for user_id or we infer it.
-        # Let's pass user_id=0 for now as it's required by model but maybe not critical for link generation.
+            # Save Payment Record
+            # We need a user_id, but for this tool we might not have it directly from the prompt 
+            # unless passed. We'll assume a placeholder or try to fetch from booking if possible.
+            # For now, let's use a default or 0 if not provided.
+            # Ideally, the bot should ask for user_id or we infer it.
+            # Let's pass user_id=0 for now as it's required by model but maybe not critical for link generation.
         
-        new_payment = Payment(
-            booking_id=booking_id,
-            user_id=0, # Placeholder
-            order_id=order['id'],
-            amount=amount,
-            currency=currency,
-            status="created"
-        )
-        db.add(new_payment)
-        db.commit()
+            new_payment = Payment(
+                booking_id=booking_id,
+                user_id=0, # Placeholder
+                order_id=order['id'],
+                amount=amount,
+                currency=currency,
+                status="created"
+            )
+            db.add(new_payment)
+            rollups.payment_status_changed(db, new_payment)
+            db.commit()
         
-        payment_link = f"https://checkout.razorpay.com/v1/checkout.js?order_id={order['id']}"
-        return {"success": True, "payment_link": payment_link, "order_id": order['id']}
+            payment_link = f"https://checkout.razorpay.com/v1/checkout.js?order_id={order['id']}"
+            return {"success": True, "payment_link": payment_link, "order_id": order['id']}
         
-    except Exception as e:
-        return {"error": str(e)}
-    finally:
-        db.close()
+        except Exception as e:
+            db.rollback()
+            return {"error": str(e)}
 
 tools_list = [
     check_availability,
@@ -135,6 +184,251 @@ tools_list = [
     create_payment_link
 ]
 
+TOOLS = {fn.__name__: fn for fn in tools_list}
+
+# Runs the function calls of one model response concurrently; shared by all chats
+_tool_executor = ThreadPoolExecutor(max_workers=settings.GEMINI_TOOL_WORKERS, thread_name_prefix="gemini-tool")
+
+_tool_stats_lock = threading.Lock()
+_tool_stats = {} # name -> {"calls", "errors", "total_ms", "max_ms"}
+
+def _record_tool(name: str, elapsed_ms: float, ok: bool):
+    with _tool_stats_lock:
+        stats = _tool_stats.setdefault(name, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["calls"] += 1
+        stats["errors"] += 0 if ok else 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+def get_tool_metrics():
+    with _tool_stats_lock:
+        return {
+            name: dict(s, avg_ms=round(s["total_ms"] / s["calls"], 1), total_ms=round(s["total_ms"], 1))
+            for name, s in _tool_stats.items()
+        }
+
+def _jsonable(value):
+    """Tool results go back to Gemini as a protobuf Struct: plain JSON types only."""
+    return json.loads(json.dumps(value, default=str))
+
+def _call_tool(name: str, args: dict):
+    """Runs one function call; returns (response dict, elapsed ms). Errors are reported to the model."""
+    start = time.perf_counter()
+    ok = True
+    try:
+        fn = TOOLS.get(name)
+        if fn is None:
+            result = {"error": f"Unknown function '{name}'"}
+            ok = False
+        else:
+            deadline.check()
+            result = fn(**args)
+    except Exception as e:
+        logger.warning(f"Tool '{name}' failed: {e}")
+        scope = _turn_sessions.get()
+        if scope is not None:
+            scope.rollback()
+        result = {"error": str(e)}
+        ok = False
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+    _record_tool(name, elapsed_ms, ok)
+    if not isinstance(result, dict):
+        result = {"result": result}
+    return _jsonable(result), elapsed_ms
+
+def _function_calls(response):
+    calls = []
+    for candidate in getattr(response, "candidates", None) or []:
+        for part in getattr(candidate.content, "parts", None) or []:
+            fc = getattr(part, "function_call", None)
+            if fc and fc.name:
+                calls.append(fc)
+        break # Only the first candidate is used
+    return calls
+
+def _run_tools(calls):
+    """
+    Runs the function calls of one response concurrently and returns the
+    function_response parts in call order. The turn's wall time is that of
+    the slowest tool rather than the sum.
+    """
+    futures = []
+    for fc in calls:
+        # Each call runs in a copy of the turn's context (deadline, DB scope, request id)
+        futures.append(_tool_executor.submit(contextvars.copy_context().run, _call_tool, fc.name, dict(fc.args or {})))
+    llm_usage.observe_tools([fc.name for fc in calls])
+    parts, timings = [], []
+    for fc, future in zip(calls, futures):
+        result, elapsed_ms = future.result()
+        timings.append({"name": fc.name, "ms": elapsed_ms})
+        parts.append(genai.protos.Part(function_response=genai.protos.FunctionResponse(name=fc.name, response=result)))
+    logger.info("Gemini tool calls finished", extra={"tools": timings})
+    return parts
+
+def _send_turn(chat, message):
+    """
+    Sends a message and serves function calls until the model answers in text.
+    Replaces the SDK's automatic function calling, which runs tools one by one.
+    """
+    scope = _TurnSessions()
+    token = _turn_sessions.set(scope)
+    try:
+        response = chat.send_message(message, request_options={"timeout": deadline.timeout()})
+        llm_usage.observe(response, _model_name)
+        for _ in range(settings.GEMINI_MAX_TOOL_ROUNDS):
+            calls = _function_calls(response)
+            if not calls:
+                return response
+            parts = _run_tools(calls)
+            response = chat.send_message(parts, request_options={"timeout": deadline.timeout()})
+            llm_usage.observe(response, _model_name)
+        logger.warning(f"Stopped after {settings.GEMINI_MAX_TOOL_ROUNDS} tool rounds")
+        return response
+    finally:
+        _turn_sessions.reset(token)
+        scope.close()
+
+def _approx_tokens(content) -> int:
+    """Rough token count of a Content entry (~4 characters per token)."""
+    return len(json.dumps(type(content).to_dict(content), default=str)) // 4 + 1
+
+def _content_text(content) -> str:
+    return " ".join(part.text for part in content.parts if getattr(part, "text", None)).strip()
+
+def _payload_outline(value, depth: int = 0):
+    """Shape of a tool payload with lists collapsed to counts, e.g. {"slots": "<24 items>"}."""
+    if isinstance(value, list):
+        return f"<{len(value)} items>"
+    if isinstance(value, dict):
+        if depth >= 2:
+            return "<object>"
+        return {k: _payload_outline(v, depth + 1) for k, v in value.items()}
+    if isinstance(value, str) and len(value) > 80:
+        return value[:77] + "..."
+    return value
+
+class ConversationHistory:
+    """
+    Gemini history for one visitor, kept under a token budget.
+
+    A turn is every Content entry produced by one message (user text, function
+    calls and responses, model answer). The newest turns stay verbatim. Once
+    the budget is exceeded, tool payloads in older turns are replaced with a
+    reference plus an outline, then the oldest turns are folded into a running
+    text summary. Compaction is local string work, so the history sent per
+    turn, and with it the model latency, stays bounded however long the chat runs.
+    """
+
+    def __init__(self, budget: int, keep_turns: int, summary_tokens: int):
+        self.budget = budget
+        self.keep_turns = keep_turns
+        self.summary_tokens = summary_tokens
+        self.turns = [] # [{"contents": [...], "tokens": int, "compacted": bool}]
+        self.summary_lines = []
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self._refs = 0
+
+    @property
+    def tokens(self) -> int:
+        return sum(t["tokens"] for t in self.turns) + len(" ".join(self.summary_lines)) // 4
+
+    def history(self):
+        """Content list to start the next chat with: summary first, then the kept turns."""
+        contents = []
+        if self.summary_lines:
+            contents.append(genai.protos.Content(role="user", parts=[genai.protos.Part(
+                text="Summary of the earlier conversation:\n" + "\n".join(self.summary_lines))]))
+            contents.append(genai.protos.Content(role="model", parts=[genai.protos.Part(text="Understood.")]))
+        for turn in self.turns:
+            contents.extend(turn["contents"])
+        return contents
+
+    def record(self, contents):
+        contents = list(contents)
+        if not contents:
+            return
+        self.turns.append({"contents": contents, "tokens": sum(_approx_tokens(c) for c in contents), "compacted": False})
+        self.last_used = time.monotonic()
+        self.compact()
+
+    def compact(self):
+        old = len(self.turns) - self.keep_turns
+        # 1. Swap bulky tool payloads in older turns for references
+        for turn in self.turns[:max(old, 0)]:
+            if self.tokens <= self.budget:
+                return
+            if not turn["compacted"]:
+                turn["contents"] = [self._compact_content(c) for c in turn["contents"]]
+                turn["tokens"] = sum(_approx_tokens(c) for c in turn["contents"])
+                turn["compacted"] = True
+        # 2. Fold the oldest turns into the summary
+        while self.tokens > self.budget and len(self.turns) > self.keep_turns:
+            self._fold(self.turns.pop(0))
+
+    def _compact_content(self, content):
+        parts = []
+        for part in content.parts:
+            fr = getattr(part, "function_response", None)
+            if fr and fr.name:
+                self._refs += 1
+                payload = type(fr).to_dict(fr).get("response", {})
+                parts.append(genai.protos.Part(function_response=genai.protos.FunctionResponse(
+                    name=fr.name,
+                    response={"ref": f"{fr.name}#{self._refs}", "outline": _jsonable(_payload_outline(payload))},
+                )))
+            else:
+                parts.append(part)
+        return genai.protos.Content(role=content.role, parts=parts)
+
+    def _fold(self, turn):
+        user = next((_content_text(c) for c in turn["contents"] if c.role == "user" and _content_text(c)), "")
+        answer = next((_content_text(c) for c in reversed(turn["contents"]) if c.role == "model" and _content_text(c)), "")
+        tools = sorted({p.function_call.name for c in turn["contents"] for p in c.parts if getattr(p, "function_call", None) and p.function_call.name})
+        line = f"- User: {user[:200]}"
+        if tools:
+            line += f" [tools: {', '.join(tools)}]"
+        if answer:
+            line += f" / Assistant: {answer[:200]}"
+        self.summary_lines.append(line)
+        while len(" ".join(self.summary_lines)) // 4 > self.summary_tokens and len(self.summary_lines) > 1:
+            self.summary_lines.pop(0)
+
+_conversations = OrderedDict() # conversation id -> ConversationHistory, least recently used first
+_conversations_lock = threading.Lock()
+
+def get_conversation(conversation_id: str) -> ConversationHistory:
+    now = time.monotonic()
+    with _conversations_lock:
+        conv = _conversations.pop(conversation_id, None)
+        if conv is None or now - conv.last_used > settings.GEMINI_HISTORY_TTL_SECONDS:
+            conv = ConversationHistory(
+                settings.GEMINI_HISTORY_TOKEN_BUDGET,
+                settings.GEMINI_HISTORY_KEEP_TURNS,
+                settings.GEMINI_HISTORY_SUMMARY_TOKENS,
+            )
+        _conversations[conversation_id] = conv
+        while len(_conversations) > settings.GEMINI_HISTORY_MAX_CONVERSATIONS:
+            _conversations.popitem(last=False)
+        return conv
+
+def open_conversation(token: str = None) -> str:
+    """
+    Returns the conversation token to use for a chat turn. Tokens are issued
+    here and are unguessable, so a caller can only continue a conversation it
+    was given; an unknown or expired token starts a new one under a new token.
+    """
+    now = time.monotonic()
+    with _conversations_lock:
+        conv = _conversations.get(token) if token else None
+        if conv is not None and now - conv.last_used <= settings.GEMINI_HISTORY_TTL_SECONDS:
+            return token
+    return secrets.token_urlsafe(24)
+
+def reset_conversation(conversation_id: str):
+    with _conversations_lock:
+        _conversations.pop(conversation_id, None)
+
 _model = None  # lazy init
 _model_name = None  # track current model name
 
@@ -193,26 +487,95 @@ def _select_model(exclude: set | None = None):
     logger.error("No suitable Gemini model could be initialized.")
     return None
 
-def chat_with_gemini(message: str):
-    """Send a message to Gemini with dynamic model selection and graceful fallbacks."""
-    # Lazy refresh if key not present (e.g. .env added after initial import)
-    def _ensure_api_key():
-        global API_KEY
-        if not API_KEY:
+def _ensure_api_key():
+    """Lazy refresh if key not present (e.g. .env added after initial import)."""
+    global API_KEY
+    if not API_KEY:
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+        except Exception:
+            pass
+        API_KEY = os.getenv("GEMINI_API_KEY")
+        if API_KEY:
             try:
-                from dotenv import load_dotenv
-                load_dotenv()
-            except Exception:
-                pass
-            API_KEY = os.getenv("GEMINI_API_KEY")
-            if API_KEY:
-                try:
-                    genai.configure(api_key=API_KEY)
-                    logger.info("Gemini API key loaded at runtime.")
-                except Exception as e:
-                    logger.error(f"Failed to configure Gemini after dynamic load: {e}")
-        return API_KEY
+                genai.configure(api_key=API_KEY)
+                logger.info("Gemini API key loaded at runtime.")
+            except Exception as e:
+                logger.error(f"Failed to configure Gemini after dynamic load: {e}")
+    return API_KEY
 
+def warm_model():
+    """Select and cache the Gemini model ahead of the first chat. Returns the model name or None."""
+    global _model, _model_name
+    if not _ensure_api_key():
+        return None
+    if _model is None:
+        sel = _select_model()
+        if sel:
+            _model_name, _model = sel
+    return _model_name
+
+def chat_with_gemini(message: str, conversation_id: str = None, flow: str = "chat", visitor: str = None):
+    """
+    Send a message to Gemini with dynamic model selection and graceful fallbacks.
+    With a conversation_id the visitor's compacted history is sent along and the
+    turn is added to it; messages of one conversation are handled one at a time.
+    Tokens, latency and tool calls are accounted to flow and visitor.
+    """
+    usage = llm_usage.TurnUsage(flow, visitor or conversation_id)
+    token = llm_usage.current.set(usage)
+    text = None
+    try:
+        if conversation_id and settings.GEMINI_HISTORY_ENABLED:
+            conversation = get_conversation(conversation_id)
+            with conversation.lock:
+                text = _chat(message, conversation)
+        else:
+            text = _chat(message, None)
+        return text
+    finally:
+        llm_usage.current.reset(token)
+        usage.finish(ok=isinstance(text, str) and not text.startswith("Error"))
+        # Demo mode and model selection failures make no calls and are not accounted
+        if usage.model_calls or not usage.ok:
+            llm_usage.record(usage)
+
+_plain_models = {} # model name -> GenerativeModel without tools
+
+def generate_text(prompt: str, flow: str):
+    """
+    One-shot generation with the selected model but no tools, so the prompt
+    cannot trigger bookings, OTPs or emails. Returns the text, or None in demo
+    mode or on failure.
+    """
+    model_name = warm_model()
+    if not model_name:
+        return None
+    usage = llm_usage.TurnUsage(flow)
+    token = llm_usage.current.set(usage)
+    text = None
+    try:
+        mdl = _plain_models.get(model_name)
+        if mdl is None:
+            mdl = _plain_models[model_name] = genai.GenerativeModel(model_name=model_name)
+        response = mdl.generate_content(prompt, request_options={"timeout": deadline.timeout()})
+        llm_usage.observe(response, model_name)
+        text = response.text
+        return text
+    except Exception as e:
+        logger.warning(f"Plain generation for {flow} failed: {e}")
+        return None
+    finally:
+        llm_usage.current.reset(token)
+        usage.finish(ok=text is not None)
+        llm_usage.record(usage)
+
+def _start_chat(conversation):
+    history = conversation.history() if conversation else None
+    return _model.start_chat(history=history), len(history or [])
+
+def _chat(message: str, conversation):
     if not _ensure_api_key():
         safe_msg = (message or "").strip() or "your message"
         return (
@@ -227,9 +590,12 @@ def chat_with_gemini(message: str):
             return "Error: No available Gemini model"
         _model_name, _model = sel
     try:
-        chat = _model.start_chat(enable_automatic_function_calling=True)
-        response = chat.send_message(message)
-        return getattr(response, "text", str(response))
+        chat, offset = _start_chat(conversation)
+        response = _send_turn(chat, message)
+        text = getattr(response, "text", str(response))
+        if conversation:
+            conversation.record(chat.history[offset:])
+        return text
     except Exception as e:
         # On model not found errors, attempt one re-selection then retry once
         err_msg = str(e)
@@ -240,9 +606,12 @@ def chat_with_gemini(message: str):
                 return f"Error: {err_msg} (and no fallback model available)"
             _model_name, _model = sel2
             try:
-                chat = _model.start_chat(enable_automatic_function_calling=True)
-                response = chat.send_message(message)
-                return getattr(response, "text", str(response))
+                chat, offset = _start_chat(conversation)
+                response = _send_turn(chat, message)
+                text = getattr(response, "text", str(response))
+                if conversation:
+                    conversation.record(chat.history[offset:])
+                return text
             except Exception as e2:
                 # Last-chance: try a set of broad compatibility model names and generate_content
                 candidates = [
@@ -252,9 +621,12 @@ def chat_with_gemini(message: str):
                     "gemini-1.5-flash-002", "models/gemini-1.5-flash-002",
                 ]
                 for cand in candidates:
+                    if (deadline.remaining() or 1e9) < settings.DEADLINE_MIN_CALL_SECONDS:
+                        break
                     try:
                         mdl = genai.GenerativeModel(model_name=cand, tools=tools_list)
-                        resp = mdl.generate_content(message)
+                        resp = mdl.generate_content(message, request_options={"timeout": deadline.timeout()})
+                        llm_usage.observe(resp, cand)
                         return getattr(resp, "text", str(resp))
                     except Exception as e3:
                         logger.warning(f"Fallback model '{cand}' failed: {e3}")
@@ -1,5 +1,4 @@
-from googleapiclient.discovery import build
-from .auth import get_credentials
+from .auth import get_credentials, build_google_service
 from .utils import create_response
 from sqlalchemy.orm import Session
 from email.mime.text import MIMEText
@@ -9,7 +8,14 @@ def get_gmail_service(db: Session):
     creds = get_credentials(db)
     if not creds:
         return None
-    return build('gmail', 'v1', credentials=creds)
+    return build_google_service('gmail', 'v1', creds)
+
+def _build_message(to: str, subject: str, body: str):
+    message = MIMEText(body)
+    message['to'] = to
+    message['subject'] = subject
+    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+    return {'raw': raw_message}
 
 def send_email(db: Session, to: str, subject: str, body: str):
     service = get_gmail_service(db)
@@ -17,14 +23,38 @@ def send_email(db: Session, to: str, subject: str, body: str):
         return create_response(success=False, error="Authentication failed")
 
     try:
-        message = MIMEText(body)
-        message['to'] = to
-        message['subject'] = subject
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-        
-        message_body = {'raw': raw_message}
+        message_body = _build_message(to, subject, body)
         sent_message = service.users().messages().send(userId='me', body=message_body).execute()
         
         return create_response(success=True, data={"message_id": sent_message['id']})
     except Exception as e:
         return create_response(success=False, error=str(e))
+
+# Gmail accepts up to 100 calls per batch; smaller batches avoid rate-limit errors
+BATCH_MAX_REQUESTS = 50
+
+def send_emails_batch(db: Session, messages: list):
+    """
+    Sends many emails with Gmail batch requests.
+    messages: [(request_id, to, subject, body)]. Returns {request_id: error or None},
+    or None without credentials.
+    """
+    service = get_gmail_service(db)
+    if not service:
+        return None
+
+    results = {}
+
+    def _callback(request_id, response, exception):
+        results[request_id] = str(exception) if exception is not None else None
+
+    for i in range(0, len(messages), BATCH_MAX_REQUESTS):
+        batch = service.new_batch_http_request(callback=_callback)
+        for request_id, to, subject, body in messages[i:i + BATCH_MAX_REQUESTS]:
+            batch.add(service.users().messages().send(userId='me', body=_build_message(to, subject, body)), request_id=request_id)
+        try:
+            batch.execute()
+        except Exception as e:
+            for request_id, *_ in messages[i:i + BATCH_MAX_REQUESTS]:
+                results.setdefault(request_id, str(e))
+    return results
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+import requests
+from sqlalchemy import text
+from .database import engine, SessionLocal
+from .config import settings
+
+logger = logging.getLogger("consulting_bot.health")
+
+# Rolling probe samples per dependency: deque of (timestamp, ok, latency_ms, detail)
+_samples = {}
+
+# Last computed snapshot, served as-is by /health
+_snapshot = {
+    "status": "starting",
+    "deployment_mode": settings.DEPLOYMENT_MODE,
+    "checked_at": None,
+    "dependencies": {},
+}
+
+class ProbeSkipped(Exception):
+    """Raised by a probe when the dependency is not configured."""
+
+def _probe_database():
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return "connected"
+
+def _probe_google():
+    from .calendar_client import get_calendar_service
+    db = SessionLocal()
+    try:
+        service = get_calendar_service(db)
+    finally:
+        db.close()
+    if not service:
+        raise ProbeSkipped("no credentials")
+    service.calendarList().get(calendarId='primary').execute()
+    return "reachable"
+
+def _probe_gemini():
+    from . import gemini_client
+    if not gemini_client.API_KEY:
+        raise ProbeSkipped("GEMINI_API_KEY not set")
+    name = gemini_client._model_name or gemini_client.warm_model()
+    if not name:
+        raise RuntimeError("no model selected")
+    gemini_client.genai.get_model(name if name.startswith("models/") else f"models/{name}")
+    return f"model: {name}"
+
+def _probe_http(url: str, configured: bool):
+    if not configured:
+        raise ProbeSkipped("credentials missing")
+    # Any HTTP answer means the API edge is reachable; only transport errors count as failures
+    requests.head(url, timeout=settings.HEALTH_PROBE_TIMEOUT)
+    return "reachable"
+
+def _probe_vonage():
+    return _probe_http("https://api.nexmo.com", bool(os.getenv("VONAGE_API_KEY") and os.getenv("VONAGE_API_SECRET")))
+
+def _probe_razorpay():
+    return _probe_http("https://api.razorpay.com", bool(os.getenv("RAZORPAY_KEY_ID") and os.getenv("RAZORPAY_KEY_SECRET")))
+
+PROBES = {
+    "database": _probe_database,
+    "google": _probe_google,
+    "gemini": _probe_gemini,
+    "vonage": _probe_vonage,
+    "razorpay": _probe_razorpay,
+}
+
+# A failing required dependency marks the instance unready, the others only degrade it
+REQUIRED = {"database"}
+
+def _summarize(name: str):
+    samples = _samples.get(name)
+    if not samples:
+        return {"status": "unknown"}
+    ts, ok, latency_ms, detail = samples[-1]
+    latencies = sorted(s[2] for s in samples if s[1] is True)
+    consecutive_failures = 0
+    for s in reversed(samples):
+        if s[1] is not False:
+            break
+        consecutive_failures += 1
+    if ok is None:
+        status = "skipped"
+    else:
+        status = "ok" if ok else "error"
+    return {
+        "status": status,
+        "detail": detail,
+        "latency_ms": latency_ms,
+        "p50_latency_ms": latencies[len(latencies) // 2] if latencies else None,
+        "max_latency_ms": latencies[-1] if latencies else None,
+        "success_rate": round(sum(1 for s in samples if s[1]) / len(samples), 2),
+        "consecutive_failures": consecutive_failures,
+        "checked_at": ts,
+    }
+
+def _rebuild_snapshot():
+    global _snapshot
+    deps = {name: _summarize(name) for name in PROBES}
+    status = "running"
+    for name, dep in deps.items():
+        if dep["status"] in ("error", "skipped", "unknown"):
+            status = "degraded"
+    _snapshot = {
+        "status": status,
+        "deployment_mode": settings.DEPLOYMENT_MODE,
+        "checked_at": time.time(),
+        "dependencies": deps,
+    }
+
+async def _run_probe(name: str, func):
+    start = time.perf_counter()
+    try:
+        detail = await asyncio.wait_for(asyncio.to_thread(func), timeout=settings.HEALTH_PROBE_TIMEOUT)
+        ok = True
+    except ProbeSkipped as e:
+        detail, ok = f"skipped: {e}", None
+    except asyncio.TimeoutError:
+        detail, ok = f"timeout after {settings.HEALTH_PROBE_TIMEOUT}s", False
+    except Exception as e:
+        detail, ok = f"error: {e}", False
+    latency_ms = round((time.perf_counter() - start) * 1000, 1)
+    window = _samples.setdefault(name, deque(maxlen=settings.HEALTH_PROBE_WINDOW))
+    window.append((time.time(), ok, latency_ms, detail))
+    if ok is False:
+        logger.warning(f"Probe '{name}' failed in {latency_ms}ms: {detail}")
+
+async def probe_once():
+    """Probes every dependency concurrently and refreshes the cached snapshot."""
+    await asyncio.gather(*(_run_probe(name, func) for name, func in PROBES.items()))
+    _rebuild_snapshot()
+    return _snapshot
+
+async def run_prober(interval: float = None):
+    """Background loop started from the app lifespan."""
+    interval = interval or settings.HEALTH_PROBE_INTERVAL
+    while True:
+        try:
+            await probe_once()
+        except Exception as e:
+            logger.error(f"Health prober round failed: {e}")
+        await asyncio.sleep(interval)
+
+def get_snapshot():
+    return _snapshot
+
+def dependencies_ready() -> bool:
+    """True when every required dependency passed its latest probe."""
+    for name in REQUIRED:
+        samples = _samples.get(name)
+        if not samples or samples[-1][1] is not True:
+            return False
+    return True
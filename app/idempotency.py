@@ -0,0 +1,182 @@
+import datetime
+import hashlib
+import json
+import logging
+import threading
+import time
+from sqlalchemy.exc import IntegrityError
+from .database import SessionLocal
+from .models import IdempotencyRecord
+from .utils import create_response
+from .config import settings
+from . import deadline as request_deadline
+
+logger = logging.getLogger("consulting_bot.idempotency")
+
+# Events for keys being processed by this worker, so local waiters wake immediately
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+_last_cleanup = 0.0
+CLEANUP_INTERVAL_SECONDS = 300
+POLL_INTERVAL_SECONDS = 0.2
+
+def fingerprint(payload: dict) -> str:
+    """Stable hash of a request payload, used to detect key reuse with different data."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def purge_expired(db=None):
+    """Deletes expired records. Returns the number of rows removed."""
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        removed = db.query(IdempotencyRecord).filter(
+            IdempotencyRecord.expires_at < datetime.datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.commit()
+        return removed
+    finally:
+        if own_session:
+            db.close()
+
+def _maybe_cleanup(db):
+    global _last_cleanup
+    now = time.monotonic()
+    if now - _last_cleanup < CLEANUP_INTERVAL_SECONDS:
+        return
+    _last_cleanup = now
+    try:
+        removed = purge_expired(db)
+        if removed:
+            logger.info(f"Purged {removed} expired idempotency keys")
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Idempotency cleanup failed: {e}")
+
+def _claim(db, key: str, fp: str, ttl_seconds: int):
+    """
+    Tries to insert an in-progress record for the key.
+    Returns None when claimed, otherwise the existing record.
+    """
+    now = datetime.datetime.utcnow()
+    db.add(IdempotencyRecord(
+        key=key,
+        fingerprint=fp,
+        status="in_progress",
+        expires_at=now + datetime.timedelta(seconds=ttl_seconds),
+    ))
+    try:
+        db.commit()
+        return None
+    except IntegrityError:
+        db.rollback()
+
+    existing = db.query(IdempotencyRecord).filter(IdempotencyRecord.key == key).first()
+    if existing is None:
+        # Deleted between our insert and read; try once more
+        return _claim(db, key, fp, ttl_seconds)
+
+    stale_lock = (
+        existing.status == "in_progress"
+        and existing.created_at < now - datetime.timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+    )
+    if existing.expires_at < now or stale_lock:
+        # Expired, or the worker holding it died: take it over
+        db.delete(existing)
+        db.commit()
+        return _claim(db, key, fp, ttl_seconds)
+    return existing
+
+def _wait_for_result(db, key: str):
+    """
+    Waits for another request holding the key to finish.
+    Returns the completed record, None if the holder gave up the key,
+    or False on timeout.
+    """
+    wait_seconds = settings.IDEMPOTENCY_WAIT_SECONDS
+    left = request_deadline.remaining()
+    if left is not None:
+        wait_seconds = min(wait_seconds, left)
+    deadline = time.monotonic() + wait_seconds
+    while time.monotonic() < deadline:
+        with _inflight_lock:
+            event = _inflight.get(key)
+        if event is not None:
+            event.wait(timeout=max(0.0, deadline - time.monotonic()))
+        else:
+            time.sleep(POLL_INTERVAL_SECONDS)
+        db.expire_all()
+        record = db.query(IdempotencyRecord).filter(IdempotencyRecord.key == key).first()
+        if record is None or record.status == "completed":
+            return record
+    return False
+
+def run_idempotent(scope: str, key: str, payload: dict, func, ttl_seconds: int = None):
+    """
+    Runs func() at most once per (scope, key) within the TTL.
+
+    - A replay of a completed request returns the stored response.
+    - A request arriving while the first is in flight waits for its result.
+    - Failed responses are not stored, so the client can retry.
+    Without a key, func() runs as usual.
+    """
+    if not key:
+        return func()
+    ttl_seconds = ttl_seconds or settings.IDEMPOTENCY_TTL_SECONDS
+
+    full_key = f"{scope}:{key}"
+    fp = fingerprint(payload)
+    db = SessionLocal()
+    try:
+        _maybe_cleanup(db)
+        for _ in range(2):
+            existing = _claim(db, full_key, fp, ttl_seconds)
+            if existing is None:
+                break
+            if existing.fingerprint != fp:
+                return create_response(success=False, error="Idempotency key reused with a different request")
+            if existing.status == "completed":
+                logger.info(f"Replaying stored response for idempotency key {full_key}")
+                return json.loads(existing.response)
+            record = _wait_for_result(db, full_key)
+            if record is False:
+                return create_response(success=False, error="Request with this idempotency key is still in progress")
+            if record is not None:
+                logger.info(f"Returning result of concurrent request for idempotency key {full_key}")
+                return json.loads(record.response)
+            # The first attempt failed and released the key: claim it ourselves
+        else:
+            return create_response(success=False, error="Request with this idempotency key is still in progress")
+
+        event = threading.Event()
+        with _inflight_lock:
+            _inflight[full_key] = event
+        try:
+            result = None
+            try:
+                result = func()
+            finally:
+                record = db.query(IdempotencyRecord).filter(IdempotencyRecord.key == full_key).first()
+                if record is not None:
+                    if isinstance(result, dict) and result.get("success"):
+                        record.status = "completed"
+                        record.response = json.dumps(result, default=str)
+                    else:
+                        db.delete(record)
+                    db.commit()
+            return result
+        finally:
+            with _inflight_lock:
+                _inflight.pop(full_key, None)
+            event.set()
+    finally:
+        db.close()
+
+def forget(scope: str, key: str):
+    """Drops a stored result so the next request with this key runs again."""
+    db = SessionLocal()
+    try:
+        db.query(IdempotencyRecord).filter(IdempotencyRecord.key == f"{scope}:{key}").delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
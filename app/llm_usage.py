@@ -0,0 +1,201 @@
+import asyncio
+import contextvars
+import datetime
+import logging
+import threading
+import time
+from collections import deque
+from .database import SessionLocal
+from .models import LLMUsageRollup
+from .config import settings
+
+logger = logging.getLogger("consulting_bot.llm_usage")
+
+FIELDS = ("calls", "errors", "model_calls", "prompt_tokens", "completion_tokens", "tool_calls", "latency_ms", "ttft_ms")
+
+# Usage of the chat turn running in the current context
+current = contextvars.ContextVar("llm_turn_usage", default=None)
+
+class TurnUsage:
+    """
+    Accounting for one chat_with_gemini call, which may take several model
+    round trips (function calling). Calls are not streamed, so the first token
+    arrives with the first response: ttft is the time to that response.
+    """
+
+    def __init__(self, flow: str, visitor: str = None):
+        self.flow = (flow or "chat")[:64]
+        self.visitor = visitor or "anonymous"
+        self.model = None
+        self.ok = True
+        self.model_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.tools = []
+        self.ttft_ms = None
+        self.latency_ms = None
+        self._start = time.perf_counter()
+
+    def _elapsed_ms(self):
+        return round((time.perf_counter() - self._start) * 1000, 1)
+
+    def finish(self, ok: bool):
+        self.ok = ok
+        self.latency_ms = self._elapsed_ms()
+
+    def as_dict(self):
+        return {
+            "flow": self.flow, "visitor": self.visitor, "model": self.model, "ok": self.ok,
+            "model_calls": self.model_calls, "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens, "tool_calls": len(self.tools),
+            "ttft_ms": self.ttft_ms, "latency_ms": self.latency_ms,
+        }
+
+def observe(response, model: str):
+    """Adds one model response (and its usage_metadata) to the current turn."""
+    usage = current.get()
+    if usage is None:
+        return
+    if usage.ttft_ms is None:
+        usage.ttft_ms = usage._elapsed_ms()
+    usage.model = model
+    usage.model_calls += 1
+    meta = getattr(response, "usage_metadata", None)
+    if meta is not None:
+        usage.prompt_tokens += getattr(meta, "prompt_token_count", 0) or 0
+        usage.completion_tokens += getattr(meta, "candidates_token_count", 0) or 0
+
+def observe_tools(names):
+    usage = current.get()
+    if usage is not None:
+        usage.tools.extend(names)
+
+def _empty():
+    return dict.fromkeys(FIELDS, 0) | {"max_latency_ms": 0.0}
+
+def _add(agg: dict, usage: TurnUsage):
+    agg["calls"] += 1
+    agg["errors"] += 0 if usage.ok else 1
+    agg["model_calls"] += usage.model_calls
+    agg["prompt_tokens"] += usage.prompt_tokens
+    agg["completion_tokens"] += usage.completion_tokens
+    agg["tool_calls"] += len(usage.tools)
+    agg["latency_ms"] += usage.latency_ms or 0
+    agg["ttft_ms"] += usage.ttft_ms or 0
+    agg["max_latency_ms"] = max(agg["max_latency_ms"], usage.latency_ms or 0)
+
+def _merge(into: dict, agg: dict):
+    for field in FIELDS:
+        into[field] += agg[field]
+    into["max_latency_ms"] = max(into["max_latency_ms"], agg["max_latency_ms"])
+
+def _finalize(agg: dict):
+    calls = agg["calls"] or 1
+    return dict(
+        agg,
+        latency_ms=round(agg["latency_ms"], 1),
+        ttft_ms=round(agg["ttft_ms"], 1),
+        avg_latency_ms=round(agg["latency_ms"] / calls, 1),
+        avg_ttft_ms=round(agg["ttft_ms"] / calls, 1),
+    )
+
+_lock = threading.Lock()
+# Rolling window: one bucket per minute, {"flow"|"model"|"visitor"|"tool": {name: agg}}
+_minutes = deque()
+# Hourly aggregates not yet written to llm_usage_rollups, keyed by (hour, flow, model)
+_pending = {}
+
+def record(usage: TurnUsage):
+    minute = int(time.time() // 60)
+    hour = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    with _lock:
+        if not _minutes or _minutes[-1][0] != minute:
+            _minutes.append((minute, {"flow": {}, "model": {}, "visitor": {}, "tool": {}}))
+        while _minutes and _minutes[0][0] <= minute - settings.LLM_USAGE_WINDOW_MINUTES:
+            _minutes.popleft()
+        bucket = _minutes[-1][1]
+        for dimension, name in (("flow", usage.flow), ("model", usage.model or "none"), ("visitor", usage.visitor)):
+            _add(bucket[dimension].setdefault(name, _empty()), usage)
+        for tool in usage.tools:
+            bucket["tool"][tool] = bucket["tool"].get(tool, 0) + 1
+        _add(_pending.setdefault((hour, usage.flow, usage.model or "none"), _empty()), usage)
+    logger.info("Gemini usage", extra=usage.as_dict())
+
+def snapshot(top_visitors: int = 10):
+    """Totals over the rolling window by flow, model and tool, plus the heaviest visitors."""
+    cutoff = int(time.time() // 60) - settings.LLM_USAGE_WINDOW_MINUTES
+    totals = {"flow": {}, "model": {}, "visitor": {}}
+    tools = {}
+    with _lock:
+        for minute, bucket in _minutes:
+            if minute <= cutoff:
+                continue
+            for dimension in totals:
+                for name, agg in bucket[dimension].items():
+                    _merge(totals[dimension].setdefault(name, _empty()), agg)
+            for name, count in bucket["tool"].items():
+                tools[name] = tools.get(name, 0) + count
+    visitors = sorted(
+        totals["visitor"].items(),
+        key=lambda item: item[1]["prompt_tokens"] + item[1]["completion_tokens"],
+        reverse=True,
+    )[:top_visitors]
+    return {
+        "window_minutes": settings.LLM_USAGE_WINDOW_MINUTES,
+        "by_flow": {name: _finalize(agg) for name, agg in totals["flow"].items()},
+        "by_model": {name: _finalize(agg) for name, agg in totals["model"].items()},
+        "top_visitors": {name: _finalize(agg) for name, agg in visitors},
+        "tool_calls": tools,
+    }
+
+def flush():
+    """Adds the pending hourly aggregates to llm_usage_rollups. Returns the number of rows touched."""
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return 0
+    db = SessionLocal()
+    try:
+        for (hour, flow, model), agg in pending.items():
+            row = db.query(LLMUsageRollup).filter(
+                LLMUsageRollup.period_start == hour,
+                LLMUsageRollup.flow == flow,
+                LLMUsageRollup.model == model,
+            ).first()
+            if not row:
+                row = LLMUsageRollup(period_start=hour, flow=flow, model=model, max_latency_ms=0, **dict.fromkeys(FIELDS, 0))
+                db.add(row)
+            for field in FIELDS:
+                setattr(row, field, (getattr(row, field) or 0) + int(agg[field]))
+            row.max_latency_ms = max(row.max_latency_ms or 0, int(agg["max_latency_ms"]))
+        db.commit()
+        return len(pending)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"LLM usage rollup failed: {e}")
+        # Put the counts back so the next flush retries them
+        with _lock:
+            for key, agg in pending.items():
+                _merge(_pending.setdefault(key, _empty()), agg)
+        return 0
+    finally:
+        db.close()
+
+async def run_flush_loop(interval: float = None):
+    """Periodic rollup flush, started from the app lifespan."""
+    interval = interval or settings.LLM_USAGE_FLUSH_INTERVAL
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(flush)
+
+def get_rollups(db, hours: int = 24):
+    since = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=hours)
+    rows = db.query(LLMUsageRollup).filter(LLMUsageRollup.period_start >= since).order_by(
+        LLMUsageRollup.period_start, LLMUsageRollup.flow
+    ).all()
+    return [
+        _finalize({field: getattr(row, field) or 0 for field in FIELDS} | {"max_latency_ms": row.max_latency_ms or 0})
+        | {"period_start": row.period_start.isoformat(), "flow": row.flow, "model": row.model}
+        for row in rows
+    ]
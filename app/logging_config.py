@@ -0,0 +1,145 @@
+import atexit
+import contextvars
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from .config import settings
+
+# Per-request context, set by the request middleware
+request_id_var = contextvars.ContextVar("request_id", default=None)
+route_var = contextvars.ContextVar("route", default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+def _parse_rates(raw: str):
+    """Parses "KEY=rate,KEY=rate" into a dict, ignoring malformed pairs."""
+    rates = {}
+    for pair in (raw or "").split(","):
+        if "=" not in pair:
+            continue
+        key, value = pair.split("=", 1)
+        try:
+            rates[key.strip()] = max(0.0, min(1.0, float(value)))
+        except ValueError:
+            continue
+    return rates
+
+def _truncate(value, limit: int):
+    if isinstance(value, str) and len(value) > limit:
+        return f"{value[:limit]}... [truncated {len(value) - limit} chars]"
+    return value
+
+class ContextFilter(logging.Filter):
+    """Stamps request id and route onto every record, in the caller's thread."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        record.route = route_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """
+    Drops a share of records by level and by route before they are queued.
+    Route rates only apply below WARNING so errors are never sampled away.
+    """
+
+    def __init__(self, level_rates: dict, route_rates: dict):
+        super().__init__()
+        self.level_rates = level_rates
+        self.route_rates = route_rates
+
+    def filter(self, record):
+        rate = self.level_rates.get(record.levelname, 1.0)
+        if record.levelno < logging.WARNING:
+            route = getattr(record, "route", None)
+            if route in self.route_rates:
+                rate = min(rate, self.route_rates[route])
+        if rate >= 1.0:
+            return True
+        return rate > 0.0 and random.random() < rate
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, large values truncated."""
+
+    def __init__(self, max_field_chars: int):
+        super().__init__()
+        self.max_field_chars = max_field_chars
+
+    def format(self, record):
+        event = {
+            "ts": datetime.datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": _truncate(record.getMessage(), self.max_field_chars),
+        }
+        for key, value in vars(record).items():
+            if key in _RESERVED or key.startswith("_"):
+                continue
+            event[key] = _truncate(value, self.max_field_chars)
+        if record.exc_text:
+            event["exc"] = _truncate(record.exc_text, self.max_field_chars * 4)
+        return json.dumps(event, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, max_field_chars: int):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s')
+        self.max_field_chars = max_field_chars
+
+    def formatMessage(self, record):
+        record.message = _truncate(record.message, self.max_field_chars)
+        return super().formatMessage(record)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Unlike the stock QueueHandler, only merges args into the message here and
+    leaves the actual formatting to the listener thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def setup_logging():
+    """
+    Routes all logging through a QueueHandler; a QueueListener thread does the
+    formatting and the blocking stderr writes off the request path.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    if settings.LOG_FORMAT == "text":
+        formatter = TextFormatter(settings.LOG_MAX_FIELD_CHARS)
+    else:
+        formatter = JsonFormatter(settings.LOG_MAX_FIELD_CHARS)
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(
+        _parse_rates(settings.LOG_LEVEL_SAMPLE_RATES),
+        _parse_rates(settings.LOG_ROUTE_SAMPLE_RATES),
+    ))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(settings.LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -1,28 +1,72 @@
 from fastapi import FastAPI, Request, Depends, HTTPException
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from .database import engine, Base, get_db
-from . import models, bookings, auth, otp_client, gmail_client, payment, voice
+from .database import engine, Base, archive_engine, ArchiveBase, get_db, add_missing_columns
+from . import models, bookings, auth, otp_client, gmail_client, payment, voice, warmup, health, singleflight, calendar_sync, availability, consultants, composite, reminders, ratelimit, admission, deadline, admin, llm_usage, reply_templates, archive, data_version, conditional, slot_stream
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
+from typing import List, Optional
 from .utils import create_response
 from .config import settings
+from .logging_config import setup_logging, request_id_var, route_var
+from contextlib import asynccontextmanager
+import asyncio
 import logging
 import time
 import os
+import sys
+import uuid
 
 # Configure Structured Logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+setup_logging()
 logger = logging.getLogger("consulting_bot")
 
 # Create tables
 Base.metadata.create_all(bind=engine)
+add_missing_columns(engine)
+ArchiveBase.metadata.create_all(bind=archive_engine)
+
+bookings.booking_listeners.append(availability.on_booking_change)
+bookings.booking_listeners.append(reminders.on_booking_change)
+bookings.booking_listeners.append(data_version.on_booking_change)
+bookings.booking_listeners.append(bookings.release_slot_key)
+bookings.booking_listeners.append(slot_stream.on_booking_change)
+availability.change_listeners.append(slot_stream.hub.publish)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm clients before the server starts accepting connections
+    if settings.WARMUP_ENABLED:
+        await warmup.run_warmup()
+    else:
+        warmup.mark_ready()
+    # Dependency checks run off the request path; /health only reads the snapshot
+    await health.probe_once()
+    background = [asyncio.create_task(health.run_prober()), asyncio.create_task(llm_usage.run_flush_loop())]
+    if settings.CALENDAR_SYNC_ENABLED:
+        background.append(asyncio.create_task(calendar_sync.run_sync_loop()))
+        background.append(asyncio.create_task(availability.run_refresh_loop()))
+    if settings.ARCHIVE_ENABLED:
+        background.append(asyncio.create_task(archive.run_archive_loop()))
+    if settings.REMINDERS_ENABLED:
+        await asyncio.to_thread(reminders.scheduler.start)
+    yield
+    reminders.scheduler.stop()
+    for task in background:
+        task.cancel()
+    await asyncio.to_thread(llm_usage.flush)
+
+# orjson serializes the response envelopes when installed
+app = FastAPI(
+    title="Consulting Bot API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse if conditional.orjson else JSONResponse,
+)
 
-app = FastAPI(title="Consulting Bot API", version="1.0.0")
+# Per endpoint class admission control; added first so CORS also wraps shed responses
+app.add_middleware(admission.AdmissionMiddleware)
 
 # Global CORS Configuration
 app.add_middleware(
@@ -31,15 +75,24 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"], # Read by the web frontend for If-None-Match
 )
 
 # Request Logging Middleware
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    request_id_var.set(request_id)
+    route_var.set(request.url.path)
+    deadline.start(request.url.path, request.headers.get("X-Request-Timeout"))
     start_time = time.time()
     response = await call_next(request)
     process_time = time.time() - start_time
-    logger.info(f"Path: {request.url.path} Method: {request.method} Status: {response.status_code} Time: {process_time:.4f}s")
+    response.headers["X-Request-ID"] = request_id
+    logger.info(
+        f"Path: {request.url.path} Method: {request.method} Status: {response.status_code} Time: {process_time:.4f}s",
+        extra={"method": request.method, "status": response.status_code, "duration_ms": round(process_time * 1000, 1)}
+    )
     return response
 
 # Global Exception Handlers
@@ -52,6 +105,22 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content=create_response(success=False, error="Validation Error", details={"errors": exc.errors()})
     )
 
+@app.exception_handler(ratelimit.RateLimitExceeded)
+async def rate_limit_exception_handler(request: Request, exc: ratelimit.RateLimitExceeded):
+    return JSONResponse(
+        status_code=200,
+        content=ratelimit.rejection(exc.retry_after),
+        headers={"Retry-After": str(max(1, int(exc.retry_after + 0.5)))}
+    )
+
+@app.exception_handler(deadline.DeadlineExceeded)
+async def deadline_exception_handler(request: Request, exc: deadline.DeadlineExceeded):
+    logger.warning(f"Deadline exceeded for {request.url.path}")
+    return JSONResponse(
+        status_code=200,
+        content=create_response(success=False, error="Request timed out", details={"reason": "deadline_exceeded"})
+    )
+
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     logger.error(f"HTTP Exception: {exc.detail}")
@@ -72,6 +141,11 @@ async def global_exception_handler(request: Request, exc: Exception):
 app.include_router(bookings.router)
 app.include_router(payment.router)
 app.include_router(voice.router)
+app.include_router(calendar_sync.router)
+app.include_router(consultants.router)
+app.include_router(composite.router)
+app.include_router(admin.router)
+app.include_router(slot_stream.router)
 
 # Auth Endpoints
 @app.get("/auth/init", tags=["Auth"])
@@ -114,12 +188,12 @@ class OTPVerifyRequest(BaseModel):
     request_id: str
     code: str
 
-@app.post("/otp/send", tags=["OTP"])
+@app.post("/otp/send", tags=["OTP"], dependencies=[Depends(ratelimit.limit_otp_send)])
 def send_otp_endpoint(request: OTPSendRequest):
     logger.info(f"Sending OTP to {request.phone_number}")
     return otp_client.send_otp(request.phone_number)
 
-@app.post("/otp/verify", tags=["OTP"])
+@app.post("/otp/verify", tags=["OTP"], dependencies=[Depends(ratelimit.limit_otp_verify)])
 def verify_otp_endpoint(request: OTPVerifyRequest):
     logger.info(f"Verifying OTP for {request.request_id}")
     return otp_client.verify_otp(request.request_id, request.code)
@@ -139,29 +213,45 @@ def send_email_endpoint(request: EmailSendRequest, db: Session = Depends(get_db)
 class ChatRequest(BaseModel):
     message: str
     user_id: str = "visitor"
+    # Returned by the previous /chat reply; history is keyed on it, never on user_id
+    conversation_token: Optional[str] = None
 
-@app.post("/chat", tags=["Chat"])
+@app.post("/chat", tags=["Chat"], dependencies=[Depends(ratelimit.limit_chat)])
 def chat_endpoint(request: ChatRequest):
-    from .gemini_client import chat_with_gemini
+    from .gemini_client import chat_with_gemini, open_conversation
     logger.info("Processing chat request")
-    response = chat_with_gemini(request.message)
-    logger.info(f"Gemini Response: {response} (Type: {type(response)})")
-    return create_response(success=True, data={"response": str(response)})
+    data = {}
+    conversation_id = None
+    if settings.GEMINI_HISTORY_ENABLED:
+        # user_id is caller-chosen; only a server-issued token can reach stored history
+        conversation_id = data["conversation_token"] = open_conversation(request.conversation_token)
+    response = str(chat_with_gemini(request.message, conversation_id, visitor=request.user_id))
+    logger.info("Gemini response received", extra={"user_id": request.user_id, "response_chars": len(response)})
+    logger.debug(f"Gemini Response: {response}")
+    data["response"] = response
+    return create_response(success=True, data=data)
 
 class TriggerRequest(BaseModel):
     trigger: str = "default"
     user_id: str = "visitor"
     data: dict = {}
+    locale: str = "en"
 
-@app.post("/trigger", tags=["Chat"])
+@app.post("/trigger", tags=["Chat"], dependencies=[Depends(ratelimit.limit_chat)])
 def trigger_endpoint(request: TriggerRequest):
     logger.info(f"Processing trigger: {request.trigger} for user {request.user_id}")
     # Logic to handle different triggers can go here
     # For now, we return a generic response or forward to Gemini
     from .gemini_client import chat_with_gemini
-    
-    prompt = f"System Event: {request.trigger}. User Data: {request.data}. Generate a welcome message or appropriate response."
-    response = chat_with_gemini(prompt)
+
+    # Repeat event types are rendered from a cached template without calling Gemini
+    response = reply_templates.get_reply(
+        "trigger", request.trigger, request.locale, request.data,
+        f"System Event: {request.trigger}. Generate a welcome message or appropriate response."
+    )
+    if response is None:
+        prompt = f"System Event: {request.trigger}. User Data: {request.data}. Generate a welcome message or appropriate response."
+        response = chat_with_gemini(prompt, flow=f"trigger:{request.trigger}", visitor=request.user_id)
     
     return create_response(success=True, data={"reply": str(response)})
 
@@ -170,15 +260,30 @@ class ContextRequest(BaseModel):
     user_id: str = "visitor"
     question: str = ""
     answer: str = ""
+    locale: str = "en"
+    # Options offered for this step (e.g. bot buttons); only such answers can use a cached reply
+    choices: Optional[List[str]] = None
 
-@app.post("/context", tags=["Chat"])
+@app.post("/context", tags=["Chat"], dependencies=[Depends(ratelimit.limit_chat)])
 def context_endpoint(request: ContextRequest):
     logger.info(f"Processing context: {request.context_id} for user {request.user_id}")
     # Logic to handle context updates (e.g., collecting user info)
     from .gemini_client import chat_with_gemini
-    
-    prompt = f"Context: {request.context_id}. Question: {request.question}. User Answer: {request.answer}. Continue the conversation."
-    response = chat_with_gemini(prompt)
+
+    # Free-text answers are conversational input and always go to Gemini. An
+    # answer picked from a fixed choice set is part of the template shape, so
+    # each choice gets its own cached continuation.
+    response = None
+    answer = request.answer.strip().casefold()
+    if request.choices and answer in {c.strip().casefold() for c in request.choices}:
+        response = reply_templates.get_reply(
+            "context", request.context_id, request.locale, {},
+            f"Context: {request.context_id}. Question: {request.question}. User Answer: {request.answer}. Continue the conversation.",
+            fixed=f"{request.question}\n{answer}"
+        )
+    if response is None:
+        prompt = f"Context: {request.context_id}. Question: {request.question}. User Answer: {request.answer}. Continue the conversation."
+        response = chat_with_gemini(prompt, flow=f"context:{request.context_id}", visitor=request.user_id)
     
     return create_response(success=True, data={"reply": str(response)})
 
@@ -201,51 +306,54 @@ def root():
     return {"message": "Consulting Bot Backend is running"}
 
 @app.get("/health", tags=["General"])
-def health_check(db: Session = Depends(get_db)):
+async def health_check():
     """
-    Checks the health of the application and its dependencies.
+    Returns the latest dependency snapshot collected by the background prober.
     """
-    status = {
-        "status": "running",
-        "deployment_mode": settings.DEPLOYMENT_MODE,
-        "database": "unknown",
-        "google_creds": "unknown",
-        "vonage_api": "unknown",
-        "gemini_api": "unknown"
-    }
+    return create_response(success=True, data=health.get_snapshot())
 
-    # Check Database
-    try:
-        db.execute("SELECT 1")
-        status["database"] = "connected"
-    except Exception as e:
-        status["database"] = f"error: {str(e)}"
-        status["status"] = "degraded"
-
-    # Check Google Credentials
-    import os
-    import glob
-    if glob.glob("client_secret*.json"):
-         status["google_creds"] = "present"
-    else:
-         status["google_creds"] = "missing"
-         status["status"] = "degraded"
-
-    # Check Vonage
-    if os.getenv("VONAGE_API_KEY") and os.getenv("VONAGE_API_SECRET"):
-        status["vonage_api"] = "configured"
-    else:
-        status["vonage_api"] = "missing"
-        status["status"] = "degraded"
+@app.get("/live", tags=["General"])
+async def liveness_check():
+    """
+    Liveness probe: the process is up and serving requests.
+    """
+    return create_response(success=True, data={"status": "alive"})
 
-    # Check Gemini
-    if os.getenv("GEMINI_API_KEY"):
-        status["gemini_api"] = "configured"
-    else:
-        status["gemini_api"] = "missing"
-        status["status"] = "degraded"
+@app.get("/ready", tags=["General"])
+async def readiness_check():
+    """
+    Readiness probe: 200 once warm-up has completed and required dependencies
+    pass their latest probe, 503 otherwise.
+    """
+    state = dict(warmup.get_state(), dependencies_ready=health.dependencies_ready())
+    if not (state["ready"] and state["dependencies_ready"]):
+        return JSONResponse(
+            status_code=503,
+            content=create_response(success=False, error="Not ready", details=state)
+        )
+    return create_response(success=True, data=state)
 
-    return create_response(success=True, data=status)
+@app.get("/metrics", tags=["General"])
+async def metrics():
+    """
+    In-process performance counters.
+    """
+    return create_response(success=True, data={
+        "singleflight": singleflight.get_metrics(),
+        "availability": availability.index.stats(),
+        "reminders": reminders.scheduler.snapshot(),
+        "rate_limit": ratelimit.limiter.snapshot(),
+        "admission": admission.get_metrics(),
+        "gemini_tools": _gemini_tool_metrics(),
+        "reply_templates": reply_templates.get_metrics(),
+        "archive": archive.get_metrics(),
+        "slot_stream": slot_stream.hub.get_metrics(),
+    })
+
+def _gemini_tool_metrics():
+    # gemini_client is imported lazily elsewhere; only report once it is loaded
+    gc = sys.modules.get(f"{__package__}.gemini_client")
+    return gc.get_tool_metrics() if gc else {}
 
 # Simple verification endpoint for frontend connectivity checks
 @app.get("/verify", tags=["General"])
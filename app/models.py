@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Text, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
-from .database import Base
+from .database import Base, ArchiveBase
 import datetime
 
 class User(Base):
@@ -23,6 +23,16 @@ class Booking(Base):
     status = Column(String, default="confirmed") # confirmed, cancelled
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
+class Consultant(Base):
+    __tablename__ = "consultants"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String)
+    email = Column(String, unique=True, index=True)
+    calendar_id = Column(String) # Google calendar id, usually the consultant's email
+    active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
 class OAuthToken(Base):
     __tablename__ = "oauth_tokens"
 
@@ -44,6 +54,10 @@ class OTP(Base):
     phone_number = Column(String)
     status = Column(String) # pending, verified, failed
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    code_hash = Column(String) # sha256(salt + code + SECRET_KEY); the code itself is never stored
+    salt = Column(String)
+    expires_at = Column(DateTime)
+    attempts = Column(Integer, default=0)
 
 class Payment(Base):
     __tablename__ = "payments"
@@ -57,3 +71,130 @@ class Payment(Base):
     amount = Column(Integer)
     currency = Column(String, default="INR")
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, index=True) # "<scope>:<client key>"
+    fingerprint = Column(String) # Hash of the request payload
+    status = Column(String, default="in_progress") # in_progress, completed
+    response = Column(Text) # Stored JSON response
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+class CalendarEvent(Base):
+    """Local mirror of Google Calendar events, kept current with sync tokens."""
+    __tablename__ = "calendar_events"
+    __table_args__ = (
+        UniqueConstraint("calendar_id", "event_id", name="uq_calendar_event"),
+        Index("ix_calendar_events_window", "calendar_id", "start_time", "end_time"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    calendar_id = Column(String, default="primary")
+    event_id = Column(String)
+    status = Column(String) # confirmed, tentative, cancelled
+    transparency = Column(String, default="opaque") # opaque blocks time, transparent does not
+    summary = Column(String)
+    start_time = Column(DateTime) # UTC
+    end_time = Column(DateTime) # UTC
+    updated = Column(DateTime)
+
+class CalendarSyncState(Base):
+    __tablename__ = "calendar_sync_state"
+
+    id = Column(Integer, primary_key=True, index=True)
+    calendar_id = Column(String, unique=True, index=True)
+    sync_token = Column(String)
+    last_synced_at = Column(DateTime)
+
+class ReminderLog(Base):
+    """One row per reminder sent; the unique key stops two workers sending the same reminder."""
+    __tablename__ = "reminder_log"
+    __table_args__ = (UniqueConstraint("booking_id", "lead_minutes", name="uq_reminder"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    booking_id = Column(Integer, index=True)
+    lead_minutes = Column(Integer)
+    status = Column(String, default="sending") # sending, sent, failed
+    sent_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class LLMUsageRollup(Base):
+    """Hourly Gemini usage per flow and model, flushed from the in-memory counters."""
+    __tablename__ = "llm_usage_rollups"
+    __table_args__ = (UniqueConstraint("period_start", "flow", "model", name="uq_llm_usage_period"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    period_start = Column(DateTime, index=True) # UTC hour
+    flow = Column(String) # chat, trigger:<name>, context:<id>
+    model = Column(String)
+    calls = Column(Integer, default=0)
+    errors = Column(Integer, default=0)
+    model_calls = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    tool_calls = Column(Integer, default=0)
+    latency_ms = Column(Integer, default=0) # Sum; divide by calls for the mean
+    ttft_ms = Column(Integer, default=0) # Sum
+    max_latency_ms = Column(Integer, default=0)
+
+class ReplyTemplate(Base):
+    """Gemini-written reply template per trigger/context shape, rendered locally with visitor values."""
+    __tablename__ = "reply_templates"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, index=True) # See reply_templates.shape_key
+    kind = Column(String, index=True) # trigger, context
+    name = Column(String, index=True) # Trigger name or context_id
+    locale = Column(String, default="en")
+    version = Column(Integer, default=1) # Bumped on every regeneration
+    template = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime)
+
+class DailyRollup(Base):
+    """Daily reporting counters, maintained in the same transaction as booking/payment status changes."""
+    __tablename__ = "daily_rollups"
+    __table_args__ = (UniqueConstraint("day", "metric", "currency", name="uq_daily_rollup"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, index=True) # UTC creation day of the booking or payment
+    metric = Column(String) # bookings, bookings_cancelled, bookings_paid, payments, payments_paid, payments_failed, revenue
+    currency = Column(String, default="") # Payment metrics only
+    value = Column(Integer, default=0)
+
+class ArchivedBooking(ArchiveBase):
+    """Booking moved out of the hot table after the retention window (archive database)."""
+    __tablename__ = "archived_bookings"
+
+    id = Column(Integer, primary_key=True) # Same id as in bookings
+    user_email = Column(String, index=True)
+    event_id = Column(String)
+    start_time = Column(DateTime)
+    end_time = Column(DateTime)
+    status = Column(String)
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class ArchivedPayment(ArchiveBase):
+    __tablename__ = "archived_payments"
+
+    id = Column(Integer, primary_key=True) # Same id as in payments
+    booking_id = Column(Integer, index=True)
+    user_id = Column(Integer)
+    order_id = Column(String, index=True)
+    payment_id = Column(String)
+    status = Column(String)
+    amount = Column(Integer)
+    currency = Column(String)
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class DataVersion(Base):
+    """Change counters behind ETags (see data_version.py)."""
+    __tablename__ = "data_versions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True) # bookings, calendar
+    version = Column(Integer, default=0)
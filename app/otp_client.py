@@ -3,6 +3,9 @@ from vonage import Auth, Vonage
 from vonage_verify import VerifyRequest, SmsChannel
 from dotenv import load_dotenv
 from .utils import create_response
+from .database import SessionLocal
+from .config import settings
+from . import otp_engine, ratelimit, deadline
 
 load_dotenv()
 
@@ -25,6 +28,17 @@ def send_otp(number: str, brand: str = "ConsultingBot"):
     """
     Send OTP to the specified number.
     """
+    limited = ratelimit.enforce(("otp_phone", number))
+    if limited:
+        return limited
+
+    if settings.OTP_MODE == "local":
+        db = SessionLocal()
+        try:
+            return otp_engine.issue(db, number, brand)
+        finally:
+            db.close()
+
     if not VONAGE_API_KEY or VONAGE_API_KEY == "your_vonage_api_key":
         return create_response(success=False, error="Vonage API credentials missing")
 
@@ -33,7 +47,7 @@ def send_otp(number: str, brand: str = "ConsultingBot"):
 
     try:
         req = VerifyRequest(brand=brand, workflow=[SmsChannel(to=number)])
-        response = verify.start_verification(req)
+        response = deadline.run_with_timeout(verify.start_verification, req)
         # response is an object, need to check how to access request_id
         # Based on typical Vonage SDKs, it might be an object with attributes or a dict.
         # Let's assume object and try to access request_id, or convert to dict if needed.
@@ -52,6 +66,13 @@ def verify_otp(request_id: str, code: str):
     """
     Verify the OTP code.
     """
+    if settings.OTP_MODE == "local":
+        db = SessionLocal()
+        try:
+            return otp_engine.verify(db, request_id, code)
+        finally:
+            db.close()
+
     if not VONAGE_API_KEY or VONAGE_API_KEY == "your_vonage_api_key":
         return create_response(success=False, error="Vonage API credentials missing")
 
@@ -59,7 +80,7 @@ def verify_otp(request_id: str, code: str):
         return create_response(success=False, error="Vonage client not initialized. Check API keys.")
 
     try:
-        response = verify.check_code(request_id, code)
+        response = deadline.run_with_timeout(verify.check_code, request_id, code)
         # Assuming response indicates success if no exception is raised, or check status
         if response.status == "completed":
              return create_response(success=True, data={"message": "Verification successful"})
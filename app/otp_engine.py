@@ -0,0 +1,139 @@
+import abc
+import datetime
+import hashlib
+import hmac
+import logging
+import secrets
+import uuid
+from sqlalchemy.orm import Session
+from .models import OTP
+from .utils import create_response
+from .config import settings
+from . import deadline
+
+logger = logging.getLogger("consulting_bot.otp")
+
+class OTPTransport(abc.ABC):
+    """Delivers a code to a phone number. send() raises on delivery failure."""
+    name = "base"
+
+    @abc.abstractmethod
+    def send(self, phone_number: str, text: str):
+        ...
+
+class VonageSmsTransport(OTPTransport):
+    name = "vonage_sms"
+
+    def __init__(self, client, sender: str):
+        self.client = client
+        self.sender = sender
+
+    def send(self, phone_number: str, text: str):
+        from vonage_sms import SmsMessage
+        response = deadline.run_with_timeout(self.client.sms.send, SmsMessage(to=phone_number, from_=self.sender, text=text))
+        messages = getattr(response, "messages", None) or []
+        if messages and str(getattr(messages[0], "status", "0")) != "0":
+            raise RuntimeError(f"SMS rejected: {getattr(messages[0], 'error_text', messages[0].status)}")
+
+class LogTransport(OTPTransport):
+    """Development stand-in: writes the code to the log instead of sending it."""
+    name = "log"
+
+    def send(self, phone_number: str, text: str):
+        logger.info(f"OTP for {phone_number}: {text}")
+
+class SinkTransport(OTPTransport):
+    """Test sink: keeps every message in memory."""
+    name = "sink"
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, phone_number: str, text: str):
+        self.messages.append((phone_number, text))
+
+_transport = None
+
+def get_transport():
+    global _transport
+    if _transport is not None:
+        return _transport
+    from . import otp_client
+    name = settings.OTP_TRANSPORT or ("vonage_sms" if otp_client.client else "log")
+    if name == "vonage_sms":
+        if not otp_client.client:
+            return None
+        _transport = VonageSmsTransport(otp_client.client, settings.OTP_SMS_FROM)
+    elif name == "sink":
+        _transport = SinkTransport()
+    elif name == "log":
+        if settings.DEPLOYMENT_MODE == "PROD":
+            # Never write real codes to production logs
+            return None
+        _transport = LogTransport()
+    else:
+        return None
+    return _transport
+
+def set_transport(transport: OTPTransport):
+    """Overrides the delivery transport (tests, custom providers)."""
+    global _transport
+    _transport = transport
+
+def _hash(code: str, salt: str) -> str:
+    return hashlib.sha256(f"{salt}{code}{settings.SECRET_KEY}".encode("utf-8")).hexdigest()
+
+def issue(db: Session, phone_number: str, brand: str = "ConsultingBot"):
+    """Generates a code, stores its salted hash and delivers it. Returns a create_response dict."""
+    if not settings.SECRET_KEY and settings.DEPLOYMENT_MODE == "PROD":
+        # Without the pepper a leaked table lets every 6-digit code be brute-forced offline
+        logger.error("Refusing to issue OTP: SECRET_KEY is not set")
+        return create_response(success=False, error="OTP disabled: SECRET_KEY not set")
+    transport = get_transport()
+    if transport is None:
+        return create_response(success=False, error="OTP transport not configured")
+
+    code = "".join(secrets.choice("0123456789") for _ in range(settings.OTP_LENGTH))
+    salt = secrets.token_hex(16)
+    now = datetime.datetime.utcnow()
+    record = OTP(
+        request_id=uuid.uuid4().hex,
+        phone_number=phone_number,
+        status="pending",
+        code_hash=_hash(code, salt),
+        salt=salt,
+        expires_at=now + datetime.timedelta(seconds=settings.OTP_TTL_SECONDS),
+        attempts=0,
+    )
+
+    try:
+        transport.send(phone_number, f"Your {brand} verification code is {code}. It expires in {settings.OTP_TTL_SECONDS // 60} minutes.")
+    except Exception as e:
+        return create_response(success=False, error=str(e))
+
+    db.add(record)
+    db.commit()
+    return create_response(success=True, data={"request_id": record.request_id})
+
+def verify(db: Session, request_id: str, code: str):
+    """Checks a code against the stored hash by indexed request_id lookup. Returns a create_response dict."""
+    record = db.query(OTP).filter(OTP.request_id == request_id).first()
+    if not record or not record.code_hash:
+        return create_response(success=False, error="Unknown request_id")
+    if record.status != "pending":
+        return create_response(success=False, error=f"Status: {record.status}")
+    if record.expires_at and record.expires_at < datetime.datetime.utcnow():
+        record.status = "expired"
+        db.commit()
+        return create_response(success=False, error="Status: expired")
+
+    if hmac.compare_digest(record.code_hash, _hash(code, record.salt)):
+        record.status = "verified"
+        db.commit()
+        return create_response(success=True, data={"message": "Verification successful"})
+
+    record.attempts = (record.attempts or 0) + 1
+    if record.attempts >= settings.OTP_MAX_ATTEMPTS:
+        record.status = "failed"
+    db.commit()
+    return create_response(success=False, error="Invalid code")
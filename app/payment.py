@@ -3,7 +3,11 @@ from sqlalchemy.orm import Session
 from .database import get_db
 from .models import Payment, Booking
 from .utils import create_response
+from .idempotency import run_idempotent
+from .config import settings
+from . import deadline, rollups, archive, data_version
 from pydantic import BaseModel
+from typing import Optional
 import razorpay
 import os
 import hmac
@@ -31,14 +35,30 @@ class OrderCreateRequest(BaseModel):
     currency: str = "INR"
     user_id: int
     booking_id: int
+    # Client supplied; the Idempotency-Key header also works
+    idempotency_key: Optional[str] = None
 
 class PaymentVerifyRequest(BaseModel):
     razorpay_payment_id: str
     razorpay_order_id: str
     razorpay_signature: str
 
+def create_order_once(request: OrderCreateRequest, db: Session, idempotency_key: Optional[str] = None):
+    key = idempotency_key or request.idempotency_key
+    if key:
+        return run_idempotent("payment.create_order", key, request.dict(exclude={"idempotency_key"}), lambda: _create_order(request, db))
+    # No client key: one order per booking, amount and currency while retries are likely
+    key = f"{request.booking_id}|{request.amount}|{request.currency.upper()}"
+    return run_idempotent(
+        "payment.create_order", key, {"order": key}, lambda: _create_order(request, db),
+        ttl_seconds=settings.IDEMPOTENCY_DERIVED_TTL_SECONDS,
+    )
+
 @router.post("/payment/create-order", tags=["Payment"])
-def create_order(request: OrderCreateRequest, db: Session = Depends(get_db)):
+def create_order(request: OrderCreateRequest, db: Session = Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    return create_order_once(request, db, idempotency_key)
+
+def _create_order(request: OrderCreateRequest, db: Session):
     if not client:
         return create_response(success=False, error="Razorpay client not initialized. Check API keys.")
 
@@ -49,7 +69,7 @@ def create_order(request: OrderCreateRequest, db: Session = Depends(get_db)):
             "receipt": f"booking_{request.booking_id}",
             "payment_capture": 1
         }
-        order = client.order.create(data=data)
+        order = client.order.create(data=data, timeout=deadline.timeout())
         
         # Save to DB
         new_payment = Payment(
@@ -61,6 +81,7 @@ def create_order(request: OrderCreateRequest, db: Session = Depends(get_db)):
             status="created"
         )
         db.add(new_payment)
+        rollups.payment_status_changed(db, new_payment)
         db.commit()
         db.refresh(new_payment)
 
@@ -133,15 +154,22 @@ def verify_payment(request: PaymentVerifyRequest, db: Session = Depends(get_db))
 
         # Update DB
         payment = db.query(Payment).filter(Payment.order_id == request.razorpay_order_id).first()
+        if not payment and archive.find_archived_payment(request.razorpay_order_id):
+            return create_response(success=False, error="Payment is archived")
         if payment:
+            old_status = payment.status
             payment.status = "paid"
             payment.payment_id = request.razorpay_payment_id
+            rollups.payment_status_changed(db, payment, old_status)
             db.commit()
             
             # Update Booking Status
             booking = db.query(Booking).filter(Booking.id == payment.booking_id).first()
             if booking:
+                old_status = booking.status
                 booking.status = "confirmed_paid"
+                rollups.booking_status_changed(db, booking, old_status)
+                data_version.bump(db, data_version.BOOKINGS)
                 db.commit()
 
         return create_response(success=True, data={"payment_id": request.razorpay_payment_id}, message="Payment verified successfully")
@@ -167,22 +195,34 @@ async def payment_webhook(request: Request, db: Session = Depends(get_db)):
         payment_entity = payload.get('payment', {}).get('entity', {})
         order_id = payment_entity.get('order_id')
         
+        if event['event'] in ('payment.captured', 'payment.failed') and order_id:
+            if not db.query(Payment.id).filter(Payment.order_id == order_id).first() and archive.find_archived_payment(order_id):
+                # Late event for an archived order: acknowledge, the archive is read-only
+                return create_response(success=True, message="Webhook ignored: payment archived")
+
         if event['event'] == 'payment.captured':
             payment = db.query(Payment).filter(Payment.order_id == order_id).first()
             if payment:
+                old_status = payment.status
                 payment.status = "paid"
                 payment.payment_id = payment_entity.get('id')
+                rollups.payment_status_changed(db, payment, old_status)
                 db.commit()
                 
                 booking = db.query(Booking).filter(Booking.id == payment.booking_id).first()
                 if booking:
+                    old_status = booking.status
                     booking.status = "confirmed_paid"
+                    rollups.booking_status_changed(db, booking, old_status)
+                    data_version.bump(db, data_version.BOOKINGS)
                     db.commit()
                     
         elif event['event'] == 'payment.failed':
              payment = db.query(Payment).filter(Payment.order_id == order_id).first()
              if payment:
+                old_status = payment.status
                 payment.status = "failed"
+                rollups.payment_status_changed(db, payment, old_status)
                 db.commit()
 
         return create_response(success=True, message="Webhook processed")
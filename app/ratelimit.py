@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from fastapi import Request
+from .utils import create_response
+from .config import settings
+
+logger = logging.getLogger("consulting_bot.ratelimit")
+
+def _parse_rules(raw: str):
+    """Parses "name=burst/seconds,..." into {name: (capacity, refill_per_second)}."""
+    rules = {}
+    for pair in (raw or "").split(","):
+        try:
+            name, spec = pair.split("=", 1)
+            burst, period = spec.split("/", 1)
+            rules[name.strip()] = (float(burst), float(burst) / float(period))
+        except ValueError:
+            continue
+    return rules
+
+def _refill(tokens: float, updated: float, now: float, capacity: float, rate: float):
+    return min(capacity, tokens + (now - updated) * rate)
+
+class MemoryBucketStore:
+    """
+    Per-process buckets in an LRU map. When full, the least recently used
+    bucket is evicted; an idle bucket would have refilled anyway, so evicting
+    it only forgets state that no longer limits anyone.
+    """
+
+    def __init__(self, max_buckets: int):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict() # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float, cost: float = 1.0):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = _refill(tokens, updated, now, capacity, rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+class SqliteBucketStore:
+    """
+    Buckets in a small SQLite file shared by every worker on the host, so
+    limits hold across processes. Each take() is one IMMEDIATE transaction.
+    """
+
+    def __init__(self, path: str, max_buckets: int):
+        self.path = path
+        self.max_buckets = max_buckets
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_buckets_updated ON buckets (updated)")
+        self._takes = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, capacity: float, rate: float, cost: float = 1.0):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = _refill(row[0], row[1], now, capacity, rate) if row else capacity
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._takes += 1
+        if self._takes % 1000 == 0:
+            self._evict()
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def _evict(self):
+        conn = self._conn()
+        conn.execute(
+            "DELETE FROM buckets WHERE key IN (SELECT key FROM buckets ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+            (self.max_buckets,)
+        )
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+class RateLimiter:
+    def __init__(self, rules: dict, store):
+        self.rules = rules
+        self.store = store
+        self.stats = {"allowed": 0, "rejected": 0}
+
+    def check(self, policy: str, key: str, cost: float = 1.0):
+        """Returns (allowed, retry_after_seconds). Unknown policies and empty keys always pass."""
+        rule = self.rules.get(policy)
+        if not settings.RATE_LIMIT_ENABLED or rule is None or not key:
+            return True, 0.0
+        capacity, rate = rule
+        try:
+            allowed, retry_after = self.store.take(f"{policy}:{key}", capacity, rate, cost)
+        except Exception as e:
+            # Fail open: a limiter problem must not take the endpoint down
+            logger.warning(f"Rate limiter error for {policy}: {e}")
+            return True, 0.0
+        self.stats["allowed" if allowed else "rejected"] += 1
+        return allowed, retry_after
+
+    def snapshot(self):
+        return dict(self.stats, buckets=len(self.store), backend=type(self.store).__name__)
+
+def _build_limiter():
+    rules = _parse_rules(settings.RATE_LIMIT_RULES)
+    if settings.RATE_LIMIT_BACKEND == "sqlite":
+        try:
+            return RateLimiter(rules, SqliteBucketStore(settings.RATE_LIMIT_SQLITE_PATH, settings.RATE_LIMIT_MAX_BUCKETS))
+        except Exception as e:
+            logger.error(f"SQLite rate limit store unavailable, using memory: {e}")
+    return RateLimiter(rules, MemoryBucketStore(settings.RATE_LIMIT_MAX_BUCKETS))
+
+limiter = _build_limiter()
+
+def client_ip(request: Request) -> str:
+    """
+    The caller's address for per-IP buckets. X-Forwarded-For is client
+    controlled except for the entries our own proxies append, so only the
+    hop added by the outermost of TRUSTED_PROXY_HOPS proxies is used.
+    """
+    hops = settings.TRUSTED_PROXY_HOPS
+    if hops > 0:
+        forwarded = [h.strip() for h in request.headers.get("X-Forwarded-For", "").split(",") if h.strip()]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.client.host if request.client else ""
+
+class RateLimitExceeded(Exception):
+    def __init__(self, policy: str, retry_after: float):
+        super().__init__(policy)
+        self.policy = policy
+        self.retry_after = retry_after
+
+def rejection(retry_after: float):
+    """Envelope-compatible rejection; HTTP 200 like every other error for Deluge."""
+    return create_response(
+        success=False,
+        error="Too many requests. Please try again later.",
+        details={"retry_after_seconds": round(retry_after, 1)}
+    )
+
+def enforce(*checks):
+    """
+    Runs (policy, key) checks in order and returns a rejection response for
+    the first one that is exhausted, or None when all pass.
+    """
+    for policy, key in checks:
+        allowed, retry_after = limiter.check(policy, key)
+        if not allowed:
+            logger.info(f"Rate limited by {policy}")
+            return rejection(retry_after)
+    return None
+
+def _enforce_or_raise(*checks):
+    for policy, key in checks:
+        allowed, retry_after = limiter.check(policy, key)
+        if not allowed:
+            logger.info(f"Rate limited by {policy}")
+            raise RateLimitExceeded(policy, retry_after)
+
+async def _json_body(request: Request) -> dict:
+    try:
+        body = await request.json()
+    except Exception:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+# Async dependencies run on the event loop, so an over-limit caller is turned
+# away before the endpoint takes a threadpool worker. The bucket check itself
+# may block (SQLite backend), so it runs in a thread.
+
+async def _check(*checks):
+    await asyncio.to_thread(_enforce_or_raise, *checks)
+
+async def limit_chat(request: Request):
+    body = await _json_body(request)
+    user_id = body.get("user_id")
+    if user_id == "visitor":
+        # Default id shared by every anonymous visitor; the IP bucket covers them
+        user_id = None
+    await _check(("chat_user", user_id), ("chat_ip", client_ip(request)))
+
+async def limit_otp_send(request: Request):
+    await _check(("otp_send_ip", client_ip(request)))
+
+async def limit_otp_verify(request: Request):
+    # Separate budget, so checking codes does not use up sends
+    await _check(("otp_verify_ip", client_ip(request)))
@@ -0,0 +1,221 @@
+import datetime
+import heapq
+import logging
+import threading
+import time
+from sqlalchemy.exc import IntegrityError
+from .database import SessionLocal
+from .models import Booking, ReminderLog
+from .config import settings
+from . import gmail_client
+
+logger = logging.getLogger("consulting_bot.reminders")
+
+ACTIVE_STATUSES = ("confirmed", "confirmed_paid")
+
+# Reminders that fell due less than this long ago are still sent (e.g. during a restart)
+GRACE_SECONDS = 600
+# A reminder popped more than this long before its due time belongs to an older start time
+RESCHEDULE_TOLERANCE_SECONDS = 60
+
+def _epoch(dt: datetime.datetime) -> float:
+    """Unix time of a booking datetime; naive values are UTC as stored in the DB."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+class ReminderScheduler:
+    """
+    Timer heap of upcoming reminders.
+
+    Entries are (due_ts, booking_id, lead_minutes, version). Rescheduling or
+    cancelling a booking bumps/removes its version instead of searching the
+    heap; stale entries are discarded when they reach the top. A single thread
+    sleeps until the earliest entry is due, so the cost per reminder does not
+    depend on how many bookings exist.
+    """
+
+    def __init__(self, leads: list, batch_size: int):
+        self.leads = sorted(set(leads), reverse=True)
+        self.batch_size = batch_size
+        self._heap = []
+        self._versions = {} # (booking_id, lead) -> version
+        self._next_version = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.stats = {"scheduled": 0, "sent": 0, "failed": 0, "skipped": 0}
+
+    def schedule(self, booking_id: int, start: datetime.datetime):
+        now = time.time()
+        start_ts = _epoch(start)
+        with self._cond:
+            for lead in self.leads:
+                key = (booking_id, lead)
+                self._versions.pop(key, None)
+                due = start_ts - lead * 60
+                if start_ts <= now or due < now - GRACE_SECONDS:
+                    continue
+                self._next_version += 1
+                self._versions[key] = self._next_version
+                heapq.heappush(self._heap, (due, booking_id, lead, self._next_version))
+                self.stats["scheduled"] += 1
+            self._cond.notify()
+
+    def cancel(self, booking_id: int):
+        with self._cond:
+            for lead in self.leads:
+                self._versions.pop((booking_id, lead), None)
+            self._cond.notify()
+
+    def load_from_db(self):
+        """Rebuilds the heap from upcoming active bookings, e.g. after a restart."""
+        db = SessionLocal()
+        try:
+            now = datetime.datetime.utcnow()
+            rows = db.query(Booking.id, Booking.start_time).filter(
+                Booking.status.in_(ACTIVE_STATUSES),
+                Booking.start_time > now
+            ).all()
+            sent = set(db.query(ReminderLog.booking_id, ReminderLog.lead_minutes).filter(
+                ReminderLog.booking_id.in_([r[0] for r in rows])
+            ).all()) if rows else set()
+        finally:
+            db.close()
+        for booking_id, start in rows:
+            self.schedule(booking_id, start)
+        with self._cond:
+            for key in sent:
+                self._versions.pop(key, None)
+        logger.info(f"Loaded reminders for {len(rows)} upcoming bookings")
+
+    def _pop_due(self):
+        """Blocks until reminders are due; returns up to batch_size (booking_id, lead) pairs."""
+        with self._cond:
+            while not self._stopping:
+                while self._heap and self._versions.get(self._heap[0][1:3]) != self._heap[0][3]:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    self._cond.wait(timeout=delay)
+                    continue
+                due = []
+                while self._heap and len(due) < self.batch_size and self._heap[0][0] <= time.time():
+                    _, booking_id, lead, version = heapq.heappop(self._heap)
+                    if self._versions.get((booking_id, lead)) == version:
+                        del self._versions[(booking_id, lead)]
+                        due.append((booking_id, lead))
+                if due:
+                    return due
+            return []
+
+    def _claim(self, db, booking_id: int, lead: int) -> bool:
+        db.add(ReminderLog(booking_id=booking_id, lead_minutes=lead, status="sending"))
+        try:
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+            return False
+
+    def _send(self, due: list):
+        db = SessionLocal()
+        try:
+            bookings = {b.id: b for b in db.query(Booking).filter(Booking.id.in_({bid for bid, _ in due})).all()}
+            messages, claimed, rescheduled = [], {}, set()
+            now = time.time()
+            for booking_id, lead in due:
+                booking = bookings.get(booking_id)
+                # Re-check against the DB: another worker may have moved or cancelled it
+                if not booking or booking.status not in ACTIVE_STATUSES or _epoch(booking.start_time) <= now:
+                    self.stats["skipped"] += 1
+                    continue
+                if _epoch(booking.start_time) - lead * 60 > now + RESCHEDULE_TOLERANCE_SECONDS:
+                    # Moved to a later time: this entry was queued for the old start
+                    self.stats["skipped"] += 1
+                    if booking_id not in rescheduled:
+                        rescheduled.add(booking_id)
+                        self.schedule(booking_id, booking.start_time)
+                    continue
+                if not self._claim(db, booking_id, lead):
+                    self.stats["skipped"] += 1
+                    continue
+                request_id = f"{booking_id}-{lead}"
+                claimed[request_id] = (booking_id, lead)
+                start = booking.start_time.strftime('%Y-%m-%d %H:%M')
+                messages.append((
+                    request_id,
+                    booking.user_email,
+                    f"Reminder: your consulting session on {start} UTC",
+                    f"This is a reminder of your consulting session (booking #{booking_id}) starting at {start} UTC."
+                ))
+            if not messages:
+                return
+
+            results = gmail_client.send_emails_batch(db, messages)
+            for request_id, (booking_id, lead) in claimed.items():
+                error = "Authentication failed" if results is None else results.get(request_id, "No response")
+                log = db.query(ReminderLog).filter(ReminderLog.booking_id == booking_id, ReminderLog.lead_minutes == lead).first()
+                if log:
+                    log.status = "failed" if error else "sent"
+                if error:
+                    self.stats["failed"] += 1
+                    logger.warning(f"Reminder for booking {booking_id} ({lead} min) failed: {error}")
+                else:
+                    self.stats["sent"] += 1
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Reminder batch failed: {e}")
+        finally:
+            db.close()
+
+    def _run(self):
+        while True:
+            due = self._pop_due()
+            if not due:
+                return
+            self._send(due)
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping = False
+        self.load_from_db()
+        self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread = None
+
+    def snapshot(self):
+        with self._cond:
+            pending = len(self._versions)
+            next_due = min((e[0] for e in self._heap if self._versions.get(e[1:3]) == e[3]), default=None)
+        return dict(self.stats, pending=pending, next_due=next_due)
+
+scheduler = ReminderScheduler(settings.REMINDER_LEAD_MINUTES, settings.REMINDER_BATCH_SIZE)
+
+def on_booking_change(action: str, booking, previous: tuple = None):
+    """bookings listener: keeps the heap in step with creates, reschedules and cancellations."""
+    if action == "cancelled":
+        scheduler.cancel(booking.id)
+    else:
+        # A rescheduled booking gets fresh reminders at its new time
+        if action == "updated":
+            _forget_sent(booking.id)
+        scheduler.schedule(booking.id, booking.start_time)
+
+def _forget_sent(booking_id: int):
+    db = SessionLocal()
+    try:
+        db.query(ReminderLog).filter(ReminderLog.booking_id == booking_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
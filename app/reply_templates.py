@@ -0,0 +1,164 @@
+import datetime
+import hashlib
+import json
+import logging
+import re
+import threading
+from .database import SessionLocal
+from .models import ReplyTemplate
+from .singleflight import SingleFlight
+from .config import settings
+
+logger = logging.getLogger("consulting_bot.reply_templates")
+
+PLACEHOLDER = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+FIELD_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+MAX_CACHED = 1000
+
+# Concurrent first requests for the same shape share one Gemini call
+generate_flight = SingleFlight("reply_templates")
+
+_lock = threading.Lock()
+_cache = {} # shape key -> (template, version, expires_at, kind, name)
+_stats = {"hits": 0, "db_hits": 0, "generated": 0, "rejected": 0, "bypassed": 0}
+
+def template_fields(data: dict):
+    """Visitor fields that can become placeholders: short scalar values under plain names."""
+    return sorted(
+        k for k, v in (data or {}).items()
+        if FIELD_NAME.match(str(k)) and isinstance(v, (str, int, float)) and not isinstance(v, bool) and len(str(v)) <= 200
+    )
+
+def shape_key(kind: str, name: str, locale: str, fields: list, fixed: str = "") -> str:
+    """
+    Identifies replies that differ only in visitor values: event kind and name,
+    locale, the set of field names, and any fixed text (e.g. the bot's question).
+    """
+    raw = json.dumps([settings.REPLY_TEMPLATE_VERSION, kind, name, (locale or "en").lower(), fields, fixed])
+    return f"{kind}:{name}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:24]}"
+
+def render(template: str, values: dict) -> str:
+    return PLACEHOLDER.sub(lambda m: str(values.get(m.group(1), "")), template)
+
+def _valid(template: str, fields: list) -> bool:
+    if not template or template.startswith("Error"):
+        return False
+    used = set(PLACEHOLDER.findall(template))
+    # A placeholder Gemini invented would render as an empty string
+    return used <= set(fields)
+
+def _load(key: str):
+    now = datetime.datetime.utcnow()
+    with _lock:
+        entry = _cache.get(key)
+        if entry and entry[2] > now:
+            _stats["hits"] += 1
+            return entry[0]
+    db = SessionLocal()
+    try:
+        row = db.query(ReplyTemplate).filter(ReplyTemplate.key == key).first()
+        if row and row.expires_at and row.expires_at > now:
+            with _lock:
+                _cache[key] = (row.template, row.version, row.expires_at, row.kind, row.name)
+                _stats["db_hits"] += 1
+            return row.template
+    finally:
+        db.close()
+    return None
+
+def _store(key: str, kind: str, name: str, locale: str, template: str):
+    expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=settings.REPLY_TEMPLATE_TTL_SECONDS)
+    db = SessionLocal()
+    try:
+        row = db.query(ReplyTemplate).filter(ReplyTemplate.key == key).first()
+        if not row:
+            row = ReplyTemplate(key=key, kind=kind, name=name, locale=locale, version=0)
+            db.add(row)
+        row.version = (row.version or 0) + 1
+        row.template = template
+        row.created_at = datetime.datetime.utcnow()
+        row.expires_at = expires_at
+        db.commit()
+        version = row.version
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Could not persist reply template {key}: {e}")
+        version = 0
+    finally:
+        db.close()
+    with _lock:
+        if len(_cache) >= MAX_CACHED:
+            now = datetime.datetime.utcnow()
+            for stale in [k for k, e in _cache.items() if e[2] <= now] or [next(iter(_cache))]:
+                del _cache[stale]
+        _cache[key] = (template, version, expires_at, kind, name)
+
+def _template_prompt(instruction: str, locale: str, fields: list) -> str:
+    placeholders = ", ".join("{{" + f + "}}" for f in fields) or "none"
+    return (
+        f"{instruction}\n"
+        f"Write the reply in locale '{locale}' as a reusable template for any visitor. "
+        f"Where a visitor's value belongs, use exactly one of these placeholders: {placeholders}. "
+        "Use no other {{...}} placeholders. Output only the message text."
+    )
+
+def _generate(key: str, kind: str, name: str, locale: str, instruction: str, fields: list):
+    from .gemini_client import generate_text
+    # No tools: a template prompt must not book, send OTPs or have tool output cached.
+    # None in demo mode, whose echo replies must not become templates either.
+    template = generate_text(_template_prompt(instruction, locale, fields), flow=f"template:{kind}:{name}")
+    if template is None:
+        return None
+    template = template.strip()
+    if not _valid(template, fields):
+        with _lock:
+            _stats["rejected"] += 1
+        logger.warning(f"Discarded reply template for {kind} '{name}'")
+        return None
+    _store(key, kind, name, locale, template)
+    with _lock:
+        _stats["generated"] += 1
+    return template
+
+def get_reply(kind: str, name: str, locale: str, values: dict, instruction: str, fixed: str = ""):
+    """
+    Renders the cached template for this reply shape with the visitor's values.
+    On a miss, Gemini is asked once, with `instruction` and the field names but
+    no visitor values, for a template using {{field}} placeholders.
+    Returns None when no usable template exists; the caller then asks Gemini directly.
+    """
+    if not settings.REPLY_TEMPLATES_ENABLED:
+        with _lock:
+            _stats["bypassed"] += 1
+        return None
+    fields = template_fields(values)
+    key = shape_key(kind, name, locale, fields, fixed)
+    template = _load(key)
+    if template is None:
+        template = generate_flight.do(key, _generate, key, kind, name, locale, instruction, fields)
+    if template is None:
+        return None
+    return render(template, values)
+
+def invalidate(kind: str = None, name: str = None):
+    """Drops cached templates (all, or one kind/name) so the next request regenerates them."""
+    with _lock:
+        for key in [k for k, e in _cache.items() if (kind is None or e[3] == kind) and (name is None or e[4] == name)]:
+            del _cache[key]
+    db = SessionLocal()
+    try:
+        query = db.query(ReplyTemplate)
+        if kind:
+            query = query.filter(ReplyTemplate.kind == kind)
+        if name:
+            query = query.filter(ReplyTemplate.name == name)
+        count = query.delete(synchronize_session=False)
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+def get_metrics():
+    with _lock:
+        return dict(_stats, cached=len(_cache))
@@ -0,0 +1,184 @@
+import argparse
+import datetime
+import logging
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .database import SessionLocal, ArchiveSessionLocal
+from .models import Booking, Payment, DailyRollup, ArchivedBooking, ArchivedPayment
+
+logger = logging.getLogger("consulting_bot.rollups")
+
+# Bookings are counted on the day they were created (cohorts), so a later
+# cancellation or payment updates that day's row. The incremental updates and
+# a backfill from the current table state therefore give the same numbers.
+BOOKING_STATUS_METRICS = {"cancelled": "bookings_cancelled", "confirmed_paid": "bookings_paid"}
+PAYMENT_STATUS_METRICS = {"paid": "payments_paid", "failed": "payments_failed"}
+
+def _day(value) -> datetime.date:
+    if value is None:
+        return datetime.datetime.utcnow().date()
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+def _bump(db: Session, day: datetime.date, metric: str, delta: int, currency: str = ""):
+    """Adds delta to one rollup cell inside the caller's transaction (atomic upsert where supported)."""
+    if not delta:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(DailyRollup).values(day=day, metric=metric, currency=currency, value=delta)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["day", "metric", "currency"],
+            set_={"value": DailyRollup.value + delta},
+        )
+        db.execute(stmt)
+        return
+    row = db.query(DailyRollup).filter(
+        DailyRollup.day == day, DailyRollup.metric == metric, DailyRollup.currency == currency
+    ).with_for_update().first()
+    if row:
+        row.value = (row.value or 0) + delta
+    else:
+        db.add(DailyRollup(day=day, metric=metric, currency=currency, value=delta))
+
+def booking_status_changed(db: Session, booking: Booking, old_status: str = None):
+    """
+    Call before committing a booking insert (old_status None) or status change.
+    Runs in the same transaction, so the rollups cannot drift from the table.
+    """
+    new_status = booking.status
+    if old_status == new_status:
+        return
+    day = _day(booking.created_at)
+    if old_status is None:
+        _bump(db, day, "bookings", 1)
+    for status, delta in ((old_status, -1), (new_status, 1)):
+        metric = BOOKING_STATUS_METRICS.get(status)
+        if metric:
+            _bump(db, day, metric, delta)
+
+def payment_status_changed(db: Session, payment: Payment, old_status: str = None):
+    """As booking_status_changed, for payments: counts per currency and paid revenue."""
+    new_status = payment.status
+    if old_status == new_status:
+        return
+    day = _day(payment.created_at)
+    currency = payment.currency or "INR"
+    if old_status is None:
+        _bump(db, day, "payments", 1, currency)
+    for status, delta in ((old_status, -1), (new_status, 1)):
+        metric = PAYMENT_STATUS_METRICS.get(status)
+        if metric:
+            _bump(db, day, metric, delta, currency)
+        if status == "paid":
+            _bump(db, day, "revenue", delta * (payment.amount or 0), currency)
+
+def _aggregate(db: Session, booking_model, payment_model, since: datetime.date, add):
+    booking_day = func.date(booking_model.created_at)
+    query = db.query(booking_day, booking_model.status, func.count(booking_model.id)).group_by(booking_day, booking_model.status)
+    if since:
+        query = query.filter(booking_model.created_at >= datetime.datetime.combine(since, datetime.time()))
+    for day, status, count in query:
+        add(day, "bookings", count)
+        if status in BOOKING_STATUS_METRICS:
+            add(day, BOOKING_STATUS_METRICS[status], count)
+
+    payment_day = func.date(payment_model.created_at)
+    query = db.query(
+        payment_day, payment_model.currency, payment_model.status, func.count(payment_model.id), func.sum(payment_model.amount)
+    ).group_by(payment_day, payment_model.currency, payment_model.status)
+    if since:
+        query = query.filter(payment_model.created_at >= datetime.datetime.combine(since, datetime.time()))
+    for day, currency, status, count, amount in query:
+        currency = currency or "INR"
+        add(day, "payments", count, currency)
+        if status in PAYMENT_STATUS_METRICS:
+            add(day, PAYMENT_STATUS_METRICS[status], count, currency)
+        if status == "paid":
+            add(day, "revenue", amount, currency)
+
+def backfill(db: Session, since: datetime.date = None):
+    """
+    Recomputes the rollups from bookings and payments, hot and archived (for
+    days >= since, or all history), in one transaction. Returns the number of
+    rollup rows written.
+    """
+    cells = {}
+
+    def add(day, metric, value, currency=""):
+        key = (_day(day), metric, currency)
+        cells[key] = cells.get(key, 0) + int(value or 0)
+
+    _aggregate(db, Booking, Payment, since, add)
+    cold = ArchiveSessionLocal()
+    try:
+        _aggregate(cold, ArchivedBooking, ArchivedPayment, since, add)
+    finally:
+        cold.close()
+
+    existing = db.query(DailyRollup)
+    if since:
+        existing = existing.filter(DailyRollup.day >= since)
+    existing.delete(synchronize_session=False)
+    for (day, metric, currency), value in cells.items():
+        db.add(DailyRollup(day=day, metric=metric, currency=currency, value=value))
+    db.commit()
+    logger.info(f"Backfilled {len(cells)} rollup rows" + (f" since {since}" if since else ""))
+    return len(cells)
+
+def _rate(part: int, whole: int):
+    return round(part / whole, 4) if whole else None
+
+def daily_report(db: Session, start: datetime.date, end: datetime.date):
+    """Per-day dashboard figures for [start, end], read from the rollup table only."""
+    rows = db.query(DailyRollup).filter(DailyRollup.day >= start, DailyRollup.day <= end).all()
+    days = {}
+    for row in rows:
+        day = days.setdefault(row.day, {"bookings": 0, "bookings_cancelled": 0, "bookings_paid": 0, "payments": {}})
+        if row.currency:
+            day["payments"].setdefault(row.currency, {}).setdefault(row.metric, 0)
+            day["payments"][row.currency][row.metric] += row.value or 0
+        else:
+            day[row.metric] = day.get(row.metric, 0) + (row.value or 0)
+
+    report, totals = [], {"bookings": 0, "bookings_cancelled": 0, "bookings_paid": 0, "revenue": {}}
+    for day in sorted(days):
+        figures = days[day]
+        for key in ("bookings", "bookings_cancelled", "bookings_paid"):
+            totals[key] += figures[key]
+        for currency, p in figures["payments"].items():
+            p["paid_conversion"] = _rate(p.get("payments_paid", 0), p.get("payments", 0))
+            totals["revenue"][currency] = totals["revenue"].get(currency, 0) + p.get("revenue", 0)
+        report.append(dict(
+            figures,
+            day=day.isoformat(),
+            cancellation_rate=_rate(figures["bookings_cancelled"], figures["bookings"]),
+            paid_conversion=_rate(figures["bookings_paid"], figures["bookings"]),
+        ))
+    totals["cancellation_rate"] = _rate(totals["bookings_cancelled"], totals["bookings"])
+    totals["paid_conversion"] = _rate(totals["bookings_paid"], totals["bookings"])
+    return {"days": report, "totals": totals}
+
+if __name__ == "__main__":
+    # python -m app.rollups --backfill [--since YYYY-MM-DD]
+    parser = argparse.ArgumentParser(description="Maintain the daily reporting rollups")
+    parser.add_argument("--backfill", action="store_true", help="Recompute rollups from bookings and payments")
+    parser.add_argument("--since", type=datetime.date.fromisoformat, help="Only recompute days from this date (UTC)")
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.error("nothing to do; pass --backfill")
+    from .database import engine, Base, archive_engine, ArchiveBase
+    Base.metadata.create_all(bind=engine)
+    ArchiveBase.metadata.create_all(bind=archive_engine)
+    session = SessionLocal()
+    try:
+        print(f"Wrote {backfill(session, args.since)} rollup rows")
+    finally:
+        session.close()
@@ -0,0 +1,98 @@
+import asyncio
+import inspect
+import threading
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+from . import deadline
+
+# Every group by name, for metrics
+_groups = {}
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait for and share its result (or exception). Nothing is kept
+    after the call completes, so there is no staleness as with a TTL cache.
+    Usable from threadpool code (do) and from async code (do_async); both share
+    the same in-flight table.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {"calls": 0, "executions": 0, "shared": 0, "errors": 0}
+        _groups[name] = self
+
+    def _join(self, key):
+        """Returns (future, is_leader)."""
+        with self._lock:
+            self.stats["calls"] += 1
+            fut = self._calls.get(key)
+            if fut is not None:
+                self.stats["shared"] += 1
+                return fut, False
+            fut = Future()
+            self._calls[key] = fut
+            self.stats["executions"] += 1
+            return fut, True
+
+    def _finish(self, key, fut: Future, result=None, exc: BaseException = None):
+        with self._lock:
+            self._calls.pop(key, None)
+            if exc is not None:
+                self.stats["errors"] += 1
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+
+    def do(self, key, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) unless an identical call is already in flight."""
+        fut, leader = self._join(key)
+        if not leader:
+            # A follower waits no longer than its own request's deadline
+            left = deadline.remaining()
+            try:
+                return fut.result(timeout=None if left is None else max(0.0, left))
+            except FuturesTimeout:
+                raise deadline.DeadlineExceeded(f"Timed out waiting for shared {self.name} call")
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, fut, exc=e)
+            raise
+        self._finish(key, fut, result=result)
+        return result
+
+    async def do_async(self, key, func, *args, **kwargs):
+        """Async variant; func may be a coroutine function or a blocking callable (run in a thread)."""
+        fut, leader = self._join(key)
+        if not leader:
+            left = deadline.remaining()
+            # shield: timing out must not cancel the leader's future for the other waiters
+            try:
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(fut)), None if left is None else max(0.0, left))
+            except asyncio.TimeoutError:
+                raise deadline.DeadlineExceeded(f"Timed out waiting for shared {self.name} call")
+        try:
+            if inspect.iscoroutinefunction(func):
+                result = await func(*args, **kwargs)
+            else:
+                result = await asyncio.to_thread(func, *args, **kwargs)
+        except BaseException as e:
+            self._finish(key, fut, exc=e)
+            raise
+        self._finish(key, fut, result=result)
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats, inflight=len(self._calls))
+        data["shared_ratio"] = round(data["shared"] / data["calls"], 3) if data["calls"] else 0.0
+        return data
+
+def get_metrics():
+    """Coalescing counters for every group."""
+    return {name: group.snapshot() for name, group in _groups.items()}
@@ -0,0 +1,230 @@
+import asyncio
+import datetime
+import logging
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from .database import SessionLocal
+from .calendar_client import get_free_busy
+from .conditional import dumps
+from . import availability
+from .availability import SLOT_MINUTES, to_minute
+from .config import settings
+
+router = APIRouter()
+
+logger = logging.getLogger("consulting_bot.slot_stream")
+
+# Changed windows per publish above which clients are told to resync instead
+MAX_DELTA_WINDOWS = 50
+
+# Protocol (JSON text frames):
+#   client -> {"action": "subscribe", "time_min": ..., "time_max": ...}   (again to change range)
+#   server -> {"type": "snapshot", "time_min", "time_max", "slots"}      full range, once per subscribe
+#             {"type": "delta", "start", "end", "slots"}                  replaces the slots inside [start, end)
+#             {"type": "invalidate", "start", "end"}                      refetch [start, end) via /slots/get
+#             {"type": "resync"}                                          updates were dropped; refetch the range
+#             {"type": "error", "error"}
+
+def _parse(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+class Subscriber:
+    """
+    One socket. Messages go through a bounded queue drained by a sender task,
+    so a slow client never blocks the fan-out: when the queue is full it is
+    collapsed into a single resync message.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=settings.SLOT_STREAM_QUEUE_SIZE)
+        self.range = None # (start, end, start minute, end minute)
+        self._held = None # Deltas raised while the snapshot is computed
+
+    def watch(self, time_min: str, time_max: str):
+        start, end = _parse(time_min), _parse(time_max)
+        if end <= start:
+            raise ValueError("time_max must be after time_min")
+        if end - start > datetime.timedelta(days=settings.SLOT_STREAM_MAX_DAYS):
+            raise ValueError(f"Range is limited to {settings.SLOT_STREAM_MAX_DAYS} days")
+        self.range = (start, end, to_minute(start), to_minute(end))
+        self._held = []
+
+    def release(self, snapshot: dict):
+        """Sends the snapshot, then the deltas that arrived while it was computed (they are newer)."""
+        held, self._held = self._held or [], None
+        self.put(snapshot)
+        for message in held:
+            self.put(message)
+
+    def put(self, message: dict):
+        if self._held is not None:
+            if len(self._held) >= settings.SLOT_STREAM_QUEUE_SIZE:
+                self._held = [{"type": "resync"}]
+                hub.stats["resyncs"] += 1
+            self._held.append(message)
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+            hub.stats["resyncs"] += 1
+
+    async def run_sender(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(dumps(message).decode("utf-8")), settings.SLOT_STREAM_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                hub.stats["slow_closed"] += 1
+                logger.warning("Closing slot stream client that stopped reading")
+                return
+            hub.stats["sent"] += 1
+
+    def delta(self, lo: int, hi: int):
+        """The change message for epoch minutes [lo, hi), widened to this client's slot grid, or None if outside its range."""
+        start, end, sub_lo, sub_hi = self.range
+        if hi <= sub_lo or lo >= sub_hi:
+            return None
+        first = max(0, (lo - sub_lo) // SLOT_MINUTES)
+        last = -(-(min(hi, sub_hi) - sub_lo) // SLOT_MINUTES)
+        window_start = start + datetime.timedelta(minutes=first * SLOT_MINUTES)
+        window_end = min(end, start + datetime.timedelta(minutes=last * SLOT_MINUTES))
+        slots = availability.index.free_slots(window_start, window_end)
+        if slots is None:
+            return {"type": "invalidate", "start": window_start.isoformat(), "end": window_end.isoformat()}
+        return {"type": "delta", "start": window_start.isoformat(), "end": window_end.isoformat(), "slots": slots}
+
+class SlotHub:
+    """
+    Fan-out of availability changes to subscribed sockets. Changes are raised
+    from worker threads (sync endpoints, calendar sync); they are handed to the
+    event loop, which owns the subscriber set and computes each client's delta
+    from the availability index.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._loop = None
+        self.stats = {"published": 0, "sent": 0, "resyncs": 0, "slow_closed": 0, "rejected": 0}
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def add(self, subscriber: Subscriber) -> bool:
+        if len(self._subscribers) >= settings.SLOT_STREAM_MAX_CLIENTS:
+            self.stats["rejected"] += 1
+            return False
+        self._subscribers.add(subscriber)
+        return True
+
+    def discard(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def _dispatch(self, callback, *args):
+        loop = self._loop
+        if loop is None or not self._subscribers:
+            return
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError: # Loop closed during shutdown
+            pass
+
+    def publish(self, calendar_id: str, windows: list):
+        """availability change listener; /slots/get (and so the stream) serves the primary calendar."""
+        if calendar_id != "primary":
+            return
+        if len(windows) > MAX_DELTA_WINDOWS:
+            # A rebuild that changed much of the horizon: one refetch beats many deltas
+            self.resync_all()
+        else:
+            self._dispatch(self._fanout, list(windows))
+
+    def resync_all(self):
+        self._dispatch(self._fanout_resync)
+
+    def _fanout(self, windows: list):
+        self.stats["published"] += 1
+        for subscriber in list(self._subscribers):
+            if subscriber.range is None:
+                continue
+            for lo, hi in windows:
+                message = subscriber.delta(lo, hi)
+                if message:
+                    subscriber.put(message)
+
+    def _fanout_resync(self):
+        self.stats["published"] += 1
+        for subscriber in list(self._subscribers):
+            if subscriber.range is not None:
+                subscriber.put({"type": "resync"})
+
+    def get_metrics(self):
+        return dict(self.stats, clients=len(self._subscribers))
+
+hub = SlotHub()
+
+def on_booking_change(action: str, booking, previous: tuple = None):
+    """
+    bookings listener for when the availability index is not built: its change
+    listener then never fires, so clients are told to refetch instead.
+    """
+    if availability.index.built_at is not None:
+        return
+    intervals = [(booking.start_time, booking.end_time)] + ([previous] if previous else [])
+    if (action == "updated" and not previous) or any(s is None or e is None for s, e in intervals):
+        hub.resync_all()
+    else:
+        hub.publish("primary", [(to_minute(s), to_minute(e)) for s, e in intervals])
+
+def _snapshot(time_min: str, time_max: str):
+    db = SessionLocal()
+    try:
+        return get_free_busy(db, time_min, time_max)
+    finally:
+        db.close()
+
+async def _receive(websocket: WebSocket, subscriber: Subscriber):
+    while True:
+        message = await websocket.receive_json()
+        if not isinstance(message, dict) or message.get("action") != "subscribe":
+            subscriber.put({"type": "error", "error": "Unknown action"})
+            continue
+        time_min, time_max = message.get("time_min"), message.get("time_max")
+        try:
+            subscriber.watch(str(time_min), str(time_max))
+        except (TypeError, ValueError) as e:
+            subscriber.range = None
+            subscriber.put({"type": "error", "error": str(e)})
+            continue
+        result = await asyncio.to_thread(_snapshot, time_min, time_max)
+        if not result.get("success"):
+            subscriber.range = None
+            subscriber.release({"type": "error", "error": result.get("error")})
+            continue
+        subscriber.release({"type": "snapshot", "time_min": time_min, "time_max": time_max, "slots": result["data"]["slots"]})
+
+@router.websocket("/ws/slots")
+async def slots_socket(websocket: WebSocket):
+    """Live availability: one subscribed range per socket, pushed as slot deltas."""
+    await websocket.accept()
+    hub.attach(asyncio.get_running_loop())
+    subscriber = Subscriber(websocket)
+    if not hub.add(subscriber):
+        await websocket.close(code=1013) # Try again later
+        return
+    tasks = [asyncio.create_task(subscriber.run_sender()), asyncio.create_task(_receive(websocket, subscriber))]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                logger.warning(f"Slot stream closed: {task.exception()}")
+    finally:
+        hub.discard(subscriber)
+        for task in tasks:
+            task.cancel()
+        try:
+            await websocket.close()
+        except Exception:
+            pass
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from sqlalchemy import text
+from .database import engine, SessionLocal
+from .config import settings
+
+logger = logging.getLogger("consulting_bot.warmup")
+
+# Readiness state reported by /ready
+_state = {
+    "ready": False,
+    "started_at": None,
+    "finished_at": None,
+    "steps": {},
+}
+
+# Steps that must succeed before the instance reports ready
+REQUIRED_STEPS = {"database"}
+
+def _warm_database():
+    # Opens the first pooled connection
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return "connected"
+
+def _warm_google():
+    # Refreshes the stored credentials and pre-parses the discovery documents
+    from .auth import get_credentials, build_google_service
+    db = SessionLocal()
+    try:
+        creds = get_credentials(db)
+    finally:
+        db.close()
+    if not creds:
+        return "skipped: no credentials"
+    build_google_service('calendar', 'v3', creds)
+    build_google_service('gmail', 'v1', creds)
+    return "ready"
+
+def _warm_gemini():
+    # Imports the SDK and runs model selection once
+    from . import gemini_client
+    name = gemini_client.warm_model()
+    return f"model: {name}" if name else "skipped: no model"
+
+def _warm_vonage():
+    from . import otp_client
+    return "ready" if otp_client.client else "skipped: not configured"
+
+def _warm_razorpay():
+    from . import payment
+    return "ready" if payment.client else "skipped: not configured"
+
+WARMUP_STEPS = {
+    "database": _warm_database,
+    "google": _warm_google,
+    "gemini": _warm_gemini,
+    "vonage": _warm_vonage,
+    "razorpay": _warm_razorpay,
+}
+
+async def _run_step(name: str, func, timeout: float):
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(asyncio.to_thread(func), timeout=timeout)
+        status = {"ok": True, "detail": result}
+    except asyncio.TimeoutError:
+        status = {"ok": False, "detail": f"timeout after {timeout}s"}
+    except Exception as e:
+        status = {"ok": False, "detail": f"error: {e}"}
+    status["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    _state["steps"][name] = status
+    if status["ok"]:
+        logger.info(f"Warm-up step '{name}' done in {status['duration_ms']}ms: {status['detail']}")
+    else:
+        logger.warning(f"Warm-up step '{name}' failed in {status['duration_ms']}ms: {status['detail']}")
+
+async def run_warmup(timeout: float = None):
+    """
+    Runs every warm-up step concurrently, each bounded by its own timeout.
+    The instance is marked ready once all required steps succeed.
+    """
+    timeout = timeout or settings.WARMUP_STEP_TIMEOUT
+    _state["ready"] = False
+    _state["started_at"] = time.time()
+    _state["steps"] = {}
+
+    await asyncio.gather(*(_run_step(name, func, timeout) for name, func in WARMUP_STEPS.items()))
+
+    _state["finished_at"] = time.time()
+    _state["ready"] = all(_state["steps"].get(name, {}).get("ok") for name in REQUIRED_STEPS)
+    logger.info(f"Warm-up finished in {_state['finished_at'] - _state['started_at']:.2f}s (ready={_state['ready']})")
+    return _state
+
+def mark_ready():
+    """Marks the instance ready without warming (warm-up disabled)."""
+    _state["ready"] = True
+
+def is_ready() -> bool:
+    return _state["ready"]
+
+def get_state():
+    return _state
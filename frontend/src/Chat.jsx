@@ -9,6 +9,7 @@ export default function Chat({ pushToast }) {
   const [input, setInput] = useState('')
   const [loading, setLoading] = useState(false)
   const [userId] = useState('visitor') // could be enhanced with auth/session
+  const conversationToken = useRef(null) // issued by /chat when server-side history is enabled
   const endRef = useRef(null)
 
   useEffect(() => { if(endRef.current){ endRef.current.scrollIntoView({ behavior: 'smooth' }) } }, [messages])
@@ -24,10 +25,11 @@ export default function Chat({ pushToast }) {
       const res = await fetch(BACKEND_URL + '/chat', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ message: trimmed, user_id: userId })
+        body: JSON.stringify({ message: trimmed, user_id: userId, conversation_token: conversationToken.current })
       })
       let data = null
       try { data = await res.json() } catch {}
+      if(data?.data?.conversation_token) conversationToken.current = data.data.conversation_token
       if(data && data.success && data.data && typeof data.data.response === 'string') {
         appendBot(data.data.response)
       } else {
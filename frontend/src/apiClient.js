@@ -1,21 +1,37 @@
 import { BACKEND_URL } from './config'
 
+// Last ETag and body per GET path, revalidated with If-None-Match
+const etagCache = new Map()
+
 async function jsonFetch(path, opts = {}) {
+	const isGet = !opts.method || opts.method === 'GET'
+	const cached = isGet ? etagCache.get(path) : null
 	const res = await fetch(BACKEND_URL + path, {
-		headers: { 'Content-Type': 'application/json' },
 		...opts,
+		headers: {
+			'Content-Type': 'application/json',
+			...(cached ? { 'If-None-Match': cached.etag } : {}),
+			...opts.headers,
+		},
 	})
+	if (res.status === 304 && cached) return { ok: true, status: 200, data: cached.data, notModified: true }
 	let data = null
 	try { data = await res.json() } catch { /* ignore non-JSON */ }
+	const etag = res.headers.get('ETag')
+	if (isGet && etag && data) etagCache.set(path, { etag, data })
 	return { ok: res.ok, status: res.status, data }
 }
 
+const query = (params) => new URLSearchParams(
+	Object.entries(params).flatMap(([k, v]) => v == null ? [] : Array.isArray(v) ? v.map(x => [k, x]) : [[k, v]])
+).toString()
+
 export const api = {
 	verify: () => jsonFetch('/verify'),
 	health: () => jsonFetch('/health'),
-	slotsGet: (payload) => jsonFetch('/slots/get', { method: 'POST', body: JSON.stringify(payload) }),
+	slotsGet: (params) => jsonFetch('/slots/get?' + query(params)),
 	appointmentCreate: (payload) => jsonFetch('/appointment/create', { method: 'POST', body: JSON.stringify(payload) }),
-	appointmentList: (user_email) => jsonFetch('/appointment/list?user_email=' + encodeURIComponent(user_email), { method: 'POST' }),
+	appointmentList: (user_email) => jsonFetch('/appointment/list?' + query({ user_email })),
 	appointmentCancel: (payload) => jsonFetch('/appointment/cancel', { method: 'POST', body: JSON.stringify(payload) }),
 	otpSend: (payload) => jsonFetch('/otp/send', { method: 'POST', body: JSON.stringify(payload) }),
 	otpVerify: (payload) => jsonFetch('/otp/verify', { method: 'POST', body: JSON.stringify(payload) }),
@@ -27,3 +43,64 @@ export const api = {
 	}
 }
 
+// Live availability over /ws/slots instead of re-polling /slots/get.
+// onSlots(slots) gets the full, current list for the range after every change.
+// Returns { update(range), close() }.
+export function subscribeSlots(range, onSlots, { onError } = {}) {
+	const url = BACKEND_URL.replace(/^http/, 'ws') + '/ws/slots'
+	let current = range
+	let slots = []
+	let socket = null
+	let closed = false
+	let retry = 1000
+
+	const inWindow = (slot, start, end) => new Date(slot.start) >= new Date(start) && new Date(slot.start) < new Date(end)
+	const byStart = (a, b) => new Date(a.start) - new Date(b.start)
+	const subscribe = () => socket.send(JSON.stringify({ action: 'subscribe', ...current }))
+
+	async function refetch(start, end) {
+		const { data } = await api.slotsGet({ time_min: start, time_max: end })
+		if (!data?.success) return
+		slots = slots.filter(s => !inWindow(s, start, end)).concat(data.data.slots).sort(byStart)
+		onSlots(slots)
+	}
+
+	function connect() {
+		socket = new WebSocket(url)
+		socket.onopen = () => { retry = 1000; subscribe() }
+		socket.onmessage = (event) => {
+			const msg = JSON.parse(event.data)
+			if (msg.type === 'snapshot') {
+				slots = msg.slots
+				onSlots(slots)
+			} else if (msg.type === 'delta') {
+				slots = slots.filter(s => !inWindow(s, msg.start, msg.end)).concat(msg.slots).sort(byStart)
+				onSlots(slots)
+			} else if (msg.type === 'invalidate') {
+				refetch(msg.start, msg.end)
+			} else if (msg.type === 'resync') {
+				subscribe()
+			} else if (msg.type === 'error') {
+				onError?.(msg.error)
+			}
+		}
+		socket.onclose = () => {
+			if (closed) return
+			// Reconnect with backoff; the new subscription starts with a fresh snapshot
+			setTimeout(connect, retry)
+			retry = Math.min(retry * 2, 30000)
+		}
+	}
+
+	connect()
+	return {
+		update(next) {
+			current = next
+			if (socket.readyState === WebSocket.OPEN) subscribe()
+		},
+		close() {
+			closed = true
+			socket.close()
+		},
+	}
+}